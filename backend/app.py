@@ -1,19 +1,34 @@
 import os
-import traceback
-from flask import Flask, request, jsonify
+import time
+import json
+import datetime
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from flask import Flask, Response, request, jsonify, stream_with_context, g
 from flask_cors import CORS
 import uuid
-from qdrant_client import QdrantClient
-from services.llm_service import generate_llm_response
-from services.qdrant_service import search_text, insert_point, retrieve_llm_responses_by_user,embed_text
-from pipeline.ai_pipeline import ai_pipeline
-from pipeline.ml_processing import _pipelines
-from utils.fetch import fetch_tickets
+from services.clients import qdrant_client, ping_qdrant, ping_openai
+from services.llm_service import generate_llm_response, stream_llm_response
+from services.qdrant_service import search_text, search_texts, insert_point, insert_points, retrieve_llm_responses_by_user, retrieve_llm_responses_by_users, embed_text, embed_texts, embedding_cache_stats
+from services.response_cache import response_cache_stats
+from services.prompt_builder import prompt_stats
+from services.openai_gateway import openai_gateway_stats
+from services.history_writer import history_writer, history_queue_stats, HISTORY_WRITE_BEHIND
+from pipeline.ai_pipeline import ai_pipeline, ai_pipeline_stream
+from pipeline.jobs import job_manager
+from pipeline.db_connector import ensure_ticket_payload_indexes
+from pipeline.inference_cache import get_inference_cache
+from pipeline.ticket_aggregates import get_ticket_aggregates
+from pipeline.ml_processing import _pipelines, model_stats, warmup_models, models_ready
+from utils.fetch import fetch_tickets_page, decode_offset, FILTER_FIELDS
+from utils.concurrency import submit, result_or_default
+from utils.metrics import metrics, render_prometheus
+from utils.log import get_logger
 import os
 from dotenv import load_dotenv
 load_dotenv()
 # OpenAI
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+OPENAI_CHAT_MODEL = os.getenv("OPENAI_CHAT_MODEL")
 # Qdrant
 QDRANT_URL = os.getenv("QDRANT_URL")
 QDRANT_API_KEY = os.getenv("QDRANT_API_KEY")
@@ -22,24 +37,101 @@ QDRANT_COLLECTION_2 = os.getenv("QDRANT_COLLECTION_2")
 QDRANT_COLLECTION_3 = os.getenv("QDRANT_COLLECTION_3")
 QDRANT_VECTOR_NAME = os.getenv("QDRANT_VECTOR_NAME")
 QDRANT_TOP_K = int(os.getenv("QDRANT_TOP_K", 3))
+# Per-step timeouts of the chat retrieval fan-out, a step that times out falls back to an empty list
+CHAT_DOCS_TIMEOUT_SECONDS = float(os.getenv("CHAT_DOCS_TIMEOUT_SECONDS", 10))
+CHAT_HISTORY_TIMEOUT_SECONDS = float(os.getenv("CHAT_HISTORY_TIMEOUT_SECONDS", 2))
+# /chat/batch: max tickets per call and concurrent LLM calls per batch
+CHAT_BATCH_MAX_ITEMS = int(os.getenv("CHAT_BATCH_MAX_ITEMS", 500))
+CHAT_BATCH_CONCURRENCY = int(os.getenv("CHAT_BATCH_CONCURRENCY", 8))
+# Page size bounds of /fetch
+FETCH_DEFAULT_LIMIT = int(os.getenv("FETCH_DEFAULT_LIMIT", 30))
+FETCH_MAX_LIMIT = int(os.getenv("FETCH_MAX_LIMIT", 500))
+# /ready: timeout of each dependency check, and how long a passed Qdrant/OpenAI check is reused
+READY_CHECK_TIMEOUT_SECONDS = float(os.getenv("READY_CHECK_TIMEOUT_SECONDS", 3))
+READY_CACHE_SECONDS = float(os.getenv("READY_CACHE_SECONDS", 30))
+# set by gunicorn.conf.py: the per-worker startup (init_worker) then runs after fork instead of at import
+DEFER_WORKER_INIT = os.getenv("DEFER_WORKER_INIT", "0") == "1"
+# development server started with `python app.py`
+PORT = int(os.getenv("PORT", 8081))
+FLASK_DEBUG = os.getenv("FLASK_DEBUG", "0") == "1"
 
 # CORS (frontend origin)
 VECTOR_NAME = QDRANT_VECTOR_NAME
 FRONTEND_ORIGIN=os.getenv("FRONTEND_ORIGIN")
 
+logger = get_logger("app")
+
 # Initialize the Flask application
 app = Flask(__name__)
-CORS(app)  # Enable CORS for all routes
+CORS(app, expose_headers=["X-Next-Page-Offset"])  # Enable CORS for all routes
+
+@app.before_request
+def _start_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def _record_request(response):
+    """
+    Request latency and count per route. Streaming responses (SSE, NDJSON) are measured up to the
+    first byte, their full duration is in the stage metrics.
+    """
+    started = getattr(g, "request_started", None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        metrics.observe("csc_http_request_duration_seconds", time.perf_counter() - started,
+                        route=route, method=request.method, status=response.status_code)
+    return response
+
+def _cache_stats() -> dict:
+    inference_cache = get_inference_cache()
+    response = response_cache_stats()
+    if response:
+        response = {**response, "hits": response["exact_hits"] + response["semantic_hits"]}
+    caches = {
+        "embedding": embedding_cache_stats(),
+        "response": response,
+        "inference": inference_cache.stats() if inference_cache else None,
+    }
+    return {name: stats for name, stats in caches.items() if stats}
+
+def _cache_hit_ratios():
+    return [({"cache": name}, stats.get("hit_rate")) for name, stats in _cache_stats().items()]
+
+def _cache_lookups():
+    return [
+        ({"cache": name, "result": result}, stats.get(result))
+        for name, stats in _cache_stats().items() for result in ("hits", "misses")
+    ]
+
+metrics.register_gauge("csc_cache_hit_ratio", "Hit rate of each cache since the process started", _cache_hit_ratios)
+metrics.register_gauge("csc_cache_lookups", "Cache hits and misses since the process started", _cache_lookups)
+metrics.register_gauge("csc_history_queue_depth", "Chat-history records waiting to be written",
+                       lambda: history_queue_stats().get("queue_depth"))
 
-# Initialize Qdrant client with error handling
+# payload indexes behind the /fetch filters
 try:
-    qdrant_client = QdrantClient(
-        url=os.getenv("QDRANT_URL"),
-        api_key=os.getenv("QDRANT_API_KEY")
-    )
+    ensure_ticket_payload_indexes()
 except Exception as e:
-    print(f"Warning: Could not initialize Qdrant client: {e}")
-    qdrant_client = None
+    logger.warning("Could not create ticket payload indexes: %s", e)
+
+def init_worker():
+    """
+    Startup of a serving process: warms up the loaded models, replays the chat-history spill file and
+    picks up ingest jobs interrupted by a crash or redeploy. Runs at import, or in each gunicorn worker
+    after fork (post_worker_init) so that no inference thread pool or job thread is started in the master.
+    """
+    warmup_models()
+    if HISTORY_WRITE_BEHIND:
+        history_writer.start()
+    try:
+        resumed_jobs = job_manager.resume()
+        if resumed_jobs:
+            logger.info("Resuming ingest jobs: %s", resumed_jobs)
+    except Exception as e:
+        logger.warning("Could not resume ingest jobs: %s", e)
+
+if not DEFER_WORKER_INIT:
+    init_worker()
 
 @app.route('/input', methods=['POST'])
 def handle_input():
@@ -47,7 +139,10 @@ def handle_input():
     Handles incoming JSON data from the frontend, processes it through the AI pipeline, and returns the results.
     Used when the application calls the /input endpoint with a POST request containing JSON data.
     The "+ Upload Json" button on the frontend triggers this endpoint.
+    Uploads sent as NDJSON (Content-Type: application/x-ndjson) are streamed, see _handle_ndjson_input.
     """
+    if request.mimetype in NDJSON_MIMETYPES:
+        return _handle_ndjson_input()
     try:
         data = request.json
         if not isinstance(data, list):
@@ -63,17 +158,161 @@ def handle_input():
 
     except Exception as e:
         # Catch any exceptions during request parsing or pipeline execution
-        print("An error occurred:")
-        traceback.print_exc() # This will print the full traceback to your terminal
+        logger.exception("An error occurred: %s", e)
+        return jsonify({"error": "Internal server error. Check the server logs for details."}), 500
+
+def _retrieve_context(text: str, user_id: str):
+    """
+    Embeds the query once and runs the retrieval steps of the chat path.
+    The docs search and the history lookup only depend on the query vector, so they run concurrently
+    on the shared I/O executor, each with its own timeout. Missing docs or history fall back to [].
+    Returns (query_vector, search_results, previous_responses).
+    """
+    top_k = 3
+    # embed once, the vector is shared by the docs search, the history lookup and the history write
+    query_vector = embed_text(text)
+
+    docs_future = submit(search_text, query=text, k=top_k, query_vector=query_vector)
+    history_future = submit(
+        retrieve_llm_responses_by_user,
+        client=qdrant_client, user_id=user_id, input_text=text, query_vector=query_vector
+    )
+
+    search_results = result_or_default(docs_future, CHAT_DOCS_TIMEOUT_SECONDS, [], "docs search")
+    previous_responses = result_or_default(history_future, CHAT_HISTORY_TIMEOUT_SECONDS, [], "history lookup")
+
+    return query_vector, search_results, previous_responses
+
+def _save_history(user_id: str, text: str, llm_response: str, query_vector):
+    """
+    Queues the chat-history record on the write-behind queue, or writes it synchronously
+    when write-behind is disabled or the queue is full.
+    """
+    if HISTORY_WRITE_BEHIND and history_writer.enqueue(user_id, text, llm_response, vector=query_vector):
+        return
+    try:
+        insert_point(
+            client=qdrant_client,
+            user_id=user_id,
+            input_text=text,
+            llm_response=llm_response,
+            vector=query_vector
+        )
+    except Exception as insert_error:
+        logger.exception("Failed to insert Qdrant point: %s", insert_error)
+
+def _retrieve_context_batch(texts: list, user_ids: list):
+    """
+    Batched _retrieve_context: embeds every query in one embeddings request, then runs the docs search
+    and the history lookup as one Qdrant batch query each, concurrently, with the /chat timeouts.
+    Returns (query_vectors, search_results, previous_responses), one entry per text.
+    """
+    top_k = 3
+    query_vectors = embed_texts(texts)
+
+    docs_future = submit(search_texts, queries=texts, k=top_k, query_vectors=query_vectors)
+    history_future = submit(
+        retrieve_llm_responses_by_users,
+        client=qdrant_client, user_ids=user_ids, input_texts=texts, query_vectors=query_vectors
+    )
+
+    empty = [[] for _ in texts]
+    search_results = result_or_default(docs_future, CHAT_DOCS_TIMEOUT_SECONDS, empty, "batch docs search")
+    previous_responses = result_or_default(history_future, CHAT_HISTORY_TIMEOUT_SECONDS, empty, "batch history lookup")
+
+    return query_vectors, search_results, previous_responses
+
+def _save_histories(records: list):
+    """
+    Bulk _save_history for (user_id, text, llm_response, query_vector) tuples: queued on the write-behind
+    queue, and whatever it does not take is written with one bulk upsert.
+    """
+    if HISTORY_WRITE_BEHIND:
+        records = [r for r in records if not history_writer.enqueue(*r[:3], vector=r[3])]
+    if not records:
+        return
+    created_at = datetime.datetime.utcnow().isoformat()
+    try:
+        insert_points(qdrant_client, [
+            {"point_id": str(uuid.uuid4()), "user_id": user_id, "input_text": text,
+             "llm_response": llm_response, "created_at": created_at, "vector": vector}
+            for user_id, text, llm_response, vector in records
+        ])
+    except Exception as insert_error:
+        logger.exception("Failed to insert Qdrant points: %s", insert_error)
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+NDJSON_MIMETYPES = ("application/x-ndjson", "application/jsonl")
+
+def _iter_ndjson(stream):
+    """
+    Yields one parsed object per non-empty line of stream, or a ValueError for a line that is not valid JSON.
+    """
+    for line_no, line in enumerate(stream, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            yield ValueError(f"Invalid JSON on line {line_no}")
+
+def _handle_ndjson_input():
+    """
+    Streaming mode of /input: tickets are read line by line from the request body (plain or chunked
+    transfer) and go through ai_pipeline_stream in micro-batches, each per-ticket {"id", "status"} or
+    {"id", "error"} result is written back as one NDJSON line as soon as it is done.
+    The status code is always 200 since it is sent before any ticket is processed.
+    """
+    stream = request.stream
+
+    def results():
+        for result in ai_pipeline_stream(_iter_ndjson(stream)):
+            yield json.dumps(result) + "\n"
+
+    return Response(stream_with_context(results()), mimetype="application/x-ndjson")
+
+@app.route('/input/jobs', methods=['POST'])
+def submit_input_job():
+    """
+    Job-based variant of /input for large uploads. Takes the same JSON list, queues it on the local
+    ingest worker pool and returns 202 with the job ID straight away.
+    """
+    try:
+        data = request.json
+        if not isinstance(data, list) or not all(isinstance(item, dict) for item in data):
+            return jsonify({"error": "Invalid JSON format. Expected a list of objects."}), 400
+
+        job_id = job_manager.submit(data)
+        return jsonify({"job_id": job_id, "status_url": f"/input/jobs/{job_id}"}), 202
+
+    except Exception as e:
+        logger.exception("An error occurred: %s", e)
         return jsonify({"error": "Internal server error. Check the server logs for details."}), 500
 
+@app.route('/input/jobs/<job_id>', methods=['GET'])
+def input_job_status(job_id):
+    """
+    Status of an ingest job: status, total, processed, failed and the per-item {"id", "status"/"error"} results.
+    Pass ?results=0 to get only the progress counters.
+    """
+    status = job_manager.status(job_id, include_results=request.args.get("results", "1") != "0")
+    if status is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(status)
+
 @app.route("/chat", methods=["POST"])
 def chat():
     """
     Handles chat requests from the frontend, interacts with the LLM and Qdrant to generate responses.
     Expects a JSON payload with 'text' and 'user_id'.
     Returns the LLM response and cited URLs.
+    Requests sent with "Accept: text/event-stream" get the streaming response of /chat/stream.
     """
+    if "text/event-stream" in request.headers.get("Accept", ""):
+        return chat_stream()
     try:
         data = request.get_json() or {}
         text = data.get("text", "").strip()
@@ -82,22 +321,14 @@ def chat():
         if not text:
             return jsonify({"error": "No text provided"}), 400
         
-        top_k = 3
-        search_results = search_text(query=text, k=top_k)
-        # print(search_results) -> for debugging
-
-        try : 
-            previous_responses = retrieve_llm_responses_by_user(client=qdrant_client,user_id=user_id,input_text=text)
-            # print("we got the prev responses") -> for debugging
-        except Exception as e:
-            previous_responses=[]
-            # print("cant load prev responses endpoint error:", e)
+        query_vector, search_results, previous_responses = _retrieve_context(text, user_id)
 
         if previous_responses:
             llm_output = generate_llm_response(
                 user_text=text,
                 responses=previous_responses,
-                results=search_results
+                results=search_results,
+                query_vector=query_vector
             )
         else:
             
@@ -105,10 +336,12 @@ def chat():
                 user_text=text,
                 responses=[],  
                 results=search_results,
+                query_vector=query_vector
             )
 
         llm_response = llm_output.get("LLM_Response", "")
         cited_urls = llm_output.get("Cited_URLs", [])
+        llm_failed = "error" in llm_output
 
         metadata = {
                 "user_id": user_id,
@@ -118,16 +351,8 @@ def chat():
                 "timestamp": str(uuid.uuid1().time) 
             }
         
-        try:
-            insert_point(
-                client=qdrant_client,
-                user_id=user_id,
-                input_text=text,
-                llm_response=llm_response
-            )
-        except Exception as insert_error:
-            print("Failed to insert Qdrant point:", traceback.format_exc())
-            print("Insert error details:", str(insert_error))
+        if not llm_failed:
+            _save_history(user_id, text, llm_response, query_vector)
 
         response_data = {
             "user_id": user_id,
@@ -137,10 +362,123 @@ def chat():
         return jsonify(response_data)
         
     except Exception as e:
-        print("Chat endpoint error:", e)
-        traceback.print_exc()
+        logger.exception("Chat endpoint error: %s", e)
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/chat/batch", methods=["POST"])
+def chat_batch():
+    """
+    Answers many chat queries in one call, e.g. for triaging open tickets.
+    Expects a JSON list of {"text", "user_id"} objects (at most CHAT_BATCH_MAX_ITEMS).
+    All queries are embedded in one embeddings request, the docs and history lookups run as Qdrant batch
+    queries, and the LLM calls run CHAT_BATCH_CONCURRENCY at a time.
+    Returns a list in input order with the /chat response ({"user_id", "LLM_Response", "Cited_URLs"}) of
+    each item, or {"user_id", "error"} for items that failed; the chat history is written in bulk.
+    """
+    try:
+        data = request.get_json(silent=True)
+        if not isinstance(data, list) or not all(isinstance(item, dict) for item in data):
+            return jsonify({"error": "Invalid JSON format. Expected a list of objects."}), 400
+        if len(data) > CHAT_BATCH_MAX_ITEMS:
+            return jsonify({"error": f"At most {CHAT_BATCH_MAX_ITEMS} items per batch"}), 400
+
+        items = [(str(item.get("text") or "").strip(), str(item.get("user_id") or "").strip()) for item in data]
+        results = [{"user_id": user_id, "error": "No text provided"} for _, user_id in items]
+        valid = [i for i, (text, _) in enumerate(items) if text]
+        if not valid:
+            return jsonify(results)
+
+        texts = [items[i][0] for i in valid]
+        user_ids = [items[i][1] for i in valid]
+        query_vectors, search_results, previous_responses = _retrieve_context_batch(texts, user_ids)
+
+        def answer(j):
+            return generate_llm_response(
+                user_text=texts[j],
+                responses=previous_responses[j],
+                results=search_results[j],
+                query_vector=query_vectors[j]
+            )
+
+        history = []
+        with ThreadPoolExecutor(max_workers=max(1, min(CHAT_BATCH_CONCURRENCY, len(valid))),
+                                thread_name_prefix="chat-batch") as pool:
+            futures = [pool.submit(answer, j) for j in range(len(valid))]
+            for j, (i, future) in enumerate(zip(valid, futures)):
+                try:
+                    llm_output = future.result()
+                    if "error" in llm_output:
+                        raise RuntimeError(llm_output["error"])
+                except Exception as e:
+                    logger.warning("Chat batch item %s failed: %s", i, e)
+                    results[i] = {"user_id": user_ids[j], "error": str(e)}
+                    continue
+                llm_response = llm_output.get("LLM_Response", "")
+                results[i] = {
+                    "user_id": user_ids[j],
+                    "LLM_Response": llm_response,
+                    "Cited_URLs": llm_output.get("Cited_URLs", [])
+                }
+                history.append((user_ids[j], texts[j], llm_response, query_vectors[j]))
+
+        _save_histories(history)
+        return jsonify(results)
+
+    except Exception as e:
+        logger.exception("Chat batch endpoint error: %s", e)
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/chat/stream", methods=["POST"])
+def chat_stream():
+    """
+    Streaming variant of /chat using Server-Sent Events. Same JSON payload as /chat.
+    Sends "token" events ({"text": ...}) with the LLM_Response as it is generated, then one "done" event
+    with {"user_id", "LLM_Response", "Cited_URLs"} (or an "error" event).
+    The chat history is written after the stream has been closed.
+    """
+    try:
+        data = request.get_json() or {}
+        text = data.get("text", "").strip()
+        user_id = data.get("user_id", "").strip()
+
+        if not text:
+            return jsonify({"error": "No text provided"}), 400
+
+        query_vector, search_results, previous_responses = _retrieve_context(text, user_id)
+    except Exception as e:
+        logger.exception("Chat stream endpoint error: %s", e)
         return jsonify({"error": str(e)}), 500
 
+    final = {}
+
+    def events():
+        for event in stream_llm_response(
+            user_text=text,
+            responses=previous_responses,
+            results=search_results,
+            query_vector=query_vector
+        ):
+            if event["type"] == "token":
+                yield _sse("token", {"text": event["text"]})
+                continue
+            if event["type"] == "done":
+                final["LLM_Response"] = event.get("LLM_Response", "")
+            yield _sse(event["type"], {
+                "user_id": user_id,
+                "LLM_Response": event.get("LLM_Response", ""),
+                "Cited_URLs": event.get("Cited_URLs", [])
+            })
+
+    def save_history():
+        if final.get("LLM_Response"):
+            _save_history(user_id, text, final["LLM_Response"], query_vector)
+
+    response = Response(events(), mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    response.call_on_close(save_history)
+    return response
+
 @app.route("/health", methods=['GET'])
 def health_check():
     """
@@ -148,23 +486,182 @@ def health_check():
     Often helps in debugging. Returns a simple JSON response."""
     return jsonify({"status": "healthy", "message": "Server is running"})
 
+# monotonic time of the last passed check of each dependency, and the checks still running
+_ready_since = {}
+_ready_pending = {}
+
+def _check_dependencies(checks: dict) -> dict:
+    """
+    Runs the dependency checks ({name: callable raising when not ready}) concurrently, each bounded by
+    READY_CHECK_TIMEOUT_SECONDS; a passed check is reused for READY_CACHE_SECONDS, and a check that is
+    still running from an earlier probe is awaited instead of started again.
+    Returns {name: "ready" | "timeout" | "error: ..."}.
+    """
+    now = time.monotonic()
+    futures = {}
+    for name, check in checks.items():
+        if now - _ready_since.get(name, float("-inf")) < READY_CACHE_SECONDS:
+            continue
+        future = _ready_pending.get(name)
+        if future is None or future.done():
+            future = _ready_pending[name] = submit(check)
+        futures[name] = future
+    results = {name: "ready" for name in checks if name not in futures}
+    for name, future in futures.items():
+        try:
+            future.result(timeout=READY_CHECK_TIMEOUT_SECONDS)
+        except FutureTimeoutError:
+            results[name] = "timeout"
+            continue
+        except Exception as e:
+            results[name] = f"error: {e}"
+            continue
+        _ready_since[name] = time.monotonic()
+        results[name] = "ready"
+    return results
+
+@app.route("/ready", methods=['GET'])
+def readiness_check():
+    """
+    Readiness probe: 200 only once this process can serve traffic, i.e. Qdrant answers and has the
+    docs, tickets and history collections, the OpenAI API accepts the key and chat model, and every
+    eager model is loaded and warmed up. 503 otherwise, with the state of each check.
+    /health stays a liveness probe and does not look at any of this.
+    """
+    models = models_ready()
+    checks = _check_dependencies({
+        "qdrant": lambda: ping_qdrant([QDRANT_COLLECTION, QDRANT_COLLECTION_2, QDRANT_COLLECTION_3]),
+        "openai": lambda: ping_openai(OPENAI_CHAT_MODEL, timeout=READY_CHECK_TIMEOUT_SECONDS),
+    })
+    ready = all(state == "ready" for state in checks.values()) and \
+        all(state in ("ready", "lazy") for state in models.values())
+    body = {"status": "ready" if ready else "not ready", "checks": checks, "models": models}
+    return jsonify(body), 200 if ready else 503
+
+@app.route("/cache/stats", methods=['GET'])
+def cache_stats():
+    """
+    Hit rates of the embedding, LLM response and model inference caches, plus the LLM latency saved by response cache hits.
+    """
+    inference_cache = get_inference_cache()
+    return jsonify({
+        "embedding_cache": embedding_cache_stats(),
+        "response_cache": response_cache_stats(),
+        "inference_cache": inference_cache.stats() if inference_cache else None
+    })
+
+@app.route("/models/stats", methods=['GET'])
+def models_stats():
+    """
+    Load state, load time and memory of each Hugging Face model.
+    """
+    return jsonify(model_stats())
+
+@app.route("/metrics", methods=['GET'])
+def prometheus_metrics():
+    """
+    Prometheus metrics of this process: request and per-stage latency histograms, stage error counters,
+    OpenAI token counters, cache hit rates and fallback counters.
+    """
+    return Response(render_prometheus(), mimetype="text/plain; version=0.0.4")
+
+@app.route("/openai/stats", methods=['GET'])
+def openai_stats():
+    """
+    OpenAI gateway counters of this process: calls, upstream calls, coalesced calls, retries, 429s,
+    failures, rate-limit queue timeouts and calls in flight.
+    """
+    return jsonify(openai_gateway_stats())
+
+@app.route("/prompt/stats", methods=['GET'])
+def prompt_token_stats():
+    """
+    Average prompt size per chat request (docs, history, dropped chunks) and prompt tokens served from the OpenAI cache.
+    """
+    return jsonify(prompt_stats.stats())
+
+@app.route("/history/stats", methods=['GET'])
+def history_stats():
+    """
+    Depth, throughput and flush latency of the chat-history write-behind queue.
+    """
+    return jsonify(history_queue_stats())
+
+@app.route("/aggregates", methods=['GET'])
+def aggregates():
+    """
+    Ticket counts by priority, topics and sentiment, overall and per created_at bucket.
+    Query parameters, all optional:
+    - bucket: day (default), week or month
+    - from, to: ISO dates bounding created_at (inclusive)
+    Served from counters updated at ingest, run `python -m pipeline.ticket_aggregates rebuild` to recompute them.
+    """
+    ticket_aggregates = get_ticket_aggregates()
+    if ticket_aggregates is None:
+        return jsonify({"error": "Ticket aggregates are disabled"}), 404
+    try:
+        return jsonify(ticket_aggregates.summary(
+            bucket=request.args.get("bucket", "day"),
+            date_from=request.args.get("from"),
+            date_to=request.args.get("to")
+        ))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+def _csv_arg(name: str):
+    value = request.args.get(name, "")
+    return [v.strip() for v in value.split(",") if v.strip()]
+
 @app.route("/fetch",  methods=['GET', 'POST'])
-def get_tickets(limit: int = 30):
+def get_tickets():
     """
     Fetches ticket points from the Qdrant collection and returns them to the frontend.
     /fetch endpoint can be called with a GET or POST request.
-    Accepts an optional 'limit' query parameter to specify the number of tickets to fetch (default is 30).
+    Query parameters, all optional:
+    - limit: number of tickets per page (default 30, max FETCH_MAX_LIMIT)
+    - offset: the X-Next-Page-Offset header of the previous page
+    - priority, topics, sentiment: comma separated values to filter on
+    - created_from, created_to: ISO datetimes bounding created_at
+    - fields: comma separated payload fields to return, e.g. id,subject,priority for list views
+    The body is the list of tickets; X-Next-Page-Offset holds the cursor of the next page and is absent on the last page.
     """
     try:
-        tickets = fetch_tickets(limit)
-        return jsonify(tickets)
+        limit = min(max(int(request.args.get("limit", FETCH_DEFAULT_LIMIT)), 1), FETCH_MAX_LIMIT)
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+
+    filters = {field: _csv_arg(field) for field in FILTER_FIELDS}
+    for bound in ("created_from", "created_to"):
+        raw = request.args.get(bound)
+        try:
+            filters[bound] = datetime.datetime.fromisoformat(raw) if raw else None
+        except ValueError:
+            return jsonify({"error": f"{bound} must be an ISO datetime"}), 400
+    try:
+        offset = decode_offset(request.args.get("offset"))
+    except ValueError:
+        return jsonify({"error": "offset must be the X-Next-Page-Offset of a previous page"}), 400
+
+    try:
+        page = fetch_tickets_page(
+            limit=limit,
+            offset=offset,
+            filters=filters,
+            fields=_csv_arg("fields") or None
+        )
+        response = jsonify(page["tickets"])
+        if page["next_page_offset"] is not None:
+            response.headers["X-Next-Page-Offset"] = page["next_page_offset"]
+        return response
     except Exception as e:
-        print(f"Error fetching tickets: {e}")
+        logger.exception("Error fetching tickets: %s", e)
+        return jsonify({"error": "Could not fetch tickets"}), 500
 
 if __name__ == '__main__':
     """
-    Backend runs on port 8081
+    Development server, backend runs on port 8081 (PORT). Set FLASK_DEBUG=1 for the reloader and debugger.
+    In production run gunicorn with gunicorn.conf.py instead: gunicorn -c gunicorn.conf.py wsgi:app
     """
-    app.run(port=8081, debug=True)
+    app.run(port=PORT, debug=FLASK_DEBUG)
 
 
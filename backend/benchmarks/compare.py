@@ -0,0 +1,37 @@
+import sys
+import json
+
+METRICS = [("throughput_rps", "req/s"), ("p50_ms", "p50"), ("p95_ms", "p95"), ("p99_ms", "p99")]
+
+
+def _value(endpoint: dict, metric: str):
+    if metric == "throughput_rps":
+        return endpoint.get(metric)
+    return (endpoint.get("latency") or {}).get(metric)
+
+
+def compare(old: dict, new: dict) -> list:
+    """
+    One line per endpoint and metric present in both runs: old value, new value and relative change.
+    """
+    lines = [f"{old.get('commit')} -> {new.get('commit')}"]
+    for name, new_endpoint in new.get("endpoints", {}).items():
+        old_endpoint = old.get("endpoints", {}).get(name)
+        if old_endpoint is None:
+            continue
+        for metric, label in METRICS:
+            before, after = _value(old_endpoint, metric), _value(new_endpoint, metric)
+            if before is None or after is None:
+                continue
+            change = f"{(after - before) / before * 100:+.1f}%" if before else "n/a"
+            lines.append(f"{name:12} {label:6} {before:10.2f} {after:10.2f} {change:>8}")
+    return lines
+
+
+if __name__ == "__main__":
+    # python -m benchmarks.compare old.json new.json
+    if len(sys.argv) != 3:
+        print("usage: python -m benchmarks.compare old.json new.json")
+        sys.exit(1)
+    with open(sys.argv[1]) as f_old, open(sys.argv[2]) as f_new:
+        print("\n".join(compare(json.load(f_old), json.load(f_new))))
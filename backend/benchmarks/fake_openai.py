@@ -0,0 +1,173 @@
+import re
+import json
+import time
+import hashlib
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+
+
+def fake_embedding(text: str, dim: int) -> list:
+    """
+    Deterministic unit vector for text, the same on every run and in every process.
+    """
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(dim)
+    return (vector / np.linalg.norm(vector)).astype(float).tolist()
+
+
+def fake_answer(messages: list) -> str:
+    """
+    Deterministic completion in the [{"LLM_Response", "Cited_URLs"}] envelope the app expects,
+    citing the URLs found in the DOCS of the prompt.
+    """
+    prompt = "\n".join(str(m.get("content", "")) for m in messages)
+    urls = list(dict.fromkeys(re.findall(r":::(\S+?):::FINISH", prompt)))
+    digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:8]
+    answer = (f"Benchmark answer {digest}. Open the settings page, select the connector, "
+              f"check the credentials and run the sync again. See the linked documentation for details.")
+    return json.dumps([{"LLM_Response": answer, "Cited_URLs": urls}])
+
+
+class FakeOpenAIServer:
+    """
+    Local stand-in for the OpenAI embeddings and chat completions endpoints (including stream=True),
+    with configurable latency:
+    - embed_latency_ms + embed_per_input_ms * len(input) per embeddings call
+    - chat_latency_ms before the first token, then token_latency_ms per streamed token
+      (a non-streamed completion takes the whole time before answering)
+    Point the OpenAI SDK at it with OPENAI_BASE_URL=<server.base_url>.
+    """
+
+    def __init__(self, port: int = 0, dim: int = 256, embed_latency_ms: float = 20,
+                 embed_per_input_ms: float = 0.05, chat_latency_ms: float = 300, token_latency_ms: float = 5):
+        self.dim = dim
+        self.embed_latency_ms = embed_latency_ms
+        self.embed_per_input_ms = embed_per_input_ms
+        self.chat_latency_ms = chat_latency_ms
+        self.token_latency_ms = token_latency_ms
+        self.calls = {"embeddings": 0, "embedded_inputs": 0, "chat": 0}
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}/v1"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _count(self, **counts):
+        with self._lock:
+            for key, value in counts.items():
+                self.calls[key] += value
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                if self.path.endswith("/embeddings"):
+                    self._embeddings(body)
+                elif self.path.endswith("/chat/completions"):
+                    self._chat(body)
+                else:
+                    self._json(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+            def _json(self, status: int, payload: dict):
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _embeddings(self, body: dict):
+                inputs = body.get("input")
+                inputs = [inputs] if isinstance(inputs, str) else list(inputs or [])
+                fake._count(embeddings=1, embedded_inputs=len(inputs))
+                time.sleep((fake.embed_latency_ms + fake.embed_per_input_ms * len(inputs)) / 1000)
+                self._json(200, {
+                    "object": "list",
+                    "data": [{"object": "embedding", "index": i, "embedding": fake_embedding(text, fake.dim)}
+                             for i, text in enumerate(inputs)],
+                    "model": body.get("model") or "fake-embedding",
+                    "usage": {"prompt_tokens": sum(len(t) // 4 for t in inputs),
+                              "total_tokens": sum(len(t) // 4 for t in inputs)},
+                })
+
+            def _chat(self, body: dict):
+                fake._count(chat=1)
+                messages = body.get("messages") or []
+                content = fake_answer(messages)
+                prompt_tokens = sum(len(str(m.get("content", ""))) // 4 for m in messages)
+                # split into ~4 character tokens so the stream has realistic chunk sizes
+                tokens = re.findall(r".{1,4}", content, flags=re.DOTALL)
+                usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(tokens),
+                         "total_tokens": prompt_tokens + len(tokens),
+                         "prompt_tokens_details": {"cached_tokens": 0}}
+                base = {"id": "chatcmpl-fake", "created": int(time.time()), "model": body.get("model") or "fake-chat"}
+                time.sleep(fake.chat_latency_ms / 1000)
+
+                if not body.get("stream"):
+                    time.sleep(fake.token_latency_ms * len(tokens) / 1000)
+                    self._json(200, {**base, "object": "chat.completion", "usage": usage, "choices": [{
+                        "index": 0, "finish_reason": "stop",
+                        "message": {"role": "assistant", "content": content},
+                    }]})
+                    return
+
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                self.close_connection = True
+
+                def send(chunk: dict):
+                    self.wfile.write(f"data: {json.dumps({**base, 'object': 'chat.completion.chunk', **chunk})}\n\n".encode("utf-8"))
+                    self.wfile.flush()
+
+                for token in tokens:
+                    send({"choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}]})
+                    time.sleep(fake.token_latency_ms / 1000)
+                send({"choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+                if (body.get("stream_options") or {}).get("include_usage"):
+                    send({"choices": [], "usage": usage})
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+
+        return Handler
+
+
+if __name__ == "__main__":
+    # python -m benchmarks.fake_openai --port 8099, then run the app with OPENAI_BASE_URL=http://127.0.0.1:8099/v1
+    parser = argparse.ArgumentParser(description="Fake OpenAI server for offline benchmarks")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--embed-latency-ms", type=float, default=20)
+    parser.add_argument("--chat-latency-ms", type=float, default=300)
+    parser.add_argument("--token-latency-ms", type=float, default=5)
+    args = parser.parse_args()
+    server = FakeOpenAIServer(args.port, args.dim, args.embed_latency_ms, chat_latency_ms=args.chat_latency_ms,
+                              token_latency_ms=args.token_latency_ms)
+    print(f"Fake OpenAI server on {server.base_url}")
+    server.start()
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.stop()
@@ -0,0 +1,352 @@
+"""
+Offline end-to-end benchmark of /chat, /chat/stream, /input and /fetch.
+
+    cd backend && python -m benchmarks.run --requests 200 --concurrency 8
+    python -m benchmarks.compare benchmarks/results/<old>.json benchmarks/results/<new>.json
+
+OpenAI is replaced by a local fake server (benchmarks/fake_openai.py), Qdrant by an in-memory instance
+(or a local server with --qdrant-url) seeded with docs, history and tickets, and the Hugging Face models
+by stub pipelines (benchmarks/stub_models.py) unless --real-models is given.
+Results are written as JSON to benchmarks/results/ so runs can be compared across commits.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import datetime
+import tempfile
+import threading
+import subprocess
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+from .fake_openai import FakeOpenAIServer, fake_embedding
+
+ENDPOINTS = ("chat", "chat_stream", "chat_batch", "input", "fetch")
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+WORDS = ("connector sync schedule failed snowflake lineage glossary classification policy masking "
+         "login sso saml okta token api sdk python permission role access domain asset catalog "
+         "dashboard tableau export bulk upload error timeout slow query column tag owner").split()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline end-to-end benchmark of the Flask app")
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS), help="comma separated subset of " + ", ".join(ENDPOINTS))
+    parser.add_argument("--requests", type=int, default=100, help="measured requests per endpoint")
+    parser.add_argument("--warmup", type=int, default=5, help="unmeasured requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--input-batch", type=int, default=32, help="tickets per /input request")
+    parser.add_argument("--chat-batch", type=int, default=32, help="queries per /chat/batch request")
+    parser.add_argument("--docs", type=int, default=2000, help="doc chunks seeded in QDRANT_COLLECTION")
+    parser.add_argument("--tickets", type=int, default=2000, help="tickets seeded in QDRANT_COLLECTION_2")
+    parser.add_argument("--users", type=int, default=20, help="distinct chat users (history is per user)")
+    parser.add_argument("--dim", type=int, default=256, help="embedding dimension of the fake OpenAI server")
+    parser.add_argument("--embed-latency-ms", type=float, default=20)
+    parser.add_argument("--chat-latency-ms", type=float, default=300, help="time to first token")
+    parser.add_argument("--token-latency-ms", type=float, default=5)
+    parser.add_argument("--model-batch-latency-ms", type=float, default=5)
+    parser.add_argument("--model-item-latency-ms", type=float, default=2)
+    parser.add_argument("--real-models", action="store_true", help="load the configured Hugging Face models instead of stubs")
+    parser.add_argument("--qdrant-url", help="use a local Qdrant server (collections are recreated) instead of :memory:")
+    parser.add_argument("--response-cache", action="store_true", help="keep the chat response cache enabled")
+    parser.add_argument("--inference-cache", action="store_true", help="keep the ticket inference cache enabled")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", help="result file (default benchmarks/results/<timestamp>_<commit>.json)")
+    return parser.parse_args(argv)
+
+
+def configure_env(args, fake_openai: FakeOpenAIServer, workdir: str):
+    """
+    Points every module at the stand-ins. Must run before the app is imported, config is read at import.
+    """
+    env = {
+        "OPENAI_API_KEY": "benchmark",
+        "OPENAI_BASE_URL": fake_openai.base_url,
+        "OPENAI_CHAT_MODEL": "benchmark-chat",
+        "OPENAI_EMBEDDING_MODEL": "benchmark-embedding",
+        "QDRANT_COLLECTION": "bench_docs",
+        "QDRANT_COLLECTION_2": "bench_tickets",
+        "QDRANT_COLLECTION_3": "bench_history",
+        "QDRANT_VECTOR_NAME": "text",
+        "MODEL_LOAD_MODE": "eager" if args.real_models else "lazy",
+        "RESPONSE_CACHE_ENABLED": "1" if args.response_cache else "0",
+        "INFERENCE_CACHE_ENABLED": "1" if args.inference_cache else "0",
+        "INFERENCE_CACHE_PATH": os.path.join(workdir, "inference_cache.sqlite3"),
+        "TICKET_AGGREGATES_PATH": os.path.join(workdir, "ticket_aggregates.sqlite3"),
+        "INGEST_JOB_DIR": os.path.join(workdir, "ingest_jobs"),
+        "HISTORY_SPILL_PATH": os.path.join(workdir, "history_spill.jsonl"),
+        "EMBEDDING_STORE_PATH": "",
+        "QDRANT_UPSERT_FLUSH_SECONDS": "0.2",
+    }
+    if args.qdrant_url:
+        env["QDRANT_URL"] = args.qdrant_url
+        env["QDRANT_LOCATION"] = ""
+    else:
+        env["QDRANT_LOCATION"] = ":memory:"
+    os.environ.update(env)
+
+
+def random_text(rng: random.Random, n: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(n))
+
+
+def seed_qdrant(args, rng: random.Random):
+    from qdrant_client import models
+    from services.clients import get_qdrant_client
+    from pipeline.db_connector import build_ticket_point
+
+    client = get_qdrant_client()
+    docs, tickets, history = (os.environ[k] for k in ("QDRANT_COLLECTION", "QDRANT_COLLECTION_2", "QDRANT_COLLECTION_3"))
+    vector_params = models.VectorParams(size=args.dim, distance=models.Distance.COSINE)
+    for name in (docs, tickets, history):
+        if client.collection_exists(name):
+            client.delete_collection(name)
+    client.create_collection(docs, vectors_config={os.environ["QDRANT_VECTOR_NAME"]: vector_params})
+    client.create_collection(tickets, vectors_config=vector_params)
+    client.create_collection(history, vectors_config=vector_params)
+    client.create_payload_index(history, "user_id", models.PayloadSchemaType.KEYWORD)
+
+    points = []
+    for i in range(args.docs):
+        text = random_text(rng, 60)
+        points.append(models.PointStruct(
+            id=i,
+            vector={os.environ["QDRANT_VECTOR_NAME"]: fake_embedding(text, args.dim)},
+            payload={"text": text, "url": f"https://docs.example.com/page-{i // 4}",
+                     "url_id": f"page-{i // 4}", "parent_id": f"section-{i // 2}"}
+        ))
+    for start in range(0, len(points), 500):
+        client.upsert(docs, points[start:start + 500])
+
+    points = []
+    for i in range(args.users * 5):
+        text = random_text(rng, 12)
+        points.append(models.PointStruct(
+            id=i, vector=fake_embedding(text, args.dim),
+            payload={"user_id": f"bench-user-{i % args.users}", "input_text": text,
+                     "llm_response": random_text(rng, 40), "created_at": datetime.datetime.utcnow().isoformat()}
+        ))
+    client.upsert(history, points)
+
+    points = []
+    for i in range(args.tickets):
+        subject, body = random_text(rng, 8), random_text(rng, 50)
+        points.append(build_ticket_point(
+            ticket_id=f"SEED-{i}", subject=subject, body=body, priority=rng.choice(["P0", "P1", "P2"]),
+            topics=rng.choice(["Connector", "SSO", "API/SDK"]), keywords="seed", sentiment="Curious",
+            created_at=datetime.datetime.now() - datetime.timedelta(days=rng.randrange(90)),
+            vector=fake_embedding(f"{subject} {body}", args.dim)
+        ))
+    for start in range(0, len(points), 500):
+        client.upsert(tickets, points[start:start + 500])
+
+
+class StageRecorder:
+    """Wall time of each instrumented function, per stage name."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = defaultdict(list)
+
+    def reset(self):
+        with self._lock:
+            self.samples = defaultdict(list)
+
+    def wrap(self, module, attr: str, stage: str):
+        fn = getattr(module, attr)
+
+        def timed(*a, **kw):
+            started = time.perf_counter()
+            try:
+                return fn(*a, **kw)
+            finally:
+                elapsed = time.perf_counter() - started
+                with self._lock:
+                    self.samples[stage].append(elapsed)
+
+        setattr(module, attr, timed)
+
+    def summary(self) -> dict:
+        with self._lock:
+            return {stage: {"count": len(values), **latency_summary(values)} for stage, values in self.samples.items()}
+
+
+def instrument(recorder: StageRecorder, app_module):
+    ai_pipeline_module = sys.modules["pipeline.ai_pipeline"]
+    llm_module = sys.modules["services.llm_service"]
+    stages = [
+        (app_module, "embed_text", "chat.embed"),
+        (app_module, "search_text", "chat.search_docs"),
+        (app_module, "retrieve_llm_responses_by_user", "chat.search_history"),
+        (app_module, "_retrieve_context", "chat.retrieve_context"),
+        (app_module, "embed_texts", "chat_batch.embed"),
+        (app_module, "search_texts", "chat_batch.search_docs"),
+        (app_module, "retrieve_llm_responses_by_users", "chat_batch.search_history"),
+        (app_module, "_retrieve_context_batch", "chat_batch.retrieve_context"),
+        (app_module, "generate_llm_response", "chat.generate"),
+        (llm_module, "build_prompt", "chat.build_prompt"),
+        (app_module, "ai_pipeline", "input.pipeline"),
+        (ai_pipeline_module, "_ticket_vectors", "input.embed"),
+        (ai_pipeline_module, "_inherited_labels", "input.near_duplicates"),
+        (ai_pipeline_module, "priority_topic_calculation_batch", "input.priority_topic"),
+        (ai_pipeline_module, "sentiment_analyser_batch", "input.sentiment"),
+        (ai_pipeline_module, "keyword_calculation_batch", "input.keywords"),
+        (app_module, "fetch_tickets_page", "fetch.scroll"),
+    ]
+    for module, attr, stage in stages:
+        if hasattr(module, attr):
+            recorder.wrap(module, attr, stage)
+
+
+def latency_summary(values: list) -> dict:
+    if not values:
+        return {}
+    ms = np.asarray(values) * 1000
+    return {
+        "p50_ms": round(float(np.percentile(ms, 50)), 2),
+        "p95_ms": round(float(np.percentile(ms, 95)), 2),
+        "p99_ms": round(float(np.percentile(ms, 99)), 2),
+        "mean_ms": round(float(ms.mean()), 2),
+        "max_ms": round(float(ms.max()), 2),
+    }
+
+
+def make_request(endpoint: str, args, i: int):
+    """Returns (method, path, kwargs) of the i-th request to endpoint."""
+    rng = random.Random(f"{args.seed}:{endpoint}:{i}")
+    if endpoint in ("chat", "chat_stream"):
+        payload = {"text": f"{random_text(rng, 10)} ({i})", "user_id": f"bench-user-{i % args.users}"}
+        path = "/chat" if endpoint == "chat" else "/chat/stream"
+        return "post", path, {"json": payload}
+    if endpoint == "chat_batch":
+        payload = [{"text": f"{random_text(rng, 10)} ({i}.{n})", "user_id": f"bench-user-{(i + n) % args.users}"}
+                   for n in range(args.chat_batch)]
+        return "post", "/chat/batch", {"json": payload}
+    if endpoint == "input":
+        tickets = [{"id": f"BENCH-{i}-{n}", "subject": random_text(rng, 8), "body": random_text(rng, 50)}
+                   for n in range(args.input_batch)]
+        return "post", "/input", {"json": tickets}
+    return "get", "/fetch", {"query_string": {"limit": 30, "fields": "id,subject,priority,topics,sentiment",
+                                              "priority": rng.choice(["", "P0", "P1,P2"])}}
+
+
+def run_endpoint(flask_app, endpoint: str, args, offset: int, count: int):
+    """
+    Sends count requests with args.concurrency threads. Returns (latencies, time to first byte, errors, wall time).
+    """
+    local = threading.local()
+    latencies, first_bytes, errors = [], [], []
+    lock = threading.Lock()
+
+    def one(i):
+        client = getattr(local, "client", None)
+        if client is None:
+            client = local.client = flask_app.test_client()
+        method, path, kwargs = make_request(endpoint, args, offset + i)
+        started = time.perf_counter()
+        first = None
+        try:
+            response = getattr(client, method)(path, buffered=False, **kwargs)
+            for chunk in response.response:
+                if first is None and chunk:
+                    first = time.perf_counter() - started
+            response.close()
+            ok = response.status_code < 400
+        except Exception as e:
+            ok = False
+            print(f"{endpoint} request {i} failed: {e}")
+        elapsed = time.perf_counter() - started
+        with lock:
+            latencies.append(elapsed)
+            if first is not None:
+                first_bytes.append(first)
+            if not ok:
+                errors.append(i)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(one, range(count)))
+    return latencies, first_bytes, errors, time.perf_counter() - started
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except Exception:
+        return "unknown"
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    endpoints = [e.strip() for e in args.endpoints.split(",") if e.strip()]
+    unknown = set(endpoints) - set(ENDPOINTS)
+    if unknown:
+        sys.exit(f"Unknown endpoints: {', '.join(sorted(unknown))}")
+
+    fake_openai = FakeOpenAIServer(dim=args.dim, embed_latency_ms=args.embed_latency_ms,
+                                   chat_latency_ms=args.chat_latency_ms, token_latency_ms=args.token_latency_ms).start()
+    workdir = tempfile.mkdtemp(prefix="csc-bench-")
+    configure_env(args, fake_openai, workdir)
+    rng = random.Random(args.seed)
+
+    seed_qdrant(args, rng)
+    import app as app_module
+    if not args.real_models:
+        from pipeline.ml_processing import registry
+        from .stub_models import install_stub_models
+        install_stub_models(registry, args.model_batch_latency_ms, args.model_item_latency_ms)
+    from services.history_writer import history_writer
+
+    recorder = StageRecorder()
+    instrument(recorder, app_module)
+    flask_app = app_module.app
+    flask_app.testing = True
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "config": {k: v for k, v in vars(args).items() if k != "output"},
+        "endpoints": {},
+    }
+    for endpoint in endpoints:
+        print(f"Benchmarking {endpoint}: {args.requests} requests, concurrency {args.concurrency}")
+        run_endpoint(flask_app, endpoint, args, 10 ** 6, args.warmup)
+        recorder.reset()
+        calls_before = dict(fake_openai.calls)
+        latencies, first_bytes, errors, wall = run_endpoint(flask_app, endpoint, args, 0, args.requests)
+        items = args.requests * {"input": args.input_batch, "chat_batch": args.chat_batch}.get(endpoint, 1)
+        report["endpoints"][endpoint] = {
+            "requests": args.requests,
+            "errors": len(errors),
+            "wall_seconds": round(wall, 3),
+            "throughput_rps": round(args.requests / wall, 2) if wall else None,
+            "items_per_second": round(items / wall, 2) if wall else None,
+            "latency": latency_summary(latencies),
+            "time_to_first_byte": latency_summary(first_bytes) if endpoint == "chat_stream" else None,
+            "stages": recorder.summary(),
+            "openai_calls": {k: fake_openai.calls[k] - calls_before.get(k, 0) for k in fake_openai.calls},
+        }
+        latency = report["endpoints"][endpoint]["latency"]
+        print(f"  {report['endpoints'][endpoint]['throughput_rps']} req/s, p50 {latency.get('p50_ms')} ms, "
+              f"p95 {latency.get('p95_ms')} ms, p99 {latency.get('p99_ms')} ms, errors {len(errors)}")
+
+    history_writer.stop()
+    fake_openai.stop()
+
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"{datetime.datetime.now().strftime('%Y%m%d-%H%M%S')}_{report['commit']}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+import time
+import hashlib
+
+SENTIMENT_LABELS = ["anger", "disgust", "fear", "joy", "neutral", "sadness", "surprise"]
+
+
+def _pick(text: str, n: int) -> int:
+    return int(hashlib.md5(text.encode("utf-8")).hexdigest(), 16) % n
+
+
+class StubPipeline:
+    """
+    Stand-in for a Hugging Face pipeline: deterministic outputs in the pipeline's output format,
+    taking batch_latency_ms per call plus item_latency_ms per input to model inference cost.
+    """
+
+    def __init__(self, batch_latency_ms: float = 5, item_latency_ms: float = 2):
+        self.batch_latency_ms = batch_latency_ms
+        self.item_latency_ms = item_latency_ms
+
+    def __call__(self, inputs, **kwargs):
+        single = isinstance(inputs, str)
+        texts = [inputs] if single else list(inputs)
+        time.sleep((self.batch_latency_ms + self.item_latency_ms * len(texts)) / 1000)
+        outputs = [self.predict(text, **kwargs) for text in texts]
+        return outputs[0] if single else outputs
+
+    def predict(self, text: str, **kwargs):
+        raise NotImplementedError
+
+
+class StubZeroShot(StubPipeline):
+    """zero-shot-classification: {"sequence", "labels", "scores"} with labels sorted by score."""
+
+    def predict(self, text: str, candidate_labels=(), **kwargs):
+        labels = list(candidate_labels)
+        top = _pick(text, len(labels))
+        labels = [labels[top]] + labels[:top] + labels[top + 1:]
+        scores = [0.6] + [0.4 / max(len(labels) - 1, 1)] * (len(labels) - 1)
+        return {"sequence": text, "labels": labels, "scores": scores}
+
+
+class StubTextClassification(StubPipeline):
+    """text-classification (top-1): {"label", "score"}."""
+
+    def predict(self, text: str, **kwargs):
+        return {"label": SENTIMENT_LABELS[_pick(text, len(SENTIMENT_LABELS))], "score": 0.9}
+
+
+class StubText2Text(StubPipeline):
+    """text2text-generation: [{"generated_text"}] per input."""
+
+    def predict(self, text: str, **kwargs):
+        words = [w.strip(".,!?").lower() for w in text.split() if len(w) > 4]
+        return [{"generated_text": ", ".join(list(dict.fromkeys(words))[:3]) or "ticket"}]
+
+
+def install_stub_models(registry, batch_latency_ms: float = 5, item_latency_ms: float = 2):
+    """
+    Installs stub pipelines for every model in the registry (pipeline/model_registry.py), so no weights
+    are downloaded or loaded. Start the app with MODEL_LOAD_MODE=lazy so the real models are never built.
+    """
+    stubs = {
+        "priority": StubZeroShot(batch_latency_ms, item_latency_ms),
+        "topic": StubZeroShot(batch_latency_ms, item_latency_ms),
+        "sentiment": StubTextClassification(batch_latency_ms, item_latency_ms),
+        "keywords": StubText2Text(batch_latency_ms, item_latency_ms),
+    }
+    for name, stub in stubs.items():
+        registry.set(name, stub)
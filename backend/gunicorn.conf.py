@@ -0,0 +1,65 @@
+"""
+Production server configuration, run from backend/:
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+The master imports the app and loads the models once (preload_app), then forks the workers, which share
+the read-only weights through copy-on-write. Each worker sizes its torch thread pool, warms up every
+loaded pipeline and resumes interrupted ingest jobs before it accepts connections. Point the load
+balancer / orchestrator readiness probe at /ready and the liveness probe at /health.
+"""
+import os
+import multiprocessing
+from dotenv import load_dotenv
+load_dotenv()
+
+# the per-worker startup (app.init_worker) must run after fork, not when the master imports the app
+os.environ["DEFER_WORKER_INIT"] = "1"
+
+CPU_COUNT = multiprocessing.cpu_count()
+
+bind = os.getenv("GUNICORN_BIND", f"0.0.0.0:{os.getenv('PORT', 8081)}")
+# Ticket inference is CPU bound and torch already runs each forward pass on several cores, so a few
+# processes split the cores between them; the chat path mostly waits on OpenAI and Qdrant, which
+# threads inside each worker cover.
+workers = int(os.getenv("GUNICORN_WORKERS", max(1, min(4, CPU_COUNT // 2))))
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", 8))
+# torch intra-op threads per worker, by default the cores divided between the workers
+TORCH_NUM_THREADS = int(os.getenv("TORCH_NUM_THREADS", max(1, CPU_COUNT // workers)))
+# same split for ONNX Runtime sessions (INFERENCE_BACKEND=onnx), whose default of 0 would give every worker
+# all the cores; set before the app is imported since onnx_backend reads it at import
+os.environ.setdefault("ORT_INTRA_OP_THREADS", str(TORCH_NUM_THREADS))
+
+preload_app = True
+# synchronous /input uploads run the whole pipeline inside the request
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 120))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", 30))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", 5))
+# recycle workers after this many requests (0 = never), jittered so they do not restart together
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", 0))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", 100))
+accesslog = os.getenv("GUNICORN_ACCESS_LOG", "-")
+loglevel = os.getenv("LOG_LEVEL", "info").lower()
+
+
+def when_ready(server):
+    """Master, app imported, no worker forked yet: load the models and freeze the heap."""
+    from pipeline.ml_processing import preload_models
+    preload_models(all_models=os.getenv("PRELOAD_ALL_MODELS", "0") == "1")
+    server.log.info("Models preloaded, forking %s workers", workers)
+
+
+def post_fork(server, worker):
+    """Worker, right after fork: size the torch thread pool of this process."""
+    try:
+        import torch
+    except ImportError:
+        return
+    torch.set_num_threads(TORCH_NUM_THREADS)
+
+
+def post_worker_init(worker):
+    """Worker, before its first request: warmup inference and ingest job resume."""
+    from app import init_worker
+    init_worker()
@@ -1,11 +1,26 @@
-from .ai_pipeline import ai_pipeline
+from .ai_pipeline import ai_pipeline, ai_pipeline_stream
 from .db_connector import push_ticket_point
+from .jobs import job_manager
 from .ml_processing import priority_calculation, keyword_calculation, topic_calculation, sentiment_analyser
+from .ml_processing import preload_models, warmup_models, models_ready, model_stats
+from .ml_processing import priority_calculation_batch, keyword_calculation_batch, topic_calculation_batch, sentiment_analyser_batch
+from .ml_processing import priority_topic_calculation_batch
 
 __all__ = [
     'ai_pipeline',
+    'ai_pipeline_stream',
     'push_ticket_point',
+    'job_manager',
     'keyword_calculation',
     'topic_calculation',
-    'sentiment_analyser'
+    'sentiment_analyser',
+    'preload_models',
+    'warmup_models',
+    'models_ready',
+    'model_stats',
+    'priority_calculation_batch',
+    'keyword_calculation_batch',
+    'topic_calculation_batch',
+    'sentiment_analyser_batch',
+    'priority_topic_calculation_batch'
 ]
\ No newline at end of file
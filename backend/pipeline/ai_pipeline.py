@@ -1,49 +1,234 @@
+import os
 import datetime
-from .ml_processing import priority_calculation, keyword_calculation, topic_calculation, sentiment_analyser
-from .db_connector import push_ticket_point
+from concurrent.futures import wait as wait_futures
+from services.qdrant_service import embed_texts, embedding_size
+from utils.metrics import metrics, span
+from utils.log import get_logger
+from .ml_processing import priority_topic_calculation_batch, keyword_calculation_batch, sentiment_analyser_batch
+from .db_connector import (
+    push_ticket_point, ticket_writer, ticket_vector_size, find_near_duplicates, PLACEHOLDER_VECTOR_SIZE,
+)
 
-def ai_pipeline(json_input: list) -> list:
+# tickets per micro-batch in ai_pipeline_stream, bounds the memory used by a streamed upload
+STREAM_CHUNK_SIZE = int(os.getenv("STREAM_CHUNK_SIZE", 64))
+# "openai" embeds subject + body with the embeddings API, "placeholder" stores a constant vector
+TICKET_EMBEDDINGS = os.getenv("TICKET_EMBEDDINGS", "openai")
+# similarity above which a ticket reuses the priority/topic/sentiment of a stored ticket, >1 disables it
+TICKET_DEDUP_THRESHOLD = float(os.getenv("TICKET_DEDUP_THRESHOLD", 0.97))
+
+logger = get_logger("ai_pipeline")
+_warned = set()
+
+
+def _ticket_vectors(texts: list):
     """
-    simple fxn to run the ai pipeline on a list of json objects
-    each json object should have at least 'id', 'subject', and 'body' fields
-    returns a list of results with status for each processed item
-    1. calculates priority from body
-    2. calculates keywords from subject
-    3. calculates topic from subject + body
-    4. calculates sentiment from subject + body
-    5. pushes the results to the database
+    Embeds the tickets in batches (embed_texts, list input). Returns (vectors, real), real is False when
+    placeholder vectors were used: embeddings disabled, the embeddings call failed, or QDRANT_COLLECTION_2
+    does not have a single unnamed vector of the embedding size (e.g. still the old placeholder size) and
+    must be recreated for real embeddings. A size mismatch is detected before paying for the embeddings
+    when the model's size is known, else on the first call, and every later upload skips the API.
+    """
+    size = ticket_vector_size()
+    if TICKET_EMBEDDINGS == "openai" and texts and "size" not in _warned:
+        expected = embedding_size()
+        if size is None:
+            # named vectors, or the collection could not be read (retried on the next upload)
+            if "unknown" not in _warned:
+                _warned.add("unknown")
+                logger.warning("Ticket collection has no single unnamed vector size, storing placeholder vectors")
+        elif expected is not None and expected != size:
+            _warn_size_mismatch(size, expected)
+        else:
+            try:
+                # the embeddings API rejects empty input
+                vectors = embed_texts([text or "(empty ticket)" for text in texts])
+                if size == len(vectors[0]):
+                    return vectors, True
+                _warn_size_mismatch(size, len(vectors[0]))
+            except Exception as e:
+                logger.warning("Ticket embedding failed, storing placeholder vectors: %s", e)
+    return [[0.1] * (size or PLACEHOLDER_VECTOR_SIZE) for _ in texts], False
+
+
+def _warn_size_mismatch(size, expected):
+    _warned.add("size")
+    logger.warning("Ticket collection has %s-d vectors but embeddings are %s-d, "
+                   "storing placeholder vectors until the collection is recreated", size, expected)
+
+
+def _inherited_labels(vectors: list, real: bool, ticket_ids: list) -> list:
+    """
+    Labels of near-duplicate stored tickets (other than the ticket itself), None for tickets that have
+    to go through the models.
+    """
+    if not real or TICKET_DEDUP_THRESHOLD > 1 or not vectors:
+        return [None] * len(vectors)
+    try:
+        with span("near_duplicate_lookup"):
+            payloads = find_near_duplicates(vectors, TICKET_DEDUP_THRESHOLD, ticket_ids)
+    except Exception as e:
+        logger.warning("Near-duplicate lookup failed, running all models: %s", e)
+        return [None] * len(vectors)
+    return [
+        p if p and all(p.get(k) for k in ("priority", "topics", "sentiment")) else None
+        for p in payloads
+    ]
+
+
+def _classify_and_push(items: list, writer, offset: int = 0, batch_size: int = None) -> list:
+    """
+    Embeds the tickets, reuses the labels of near-duplicate stored tickets, runs the models over the rest
+    in batches and buffers the successful tickets into writer.
+    Returns one result per item; writer refs are offset + the item's position.
+    Items that are not JSON objects (e.g. a ValueError for a bad NDJSON line) get an error result.
     """
-    results = []
-    for item in json_input:
-        item_id = item.get("id", "no_id")
-        subject = item.get("subject", "")
-        body = item.get("body", "")
-        
-        subject_body_combined = f"{subject} {body}".strip()
+    results = [None] * len(items)
+    valid = []
+    for i, item in enumerate(items):
+        if isinstance(item, dict):
+            valid.append(i)
+        else:
+            error = item if isinstance(item, Exception) else "Expected a JSON object"
+            results[i] = {"id": "no_id", "error": str(error)}
+
+    item_ids = [items[i].get("id", "no_id") for i in valid]
+    subjects = [items[i].get("subject", "") for i in valid]
+    bodies = [items[i].get("body", "") for i in valid]
+    combined = [f"{subject} {body}".strip() for subject, body in zip(subjects, bodies)]
 
+    vectors, real = _ticket_vectors(combined)
+    inherited = _inherited_labels(vectors, real, item_ids)
+
+    # near-duplicates of stored tickets reuse their labels, only the rest go through the classifiers
+    fresh = [n for n, labels in enumerate(inherited) if labels is None]
+    metrics.inc("csc_ingest_labels_reused_total", len(inherited) - len(fresh))
+    fresh_priorities, fresh_topics = priority_topic_calculation_batch(
+        [bodies[n] for n in fresh], [combined[n] for n in fresh], batch_size
+    )
+    fresh_sentiments = sentiment_analyser_batch([combined[n] for n in fresh], batch_size)
+    priorities = [labels and labels["priority"] for labels in inherited]
+    topics = [labels and labels["topics"] for labels in inherited]
+    sentiments = [labels and labels["sentiment"] for labels in inherited]
+    for k, n in enumerate(fresh):
+        priorities[n], topics[n], sentiments[n] = fresh_priorities[k], fresh_topics[k], fresh_sentiments[k]
+    keywords = keyword_calculation_batch(subjects, batch_size)
+
+    for n, i in enumerate(valid):
+        item_id = item_ids[n]
         try:
-            priority = priority_calculation(body)
-            keywords = keyword_calculation(subject)
-            topic = topic_calculation(subject_body_combined)
-            sentiment = sentiment_analyser(subject_body_combined)
-            sample_vector = [0.1] * 128
+            for prediction in (priorities[n], keywords[n], topics[n], sentiments[n]):
+                if isinstance(prediction, Exception):
+                    raise prediction
+
             push_ticket_point(
                 ticket_id=item_id,
-                subject=subject,
-                body=body,
-                priority=priority,
-                topics=topic,
-                keywords=keywords,
-                sentiment=sentiment,
+                subject=subjects[n],
+                body=bodies[n],
+                priority=priorities[n],
+                topics=topics[n],
+                keywords=keywords[n],
+                sentiment=sentiments[n],
                 created_at=datetime.datetime.now(),
-                vector=sample_vector
+                vector=vectors[n],
+                writer=writer,
+                ref=offset + i
             )
-            
-            results.append({"id": item_id, "status": "success"})
+
+            results[i] = {"id": item_id, "status": "success"}
+            metrics.inc("csc_ingest_tickets_total", status="classified")
 
         except Exception as e:
             # Handle potential errors during ML model inference
-            print(f"Error processing item with id {item_id}: {e}")
+            logger.warning("Error processing item with id %s: %s", item_id, e)
+            metrics.inc("csc_ingest_tickets_total", status="error")
             # Append a failure result to the list
-            results.append({"id": item_id, "error": str(e)})
-    return results
\ No newline at end of file
+            results[i] = {"id": item_id, "error": str(e)}
+    return results
+
+
+def _apply_write_failures(results: list, offset: int, failures: dict) -> list:
+    for i, result in enumerate(results):
+        error = failures.get(offset + i)
+        if error is not None:
+            results[i] = {"id": result.get("id", "no_id"), "error": error}
+    return results
+
+
+def ai_pipeline(json_input: list, batch_size: int = None) -> list:
+    """
+    simple fxn to run the ai pipeline on a list of json objects
+    each json object should have at least 'id', 'subject', and 'body' fields
+    returns a list of results with status for each processed item
+    1. calculates priority from body
+    2. calculates keywords from subject
+    3. calculates topic from subject + body
+    4. calculates sentiment from subject + body
+    5. pushes the results to the database, with the ticket's embedding as vector
+    Tickets nearly identical (TICKET_DEDUP_THRESHOLD) to a stored ticket reuse its priority, topic and sentiment.
+    Each model runs once over the whole upload in batches of batch_size (INFERENCE_BATCH_SIZE by default),
+    an item that fails in any stage gets {"id", "error"} and the others are still pushed.
+    Points are written through one BulkPointWriter for the whole upload, the function returns
+    once every chunk has been accepted by Qdrant (see BulkPointWriter for when they are also applied).
+    """
+    writer = ticket_writer()
+    results = _classify_and_push(json_input, writer, 0, batch_size)
+
+    # barrier: wait for every chunk to be accepted, then report tickets Qdrant rejected
+    failures = writer.close()
+    return _apply_write_failures(results, 0, failures)
+
+
+def ai_pipeline_stream(items, batch_size: int = None, chunk_size: int = None):
+    """
+    Generator version of ai_pipeline for streamed uploads.
+    Reads tickets from any iterable in micro-batches of chunk_size (STREAM_CHUNK_SIZE by default) and yields
+    one result per ticket, in input order, once Qdrant has accepted that ticket's upsert. Upserts are sent
+    with wait=False, so a yielded result means the write was accepted, not yet applied; the end of the
+    stream (the writer's wait=True barrier in close()) only guarantees more on a single-shard collection,
+    see BulkPointWriter.
+    The first micro-batch is yielded as soon as its writes are accepted, so the first results come back
+    quickly; from then on the writes of micro-batch N are awaited only after micro-batch N+1 has been
+    classified, so inference and Qdrant upserts overlap. Memory is bounded by the micro-batch size,
+    not the upload size.
+    """
+    chunk_size = max(1, chunk_size or STREAM_CHUNK_SIZE)
+    writer = ticket_writer()
+    previous = None  # (offset, results, writer futures still in flight once it was sent)
+    offset = 0
+    chunk = []
+
+    def process(chunk, offset):
+        results = _classify_and_push(chunk, writer, offset, batch_size)
+        return offset, results, writer.flush()
+
+    def finish(entry):
+        prev_offset, prev_results, futures = entry
+        wait_futures(futures)
+        return _apply_write_failures(prev_results, prev_offset, writer.failures)
+
+    try:
+        for item in items:
+            chunk.append(item)
+            if len(chunk) < chunk_size:
+                continue
+            current = process(chunk, offset)
+            offset += len(chunk)
+            chunk = []
+            if current[0] == 0:
+                # nothing to overlap the first micro-batch with yet
+                yield from finish(current)
+                continue
+            if previous is not None:
+                yield from finish(previous)
+            previous = current
+
+        if chunk:
+            current = process(chunk, offset)
+            if previous is not None:
+                yield from finish(previous)
+            previous = current
+    finally:
+        writer.close()
+
+    if previous is not None:
+        yield from _apply_write_failures(previous[1], previous[0], writer.failures)
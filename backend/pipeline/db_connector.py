@@ -1,9 +1,17 @@
 import os
+import time
 import uuid
 import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait as wait_futures
+from typing import Optional, Callable
 from qdrant_client import QdrantClient, models
+from services.clients import qdrant_client
 from qdrant_client.http.models import Distance, VectorParams, Field, PointStruct
 from dotenv import load_dotenv
+from .ticket_aggregates import record_ticket_points
+from utils.metrics import metrics, span, timed
+from utils.log import get_logger
 load_dotenv()
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 OPENAI_EMBEDDING_MODEL = os.getenv("OPENAI_EMBEDDING_MODEL")
@@ -14,13 +22,158 @@ QDRANT_COLLECTION_2 = os.getenv("QDRANT_COLLECTION_2")
 QDRANT_COLLECTION_3 = os.getenv("QDRANT_COLLECTION_3")
 QDRANT_VECTOR_NAME = os.getenv("QDRANT_VECTOR_NAME")
 
+# Bulk writer tuning: points per upsert, seconds before a partial chunk is flushed, chunks in flight at once
+QDRANT_UPSERT_BATCH_SIZE = int(os.getenv("QDRANT_UPSERT_BATCH_SIZE", 256))
+QDRANT_UPSERT_FLUSH_SECONDS = float(os.getenv("QDRANT_UPSERT_FLUSH_SECONDS", 2.0))
+QDRANT_UPSERT_PARALLELISM = int(os.getenv("QDRANT_UPSERT_PARALLELISM", 4))
+
 
 COLLECTION_NAME = QDRANT_COLLECTION_2
-print(COLLECTION_NAME)
-print(QDRANT_URL)
-print(QDRANT_API_KEY)
-client = QdrantClient(url=QDRANT_URL, api_key=QDRANT_API_KEY)
-def push_ticket_point(
+client = qdrant_client
+logger = get_logger("db_connector", sampled=True)
+
+class BulkPointWriter:
+    """
+    Buffers PointStructs and upserts them in chunks of batch_size, or after flush_interval seconds
+    for a partial chunk. Up to parallelism chunks are sent at once with wait=False.
+    close() is the barrier: it waits for every chunk in flight and then sends the last one with wait=True,
+    so when it returns every point has been accepted by Qdrant. The wait=True upsert only waits for the
+    shard holding its points, so every point is also applied on a single-shard collection (the default),
+    while on a sharded collection points of other shards may still be applied asynchronously.
+    Each point is added with a ref (e.g. the item's index); refs of rejected points end up in .failures
+    mapped to the error message. When a chunk is rejected its points are retried one by one,
+    so only the points Qdrant actually refuses are reported.
+    on_success, if given, is called with the points of every chunk Qdrant accepted.
+    """
+
+    def __init__(self, client: QdrantClient, collection_name: str, batch_size: int = None,
+                 flush_interval: float = None, parallelism: int = None, on_success: Callable = None):
+        self.client = client
+        self.on_success = on_success
+        self.collection_name = collection_name
+        self.batch_size = max(1, batch_size or QDRANT_UPSERT_BATCH_SIZE)
+        self.flush_interval = QDRANT_UPSERT_FLUSH_SECONDS if flush_interval is None else flush_interval
+        self.failures = {}
+
+        self._buffer = []
+        self._buffer_started = None
+        self._last_sent = None
+        self._futures = []
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._executor = ThreadPoolExecutor(max_workers=max(1, parallelism or QDRANT_UPSERT_PARALLELISM))
+        self._timer = None
+        if self.flush_interval > 0:
+            self._timer = threading.Thread(target=self._flush_on_timer, daemon=True)
+            self._timer.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def add(self, point: PointStruct, ref=None):
+        """Buffers one point, flushing a full chunk."""
+        with self._lock:
+            if self._closed.is_set():
+                raise RuntimeError("BulkPointWriter is closed")
+            if not self._buffer:
+                self._buffer_started = time.monotonic()
+            self._buffer.append((ref, point))
+            if len(self._buffer) >= self.batch_size:
+                self._send_buffer_locked()
+
+    def flush(self) -> list:
+        """
+        Sends whatever is buffered without waiting; returns the futures of the chunks still in flight.
+        Completed futures are dropped, so a long-lived writer only holds the chunks it has not finished.
+        """
+        with self._lock:
+            if self._buffer:
+                self._send_buffer_locked()
+            self._futures = [f for f in self._futures if not f.done()]
+            return list(self._futures)
+
+    def close(self) -> dict:
+        """Waits for all chunks to be accepted (see the class docstring) and returns the failures {ref: error}."""
+        with self._lock:
+            if self._closed.is_set():
+                return self.failures
+            self._closed.set()
+            remaining, self._buffer = self._buffer, []
+            futures = self._futures
+        wait_futures(futures)
+        self._executor.shutdown(wait=True)
+
+        if not remaining and self._last_sent is not None:
+            # nothing left to send: re-upsert the last point written (idempotent, same id and payload)
+            # with wait=True, Qdrant applies the updates of a shard in order so this waits for everything
+            # sent before it to that shard
+            remaining = [self._last_sent]
+        if remaining:
+            self._upsert_chunk(remaining, wait=True)
+        return self.failures
+
+    def _flush_on_timer(self):
+        while not self._closed.wait(self.flush_interval / 2):
+            with self._lock:
+                if self._buffer and time.monotonic() - self._buffer_started >= self.flush_interval:
+                    self._send_buffer_locked()
+
+    def _send_buffer_locked(self):
+        chunk, self._buffer = self._buffer, []
+        self._last_sent = chunk[-1]
+        self._futures.append(self._executor.submit(self._upsert_chunk, chunk, False))
+
+    def _upsert_chunk(self, chunk: list, wait: bool):
+        try:
+            with span("qdrant_upsert"):
+                self.client.upsert(
+                    collection_name=self.collection_name,
+                    wait=wait,
+                    points=[point for _, point in chunk],
+                )
+        except Exception as e:
+            if len(chunk) == 1:
+                self.failures[chunk[0][0]] = str(e)
+                metrics.inc("csc_qdrant_points_rejected_total", collection=self.collection_name)
+                logger.warning("Upsert rejected for ref %s: %s", chunk[0][0], e)
+                return
+            logger.warning("Chunk of %d points rejected (%s), retrying points one by one", len(chunk), e)
+        else:
+            if self.on_success is not None:
+                self.on_success([point for _, point in chunk])
+            return
+
+        for entry in chunk:
+            self._upsert_chunk([entry], wait)
+
+
+def ticket_writer(**kwargs) -> BulkPointWriter:
+    """
+    BulkPointWriter for the tickets collection (QDRANT_COLLECTION_2), to be passed to push_ticket_point.
+    Accepted points are counted in the ticket aggregates.
+    """
+    kwargs.setdefault("on_success", record_ticket_points)
+    return BulkPointWriter(client, COLLECTION_NAME, **kwargs)
+
+
+# namespace of the deterministic ticket point IDs
+TICKET_POINT_NAMESPACE = uuid.UUID("6f1c1f7e-4b0e-4f55-9a55-6c0f3a5e2b11")
+
+
+def ticket_point_id(ticket_id) -> str:
+    """
+    Point ID of a ticket in QDRANT_COLLECTION_2, derived from the ticket id so that re-uploading a ticket
+    overwrites its point instead of adding a duplicate. Tickets without an id get a random ID.
+    """
+    if ticket_id is None or ticket_id == "no_id" or ticket_id == "":
+        return str(uuid.uuid4())
+    return str(uuid.uuid5(TICKET_POINT_NAMESPACE, f"{COLLECTION_NAME}:{ticket_id}"))
+
+
+def build_ticket_point(
     ticket_id: str,
     subject: str,
     body: str,
@@ -30,23 +183,11 @@ def push_ticket_point(
     sentiment: str,
     created_at: datetime.datetime,
     vector: list[float]
-):
+) -> PointStruct:
     """
-    Pushes a ticket point to the Qdrant collection. In this case the collection is QDRANT_COLLECTION_2 (BULK TICKETS STORAGE)
-    Input parameters:
-    - ticket_id: str   
-    - subject: str
-    - body: str
-    - priority: str
-    - topics: str
-    - keywords: str
-    - sentiment: str
-    - created_at: datetime
-    - vector: list of floats (embedding vector)
+    Builds the PointStruct stored in QDRANT_COLLECTION_2 for one ticket.
     """
-    print(f"Pushing point with ticket_id: {ticket_id}")
-    
-    point_id = str(uuid.uuid4())
+    point_id = ticket_point_id(ticket_id)
 
     point_payload = {
         "id": ticket_id,
@@ -59,15 +200,157 @@ def push_ticket_point(
         "created_at": created_at.isoformat()  
     }
     
-    point_to_insert = PointStruct(
+    return PointStruct(
         id=point_id,  
         vector=vector,
         payload=point_payload
     )
 
+# vector size used for placeholder ticket vectors when the collection size is unknown
+PLACEHOLDER_VECTOR_SIZE = 128
+_ticket_vector_size = {}
+
+
+def ticket_vector_size() -> Optional[int]:
+    """
+    Vector size configured on QDRANT_COLLECTION_2 (read once), None if it cannot be read.
+    """
+    if "size" not in _ticket_vector_size:
+        try:
+            vectors = client.get_collection(COLLECTION_NAME).config.params.vectors
+            _ticket_vector_size["size"] = vectors.size if hasattr(vectors, "size") else None
+        except Exception as e:
+            logger.warning("Could not read vector size of %s: %s", COLLECTION_NAME, e)
+            return None
+    return _ticket_vector_size["size"]
+
+
+def find_near_duplicates(vectors: list, threshold: float, ticket_ids: list) -> list:
+    """
+    For each vector, the payload of the most similar stored ticket when its similarity is at least threshold,
+    else None. The ticket's own stored point (same ticket_ids entry) is excluded, so a re-uploaded, edited
+    ticket does not inherit the labels of its previous version. All lookups go to Qdrant in one
+    query_batch_points round trip.
+    """
+    if not vectors:
+        return []
+    responses = client.query_batch_points(
+        collection_name=COLLECTION_NAME,
+        requests=[
+            models.QueryRequest(
+                query=vector,
+                filter=models.Filter(must_not=[models.HasIdCondition(has_id=[ticket_point_id(ticket_id)])]),
+                limit=1,
+                score_threshold=threshold,
+                with_payload=["id", "priority", "topics", "sentiment"],
+            )
+            for vector, ticket_id in zip(vectors, ticket_ids)
+        ],
+    )
+    return [r.points[0].payload if r.points else None for r in responses]
+
+
+def ensure_ticket_payload_indexes():
+    """
+    Creates the payload indexes used to filter QDRANT_COLLECTION_2: keyword indexes on id, priority, topics
+    and sentiment, and a datetime index on created_at. Safe to call on every startup.
+    """
+    schema = {
+        "id": models.PayloadSchemaType.KEYWORD,
+        "priority": models.PayloadSchemaType.KEYWORD,
+        "topics": models.PayloadSchemaType.KEYWORD,
+        "sentiment": models.PayloadSchemaType.KEYWORD,
+        "created_at": models.PayloadSchemaType.DATETIME,
+    }
+    existing = client.get_collection(COLLECTION_NAME).payload_schema or {}
+    for field, field_schema in schema.items():
+        if field not in existing:
+            client.create_payload_index(
+                collection_name=COLLECTION_NAME,
+                field_name=field,
+                field_schema=field_schema,
+            )
+
+
+def existing_ticket_ids(ticket_ids: list) -> set:
+    """
+    Returns the subset of ticket_ids that already have a point in QDRANT_COLLECTION_2 (matched on payload "id").
+    """
+    found = set()
+    str_ids = list({t for t in ticket_ids if isinstance(t, str)})
+    int_ids = list({t for t in ticket_ids if isinstance(t, int) and not isinstance(t, bool)})
+    for ids in (str_ids, int_ids):
+        for start in range(0, len(ids), 256):
+            chunk = ids[start:start + 256]
+            offset = None
+            while True:
+                points, offset = client.scroll(
+                    collection_name=COLLECTION_NAME,
+                    scroll_filter=models.Filter(must=[
+                        models.FieldCondition(key="id", match=models.MatchAny(any=chunk))
+                    ]),
+                    limit=256,
+                    offset=offset,
+                    with_payload=["id"],
+                    with_vectors=False,
+                )
+                found.update((p.payload or {}).get("id") for p in points)
+                if offset is None:
+                    break
+    return found
+
+
+@timed("push_ticket_point")
+def push_ticket_point(
+    ticket_id: str,
+    subject: str,
+    body: str,
+    priority: str,
+    topics: str,
+    keywords: str,
+    sentiment: str,
+    created_at: datetime.datetime,
+    vector: list[float],
+    writer: Optional[BulkPointWriter] = None,
+    ref=None
+):
+    """
+    Pushes a ticket point to the Qdrant collection. In this case the collection is QDRANT_COLLECTION_2 (BULK TICKETS STORAGE)
+    Input parameters:
+    - ticket_id: str   
+    - subject: str
+    - body: str
+    - priority: str
+    - topics: str
+    - keywords: str
+    - sentiment: str
+    - created_at: datetime
+    - vector: list of floats (embedding vector)
+    - writer: optional BulkPointWriter, the point is buffered into it instead of being upserted right away
+    - ref: key the writer reports a failure under (defaults to ticket_id)
+    """
+    logger.debug("Pushing point with ticket_id: %s", ticket_id)
+
+    point_to_insert = build_ticket_point(
+        ticket_id=ticket_id,
+        subject=subject,
+        body=body,
+        priority=priority,
+        topics=topics,
+        keywords=keywords,
+        sentiment=sentiment,
+        created_at=created_at,
+        vector=vector
+    )
+
+    if writer is not None:
+        writer.add(point_to_insert, ref=ref if ref is not None else ticket_id)
+        return
+
     client.upsert(
         collection_name=COLLECTION_NAME,
         wait=True,
         points=[point_to_insert],
     )
-    print(f"Successfully pushed point for ticket_id: {ticket_id}")
\ No newline at end of file
+    record_ticket_points([point_to_insert])
+    logger.debug("Successfully pushed point for ticket_id: %s", ticket_id)
\ No newline at end of file
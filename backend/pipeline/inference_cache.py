@@ -0,0 +1,165 @@
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+from typing import Callable, List, Optional
+from dotenv import load_dotenv
+load_dotenv()
+
+INFERENCE_CACHE_ENABLED = os.getenv("INFERENCE_CACHE_ENABLED", "1") == "1"
+# relative to backend/ by default, so every worker uses the same file whatever its working directory
+INFERENCE_CACHE_PATH = os.getenv(
+    "INFERENCE_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "inference_cache.sqlite3"),
+)
+# the oldest outputs are evicted past this many rows (0 = no cap) ...
+INFERENCE_CACHE_MAX_ROWS = int(os.getenv("INFERENCE_CACHE_MAX_ROWS", 200000))
+# ... and outputs older than this are evicted (0 = no expiry)
+INFERENCE_CACHE_TTL_DAYS = float(os.getenv("INFERENCE_CACHE_TTL_DAYS", 30))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS inference (
+    key TEXT PRIMARY KEY,
+    result TEXT NOT NULL,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS inference_created ON inference (created);
+"""
+
+
+def cache_key(stage: str, model_key: str, text: str) -> str:
+    """
+    Key of one model output: the stage, a description of the model that produced it and a hash of the input text.
+    """
+    return hashlib.sha256(f"{stage}\x00{model_key}\x00{text}".encode("utf-8")).hexdigest()
+
+
+class InferenceCache:
+    """
+    Local SQLite (WAL) cache of model outputs, shared by every worker process on the host.
+    Each stage is keyed on its own input text, so an edited ticket only recomputes the stages whose
+    input changed (e.g. a new subject re-runs keywords but not priority, which only reads the body).
+    """
+
+    def __init__(self, path: str, max_rows: int = 0, ttl_days: float = 0):
+        self.path = path
+        self.max_rows = max_rows
+        self.ttl_days = ttl_days
+        self._local = threading.local()
+        self._stats = {"hits": 0, "misses": 0, "evicted": 0}
+        # rows written since the last prune; pruning runs every ~1% of max_rows to keep writes cheap
+        self._written = 0
+        self._prune_every = max(1, max_rows // 100) if max_rows else 1000
+        self._prune_lock = threading.Lock()
+        self._conn().executescript(_SCHEMA)
+        self.prune()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def cached_batch(self, stage: str, model_key: str, texts: List[str], compute: Callable[[List[str]], list]) -> list:
+        """
+        Returns one output per text. Texts not in the cache are deduplicated and passed to compute() in one call;
+        its outputs are stored unless they are Exceptions, which are returned but never cached.
+        """
+        keys = [cache_key(stage, model_key, text) for text in texts]
+        found = {}
+        conn = self._conn()
+        unique = list(dict.fromkeys(keys))
+        for start in range(0, len(unique), 500):
+            chunk = unique[start:start + 500]
+            rows = conn.execute(
+                f"SELECT key, result FROM inference WHERE key IN ({','.join('?' * len(chunk))})", chunk
+            ).fetchall()
+            found.update((key, json.loads(result)) for key, result in rows)
+
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in missing:
+                missing[key] = text
+        self._stats["hits"] += len(texts) - sum(1 for key in keys if key in missing)
+        self._stats["misses"] += len(missing)
+
+        if missing:
+            outputs = compute(list(missing.values()))
+            now = time.time()
+            rows = []
+            for key, output in zip(missing, outputs):
+                found[key] = output
+                if not isinstance(output, Exception):
+                    rows.append((key, json.dumps(output), now))
+            if rows:
+                conn.executemany("INSERT OR REPLACE INTO inference (key, result, created) VALUES (?, ?, ?)", rows)
+                self._written += len(rows)
+                if self._written >= self._prune_every:
+                    self.prune()
+        return [found[key] for key in keys]
+
+    def prune(self) -> int:
+        """
+        Evicts outputs older than ttl_days, then the oldest outputs beyond max_rows. Returns the number of rows deleted.
+        """
+        if not self.max_rows and not self.ttl_days:
+            return 0
+        with self._prune_lock:
+            self._written = 0
+            conn = self._conn()
+            deleted = 0
+            if self.ttl_days:
+                deleted += conn.execute(
+                    "DELETE FROM inference WHERE created < ?", (time.time() - self.ttl_days * 86400,)
+                ).rowcount
+            if self.max_rows:
+                deleted += conn.execute(
+                    "DELETE FROM inference WHERE key IN "
+                    "(SELECT key FROM inference ORDER BY created DESC LIMIT -1 OFFSET ?)",
+                    (self.max_rows,),
+                ).rowcount
+            self._stats["evicted"] += deleted
+            return deleted
+
+    def stats(self) -> dict:
+        hits, misses = self._stats["hits"], self._stats["misses"]
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+            "evicted": self._stats["evicted"],
+        }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_inference_cache() -> Optional[InferenceCache]:
+    """
+    Process-wide InferenceCache, or None when INFERENCE_CACHE_ENABLED=0.
+    """
+    global _cache
+    if not INFERENCE_CACHE_ENABLED:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = InferenceCache(INFERENCE_CACHE_PATH, INFERENCE_CACHE_MAX_ROWS, INFERENCE_CACHE_TTL_DAYS)
+    return _cache
+
+
+def cached_batch(stage: str, model_key: str, texts: List[str], compute: Callable[[List[str]], list]) -> list:
+    """
+    InferenceCache.cached_batch on the process-wide cache, or compute(texts) when the cache is disabled.
+    """
+    cache = get_inference_cache()
+    if cache is None or not texts:
+        return compute(texts)
+    return cache.cached_batch(stage, model_key, texts, compute)
@@ -0,0 +1,196 @@
+import os
+import json
+import re
+import uuid
+import fcntl
+import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+from dotenv import load_dotenv
+from .ai_pipeline import ai_pipeline
+from .db_connector import existing_ticket_ids
+from utils.log import get_logger
+load_dotenv()
+
+logger = get_logger("jobs")
+
+# relative to backend/ by default, so every worker finds the same jobs whatever its working directory
+INGEST_JOB_DIR = os.getenv(
+    "INGEST_JOB_DIR", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "ingest_jobs")
+)
+INGEST_JOB_WORKERS = int(os.getenv("INGEST_JOB_WORKERS", 2))
+# tickets per ai_pipeline call, progress is persisted after each chunk
+INGEST_JOB_CHUNK_SIZE = int(os.getenv("INGEST_JOB_CHUNK_SIZE", 256))
+# files of finished jobs are deleted this long after their last update (0 keeps them forever)
+INGEST_JOB_TTL_DAYS = float(os.getenv("INGEST_JOB_TTL_DAYS", 7))
+
+ACTIVE_STATUSES = ("queued", "running")
+
+
+class IngestJobManager:
+    """
+    Runs ai_pipeline for large uploads on a bounded local worker pool, no external broker.
+    Each job is two files in job_dir: <id>.items.json (the upload, written once) and <id>.json
+    (status, progress and per-item results, rewritten after every chunk).
+    A job is processed under an exclusive flock on <id>.lock, so with several gunicorn workers only
+    one process runs it. Jobs left queued/running by a crash are picked up by resume(); on a resumed run,
+    tickets already in QDRANT_COLLECTION_2 are reported as skipped instead of being processed again.
+    Finished jobs are deleted ttl_days after their last update. job_dir is created on first use.
+    """
+
+    def __init__(self, job_dir: str = INGEST_JOB_DIR, workers: int = INGEST_JOB_WORKERS,
+                 chunk_size: int = INGEST_JOB_CHUNK_SIZE, ttl_days: float = INGEST_JOB_TTL_DAYS):
+        self.job_dir = job_dir
+        self.chunk_size = max(1, chunk_size)
+        self.ttl_days = ttl_days
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="ingest-job")
+        self._write_lock = threading.Lock()
+
+    def submit(self, items: list) -> str:
+        os.makedirs(self.job_dir, exist_ok=True)
+        self.cleanup()
+        job_id = uuid.uuid4().hex
+        with open(self._path(job_id, ".items.json"), "w", encoding="utf-8") as f:
+            json.dump(items, f)
+        self._save({
+            "job_id": job_id,
+            "status": "queued",
+            "created_at": datetime.datetime.utcnow().isoformat(),
+            "updated_at": datetime.datetime.utcnow().isoformat(),
+            "attempts": 0,
+            "total": len(items),
+            "processed": 0,
+            "failed": 0,
+            "results": {},
+        })
+        self._executor.submit(self._run, job_id)
+        return job_id
+
+    def status(self, job_id: str, include_results: bool = True) -> Optional[dict]:
+        if not re.fullmatch(r"[0-9a-f]{32}", job_id or ""):
+            return None
+        state = self._load(job_id)
+        if state is None:
+            return None
+        results = state.pop("results")
+        if include_results:
+            state["results"] = [results[k] for k in sorted(results, key=int)]
+        return state
+
+    def resume(self) -> list:
+        """
+        Re-submits every job that was queued or running when the previous process stopped,
+        after deleting the expired finished ones.
+        """
+        os.makedirs(self.job_dir, exist_ok=True)
+        self.cleanup()
+        resumed = []
+        for job_id in self._job_ids():
+            state = self._load(job_id)
+            if state and state["status"] in ACTIVE_STATUSES:
+                self._executor.submit(self._run, job_id)
+                resumed.append(job_id)
+        return resumed
+
+    def cleanup(self) -> int:
+        """Deletes the files of jobs that finished more than ttl_days ago. Returns the number of jobs deleted."""
+        if not self.ttl_days:
+            return 0
+        cutoff = (datetime.datetime.utcnow() - datetime.timedelta(days=self.ttl_days)).isoformat()
+        deleted = 0
+        for job_id in self._job_ids():
+            state = self._load(job_id)
+            if not state or state["status"] in ACTIVE_STATUSES or state["updated_at"] >= cutoff:
+                continue
+            # the status file goes last, so a cleanup interrupted halfway is finished by the next one;
+            # _run re-checks the status under the lock, so removing the lock file cannot rerun the job
+            for suffix in (".items.json", ".lock", ".json"):
+                try:
+                    os.remove(self._path(job_id, suffix))
+                except FileNotFoundError:
+                    pass
+            deleted += 1
+        if deleted:
+            logger.info("Deleted %d finished ingest jobs older than %s days", deleted, self.ttl_days)
+        return deleted
+
+    def _job_ids(self) -> list:
+        try:
+            names = os.listdir(self.job_dir)
+        except FileNotFoundError:
+            return []
+        return [name[:-len(".json")] for name in names if name.endswith(".json") and not name.endswith(".items.json")]
+
+    def _run(self, job_id: str):
+        lock = open(self._path(job_id, ".lock"), "w")
+        try:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return  # another process is running this job
+            state = self._load(job_id)
+            if state is None or state["status"] not in ACTIVE_STATUSES:
+                return
+            with open(self._path(job_id, ".items.json"), encoding="utf-8") as f:
+                items = json.load(f)
+
+            state["attempts"] += 1
+            state["status"] = "running"
+            self._save(state)
+            results = state["results"]
+            pending = [i for i in range(len(items)) if str(i) not in results]
+
+            already_stored = set()
+            if state["attempts"] > 1 and pending:
+                already_stored = existing_ticket_ids([items[i].get("id") for i in pending])
+
+            for start in range(0, len(pending), self.chunk_size):
+                chunk = pending[start:start + self.chunk_size]
+                to_process = []
+                for i in chunk:
+                    if items[i].get("id") in already_stored:
+                        results[str(i)] = {"id": items[i].get("id"), "status": "skipped"}
+                    else:
+                        to_process.append(i)
+                if to_process:
+                    for i, result in zip(to_process, ai_pipeline([items[i] for i in to_process])):
+                        results[str(i)] = result
+                state["processed"] = len(results)
+                state["failed"] = sum(1 for r in results.values() if "error" in r)
+                self._save(state)
+
+            state["status"] = "completed_with_errors" if state["failed"] else "completed"
+            self._save(state)
+        except Exception as e:
+            logger.exception("Ingest job %s failed: %s", job_id, e)
+            state = self._load(job_id)
+            if state is not None:
+                state["status"] = "failed"
+                state["error"] = str(e)
+                self._save(state)
+        finally:
+            lock.close()
+
+    def _path(self, job_id: str, suffix: str) -> str:
+        return os.path.join(self.job_dir, f"{job_id}{suffix}")
+
+    def _load(self, job_id: str) -> Optional[dict]:
+        try:
+            with open(self._path(job_id, ".json"), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _save(self, state: dict):
+        state["updated_at"] = datetime.datetime.utcnow().isoformat()
+        path = self._path(state["job_id"], ".json")
+        # write then rename, so a crash never leaves a half-written status file
+        with self._write_lock:
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(state, f)
+            os.replace(tmp, path)
+
+
+job_manager = IngestJobManager()
@@ -1,79 +1,303 @@
-print("⚡ Loading Hugging Face pipelines at startup...")
-
-_pipelines = {
-    "priority_pipe": pipeline("zero-shot-classification",
-                              model=os.getenv("PRIORITY_MODEL", "valhalla/distilbart-mnli-12-1")),
-    "topic_pipe": pipeline("zero-shot-classification",
-                           model=os.getenv("TOPIC_MODEL", "MoritzLaurer/deberta-v3-base-zeroshot-v1")),
-    "sentiment_pipe": pipeline("text-classification",
-                               model=os.getenv("SENTIMENT_MODEL", "michellejieli/emotion_text_classifier")),
-    "keywords_pipe": pipeline("text2text-generation",
-                              model=os.getenv("KEYWORDS_MODEL", "ml6team/keyphrase-generation-t5-base-inspec")),
+import os
+import time
+from transformers import pipeline
+from .topic_prototypes import TOPIC_ENGINE, TOPIC_PROTOTYPE_MODEL, TOPIC_PROTOTYPE_MARGIN, get_prototype_classifier
+from .inference_cache import cached_batch
+from .onnx_backend import use_onnx, build_onnx_pipeline
+from .model_registry import ModelRegistry, load_mode, prepare_for_fork
+from utils.metrics import span, timed
+from utils.log import get_logger
+
+logger = get_logger("ml_processing")
+
+# Number of texts sent through a pipeline in one forward pass by the *_batch functions
+INFERENCE_BATCH_SIZE = int(os.getenv("INFERENCE_BATCH_SIZE", 16))
+# Score priority and topic labels with the topic NLI model in one call (see priority_topic_calculation_batch)
+NLI_MULTITASK = os.getenv("NLI_MULTITASK", "0") == "1" and TOPIC_ENGINE == "nli"
+# Texts of the warmup inference run on every loaded pipeline before a worker serves traffic
+WARMUP_TEXTS = [
+    "I cannot log in with SSO since this morning, the connector fails with a timeout error.",
+    "How do I add a glossary term?",
+]
+
+PRIORITY_LABELS = ["Urgent", "Medium Urgency", "Not Urgent"]
+PRIORITY_MAP = {"Urgent": "P0", "Medium Urgency": "P1", "Not Urgent": "P2"}
+
+TOPIC_LABELS = ["How-to", "Product", "Connector", "Lineage", "API/SDK", "SSO", "Glossary", "Best practices", "Sensitive data", "Integrations", "Errors", "Others"]
+
+EXACT_LABELS = ["Confused", "Curious", "Anxious", "Hopeful", "Frustrated", "Urgent"]
+
+# Map model’s labels → your EXACT_LABELS
+SENTIMENT_LABEL_MAP = {
+    "anger": "Frustrated",
+    "disgust": "Confused",
+    "fear": "Anxious",
+    "joy": "Hopeful",
+    "neutral": "Curious",
+    "sadness": "Urgent"
+}
+
+
+def _priority_from_result(result: dict) -> str:
+    return PRIORITY_MAP.get(result['labels'][0], "Unknown")
+
+
+def _keywords_from_result(result) -> str:
+    # a single text gives [{'generated_text': ...}], a list of texts gives one dict per text
+    if isinstance(result, list):
+        result = result[0]
+    keywords_list = [kw.strip() for kw in result['generated_text'].split(',')]
+    return ', '.join(keywords_list)
+
+
+def _topic_from_result(result: dict) -> str:
+    return result['labels'][0]
+
+
+def _sentiment_from_result(predictions) -> str:
+    # all-scores mode gives a list of {'label', 'score'} per text, top-1 mode gives a single dict
+    if isinstance(predictions, dict):
+        predictions = [predictions]
+    if not predictions or not isinstance(predictions, list):
+        return "Confused"  # fallback
+
+    # Take the top-scoring label
+    top_pred = max(predictions, key=lambda x: x["score"])
+    return SENTIMENT_LABEL_MAP.get(top_pred["label"].lower(), "Confused")
+
+
+# task, model env var / default, pipeline kwargs, call kwargs and label post-processing of each model
+MODEL_SPECS = {
+    "priority": {"task": "zero-shot-classification", "env": "PRIORITY_MODEL",
+                 "default": "valhalla/distilbart-mnli-12-1", "kwargs": {},
+                 "call_kwargs": {"candidate_labels": PRIORITY_LABELS}, "postprocess": _priority_from_result},
+    "topic": {"task": "zero-shot-classification", "env": "TOPIC_MODEL",
+              "default": "MoritzLaurer/deberta-v3-base-zeroshot-v1", "kwargs": {},
+              "call_kwargs": {"candidate_labels": TOPIC_LABELS}, "postprocess": _topic_from_result},
+    "sentiment": {"task": "text-classification", "env": "SENTIMENT_MODEL",
+                  "default": "michellejieli/emotion_text_classifier", "kwargs": {},
+                  "call_kwargs": {}, "postprocess": lambda r: _sentiment_from_result(r[0] if isinstance(r, list) else r)},
+    "keywords": {"task": "text2text-generation", "env": "KEYWORDS_MODEL",
+                 "default": "ml6team/keyphrase-generation-t5-base-inspec", "kwargs": {"max_new_tokens": 64},
+                 "call_kwargs": {}, "postprocess": _keywords_from_result},
 }
 
-print("✅ All Hugging Face models loaded.")
 
+def model_id_for(name: str) -> str:
+    spec = MODEL_SPECS[name]
+    return os.getenv(spec["env"], spec["default"])
+
+
+def _load_pipeline(name: str, model_id: str = None, **kwargs):
+    """
+    Builds the Hugging Face pipeline for MODEL_SPECS[name] on the configured backend:
+    ONNX Runtime when use_onnx(name) (INFERENCE_BACKEND=onnx), eager PyTorch otherwise.
+    """
+    spec = MODEL_SPECS[name]
+    model_id = model_id or model_id_for(name)
+    kwargs = {**spec["kwargs"], **kwargs}
+    if use_onnx(name):
+        kwargs.pop("device", None)
+        return build_onnx_pipeline(spec["task"], model_id, **kwargs)
+    return pipeline(spec["task"], model=model_id, **kwargs)
+
+
+registry = ModelRegistry()
+for _name in MODEL_SPECS:
+    # the NLI topic model is only a fallback for the prototype engine, so it is lazy there by default,
+    # the priority model is not used at all in multitask mode
+    _default_mode = None
+    if (_name == "topic" and TOPIC_ENGINE == "prototype") or (_name == "priority" and NLI_MULTITASK):
+        _default_mode = "lazy"
+    registry.register(_name, lambda _name=_name: _load_pipeline(_name), eager=load_mode(_name, _default_mode) == "eager")
+
+logger.info("⚡ Loading Hugging Face pipelines at startup...")
+registry.load_eager()
+logger.info("✅ All Hugging Face models loaded.")
+
+# loaded pipelines by canonical name, kept for callers that import it
+_pipelines = registry.pipelines
+
+
+def _model_key(name: str) -> str:
+    """
+    Describes what produces a stage's output (model, backend, engine) for the inference cache,
+    so switching any of them does not serve results computed by the previous setup.
+    """
+    key = f"{model_id_for(name)}:{'onnx' if use_onnx(name) else 'torch'}"
+    if name == "topic" and TOPIC_ENGINE == "prototype":
+        key = f"prototype:{TOPIC_PROTOTYPE_MODEL}:{TOPIC_PROTOTYPE_MARGIN}:{key}"
+    return key
+
+
+def preload_models(all_models: bool = False):
+    """
+    Loads the eager models (every model with all_models=True) now and freezes the heap for fork.
+    Call from the gunicorn master (preload_app) so workers share the read-only weights through copy-on-write.
+    """
+    if all_models:
+        registry.preload()
+    else:
+        registry.load_eager()
+    if TOPIC_ENGINE == "prototype":
+        get_prototype_classifier(TOPIC_LABELS)
+    prepare_for_fork()
+
+
+def warmup_models() -> dict:
+    """
+    Runs one batched inference through every loaded pipeline (and the prototype topic encoder when it is
+    the topic engine), so lazy allocations and kernel selection happen before the first real request.
+    Warmup results bypass the inference cache. Returns {name: seconds or error message}.
+    """
+    report = {}
+    for name in registry.names():
+        if not registry.is_loaded(name):
+            continue
+        spec = MODEL_SPECS[name]
+        started = time.perf_counter()
+        try:
+            registry.get(name)(WARMUP_TEXTS, batch_size=len(WARMUP_TEXTS), **spec["call_kwargs"])
+        except Exception as e:
+            logger.warning("Warmup of model %s failed: %s", name, e)
+            report[name] = f"error: {e}"
+            continue
+        elapsed = time.perf_counter() - started
+        registry.mark_warm(name, elapsed)
+        report[name] = round(elapsed, 3)
+
+    if TOPIC_ENGINE == "prototype":
+        started = time.perf_counter()
+        try:
+            get_prototype_classifier(TOPIC_LABELS).scores(WARMUP_TEXTS)
+            report["topic_prototypes"] = round(time.perf_counter() - started, 3)
+        except Exception as e:
+            logger.warning("Warmup of the prototype topic engine failed: %s", e)
+            report["topic_prototypes"] = f"error: {e}"
+    logger.info("Warmed up models: %s", report)
+    return report
+
+
+def models_ready() -> dict:
+    """
+    Readiness of each model in this process: "ready" (loaded and warmed up), "cold" (eager and loaded,
+    no warmup yet), "loading" (eager, not loaded yet) or "lazy" (loaded on first use, does not gate readiness).
+    """
+    states = {}
+    for name in registry.names():
+        if registry.is_warm(name):
+            states[name] = "ready"
+        elif not registry.is_eager(name):
+            states[name] = "lazy"
+        else:
+            states[name] = "cold" if registry.is_loaded(name) else "loading"
+    return states
+
+
+def model_stats() -> dict:
+    """
+    Per-model load state, load time and memory (see ModelRegistry.stats).
+    """
+    return registry.stats()
+
+
+def _priority_pipe():
+    return registry.get("priority")
+
+
+def _keyword_pipe():
+    return registry.get("keywords")
+
+
+def _topic_pipe():
+    return registry.get("topic")
+
+
+def _sentiment_pipe():
+    return registry.get("sentiment")
+
+
+def run_batched(run_fn, texts: list, batch_size: int = None) -> list:
+    """
+    Runs run_fn over texts in batches and returns one output per text, in input order.
+    run_fn takes a list of texts and returns a list of outputs of the same length.
+    Texts are sorted by length before batching so each batch pads to a similar length.
+    If a whole batch fails, its texts are retried one by one so a bad ticket only fails itself;
+    the output for a text that still fails is the Exception it raised.
+    """
+    batch_size = max(1, batch_size or INFERENCE_BATCH_SIZE)
+    outputs = [None] * len(texts)
+    order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+
+    for start in range(0, len(order), batch_size):
+        indices = order[start:start + batch_size]
+        try:
+            batch_outputs = run_fn([texts[i] for i in indices])
+            for i, output in zip(indices, batch_outputs):
+                outputs[i] = output
+        except Exception:
+            for i in indices:
+                try:
+                    outputs[i] = run_fn([texts[i]])[0]
+                except Exception as e:
+                    outputs[i] = e
+    return outputs
+
+
+def _map_outputs(outputs: list, convert) -> list:
+    results = []
+    for output in outputs:
+        if isinstance(output, Exception):
+            results.append(output)
+            continue
+        try:
+            results.append(convert(output))
+        except Exception as e:
+            results.append(e)
+    return results
+
+
+@timed("model_priority")
 def priority_calculation(text: str) -> str:
     """
     Calculates priority from the given text using a zero-shot classification model.
     """
-    if "priority_pipe" not in _pipelines:
-        model_id = os.getenv("PRIORITY_MODEL", "valhalla/distilbart-mnli-12-1")
-        _pipelines["priority_pipe"] = pipeline("zero-shot-classification", model=model_id)
+    pipe = _priority_pipe()
+    result = pipe(text, candidate_labels=PRIORITY_LABELS)
+    return _priority_from_result(result)
 
-    pipe = _pipelines["priority_pipe"]
-    
-    LABELS = ["Urgent", "Medium Urgency", "Not Urgent"]
-    PRIORITY_MAP = {"Urgent": "P0", "Medium Urgency": "P1", "Not Urgent": "P2"}
-
-    result = pipe(text, candidate_labels=LABELS)
-    priority_label = result['labels'][0]
-    return PRIORITY_MAP.get(priority_label, "Unknown")
+@timed("model_keywords")
 def keyword_calculation(text: str) -> str:
     """
     Calculates keywords from the given text using a text-to-text generation model.
     """
-    if "keyword_pipe" not in _pipelines:
-        model_id = os.getenv("KEYWORDS_MODEL", "ml6team/keyphrase-generation-t5-base-inspec")
-        _pipelines["keyword_pipe"] = pipeline("text2text-generation", model=model_id, max_new_tokens=64)
-
-    pipe = _pipelines["keyword_pipe"]
-    
+    pipe = _keyword_pipe()
     result = pipe(text)
-    keywords_str = result[0]['generated_text']
-
-    keywords_list = [kw.strip() for kw in keywords_str.split(',')]
-    return ', '.join(keywords_list)
+    return _keywords_from_result(result)
 
 
 def topic_calculation(text: str) -> str:
     """
-    Calculates topic from the given text using a zero-shot classification model."""
-    if "topic_pipe" not in _pipelines:
-        model_id = os.getenv("TOPIC_MODEL", "MoritzLaurer/deberta-v3-base-zeroshot-v1")
-        _pipelines["topic_pipe"] = pipeline("zero-shot-classification", model=model_id)
-    
-    pipe = _pipelines["topic_pipe"]
+    Calculates topic from the given text using a zero-shot classification model.
+    With TOPIC_ENGINE=prototype it uses the embedding-prototype classifier instead (see topic_calculation_batch)."""
+    if TOPIC_ENGINE == "prototype":
+        topic = topic_calculation_batch([text])[0]
+        if isinstance(topic, Exception):
+            raise topic
+        return topic
 
-    TOPIC_LABELS = ["How-to", "Product", "Connector", "Lineage", "API/SDK", "SSO", "Glossary", "Best practices", "Sensitive data", "Integrations", "Errors", "Others"]
-
-    result = pipe(text, candidate_labels=TOPIC_LABELS)
-    return result['labels'][0]
+    with span("model_topic"):
+        pipe = _topic_pipe()
+        result = pipe(text, candidate_labels=TOPIC_LABELS)
+    return _topic_from_result(result)
 
+@timed("model_sentiment")
 def sentiment_analyser(text: str) -> str:
     """
     Analyzes sentiment from the given text using michellejieli/emotion_text_classifier.
     Returns one of the EXACT_LABELS to keep output consistent.
     """
-
-    if "sentiment_pipe" not in _pipelines:
-        model_id = os.getenv("SENTIMENT_EXACT_MODEL", "michellejieli/emotion_text_classifier")
-        # This model gives multi-class predictions → set top_k=None so we get all labels
-        _pipelines["sentiment_pipe"] = pipeline("text-classification", model=model_id, return_all_scores=True, device=-1)
-
-    pipe = _pipelines["sentiment_pipe"]
-
-    EXACT_LABELS = ["Confused", "Curious", "Anxious", "Hopeful", "Frustrated", "Urgent"]
+    pipe = _sentiment_pipe()
 
     # Run classification (returns list of list: [[{'label': 'joy', 'score': ...}, ...]])
     results = pipe(text)
@@ -81,19 +305,125 @@ def sentiment_analyser(text: str) -> str:
     if not results or not isinstance(results, list):
         return "Confused"  # fallback
 
-    # Take the top-scoring label
-    predictions = results[0]  # inner list
-    top_pred = max(predictions, key=lambda x: x["score"])
-    model_label = top_pred["label"].lower()
-
-    # Map model’s labels → your EXACT_LABELS
-    label_map = {
-        "anger": "Frustrated",
-        "disgust": "Confused",
-        "fear": "Anxious",
-        "joy": "Hopeful",
-        "neutral": "Curious",
-        "sadness": "Urgent"
-    }
-
-    return label_map.get(model_label, "Confused")
+    return _sentiment_from_result(results[0])
+
+
+def priority_calculation_batch(texts: list, batch_size: int = None) -> list:
+    """
+    Batched priority_calculation. Returns one priority per text, or the Exception for texts that failed.
+    Texts already seen by the same model are served from the inference cache.
+    """
+    return cached_batch("priority", _model_key("priority"), texts,
+                        lambda misses: _priority_batch(misses, batch_size))
+
+
+@timed("model_priority")
+def _priority_batch(texts: list, batch_size: int = None) -> list:
+    pipe = _priority_pipe()
+    outputs = run_batched(
+        lambda batch: pipe(batch, candidate_labels=PRIORITY_LABELS, batch_size=len(batch)),
+        texts, batch_size
+    )
+    return _map_outputs(outputs, _priority_from_result)
+
+
+def keyword_calculation_batch(texts: list, batch_size: int = None) -> list:
+    """
+    Batched keyword_calculation. Returns one keyword string per text, or the Exception for texts that failed.
+    Texts already seen by the same model are served from the inference cache.
+    """
+    return cached_batch("keywords", _model_key("keywords"), texts,
+                        lambda misses: _keyword_batch(misses, batch_size))
+
+
+@timed("model_keywords")
+def _keyword_batch(texts: list, batch_size: int = None) -> list:
+    pipe = _keyword_pipe()
+    outputs = run_batched(lambda batch: pipe(batch, batch_size=len(batch)), texts, batch_size)
+    return _map_outputs(outputs, _keywords_from_result)
+
+
+def topic_calculation_batch(texts: list, batch_size: int = None) -> list:
+    """
+    Batched topic_calculation. Returns one topic per text, or the Exception for texts that failed.
+    TOPIC_ENGINE=prototype classifies the whole list with one sentence-encoder pass against label prototypes
+    (pipeline/topic_prototypes.py) and only sends low-margin texts to the NLI pipeline.
+    Texts already seen by the same engine are served from the inference cache.
+    """
+    return cached_batch("topic", _model_key("topic"), texts,
+                        lambda misses: _topic_batch(misses, batch_size))
+
+
+@timed("model_topic")
+def _topic_batch(texts: list, batch_size: int = None) -> list:
+    if TOPIC_ENGINE == "prototype" and texts:
+        try:
+            classifier = get_prototype_classifier(TOPIC_LABELS)
+            return classifier.classify(texts, batch_size or INFERENCE_BATCH_SIZE,
+                                       fallback=lambda uncertain: nli_topic_batch(uncertain, batch_size))
+        except Exception as e:
+            logger.warning("Prototype topic engine failed, using NLI: %s", e)
+    return nli_topic_batch(texts, batch_size)
+
+
+def nli_topic_batch(texts: list, batch_size: int = None) -> list:
+    """
+    Zero-shot NLI topic classification over TOPIC_LABELS, one topic (or Exception) per text.
+    """
+    pipe = _topic_pipe()
+    outputs = run_batched(
+        lambda batch: pipe(batch, candidate_labels=TOPIC_LABELS, batch_size=len(batch)),
+        texts, batch_size
+    )
+    return _map_outputs(outputs, _topic_from_result)
+
+
+def sentiment_analyser_batch(texts: list, batch_size: int = None) -> list:
+    """
+    Batched sentiment_analyser. Returns one of the EXACT_LABELS per text, or the Exception for texts that failed.
+    Texts already seen by the same model are served from the inference cache.
+    """
+    return cached_batch("sentiment", _model_key("sentiment"), texts,
+                        lambda misses: _sentiment_batch(misses, batch_size))
+
+
+@timed("model_sentiment")
+def _sentiment_batch(texts: list, batch_size: int = None) -> list:
+    pipe = _sentiment_pipe()
+    outputs = run_batched(lambda batch: pipe(batch, batch_size=len(batch)), texts, batch_size)
+    return _map_outputs(outputs, _sentiment_from_result)
+
+
+def _split_multitask_result(result: dict):
+    priority_label = next(label for label in result['labels'] if label in PRIORITY_MAP)
+    topic = next(label for label in result['labels'] if label in TOPIC_LABELS)
+    return PRIORITY_MAP[priority_label], topic
+
+
+def priority_topic_calculation_batch(bodies: list, combined: list, batch_size: int = None):
+    """
+    Priority (from bodies) and topic (from subject + body) for a batch, returned as (priorities, topics).
+    With NLI_MULTITASK=1 a single zero-shot call on the topic NLI model scores all 15 priority + topic
+    hypotheses per ticket against subject + body, and the labels are split back per task; the priority
+    model is then never loaded. Entailment scores are softmaxed across all 15 labels, which keeps the
+    ranking inside each label set unchanged, so the topic matches a separate topic call exactly.
+    """
+    if not NLI_MULTITASK:
+        return priority_calculation_batch(bodies, batch_size), topic_calculation_batch(combined, batch_size)
+
+    split = cached_batch("priority_topic", _model_key("topic"), combined,
+                         lambda misses: _multitask_batch(misses, batch_size))
+    priorities = [r if isinstance(r, Exception) else r[0] for r in split]
+    topics = [r if isinstance(r, Exception) else r[1] for r in split]
+    return priorities, topics
+
+
+@timed("model_priority_topic")
+def _multitask_batch(texts: list, batch_size: int = None) -> list:
+    pipe = _topic_pipe()
+    labels = PRIORITY_LABELS + TOPIC_LABELS
+    outputs = run_batched(
+        lambda batch: pipe(batch, candidate_labels=labels, batch_size=len(batch)),
+        texts, batch_size
+    )
+    return _map_outputs(outputs, lambda result: list(_split_multitask_result(result)))
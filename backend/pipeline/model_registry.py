@@ -0,0 +1,134 @@
+import gc
+import os
+import time
+import threading
+from typing import Callable, Dict, Any, Optional, List
+from dotenv import load_dotenv
+from utils.log import get_logger
+load_dotenv()
+
+logger = get_logger("model_registry")
+
+# default load mode of every model, "eager" (at import) or "lazy" (on first use);
+# override per model with <NAME>_MODEL_LOAD, e.g. KEYWORDS_MODEL_LOAD=lazy
+MODEL_LOAD_MODE = os.getenv("MODEL_LOAD_MODE", "eager")
+
+
+def load_mode(name: str, default: str = None) -> str:
+    return os.getenv(f"{name.upper()}_MODEL_LOAD", default or MODEL_LOAD_MODE)
+
+
+def _rss_bytes() -> Optional[int]:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _parameter_bytes(pipe) -> Optional[int]:
+    model = getattr(pipe, "model", None)
+    if model is None or not hasattr(model, "parameters"):
+        return None
+    try:
+        return sum(p.numel() * p.element_size() for p in model.parameters())
+    except Exception:
+        return None
+
+
+class ModelRegistry:
+    """
+    Loads each model once, under its canonical name, no matter how many callers ask for it.
+    Models are registered with a zero-argument factory and are loaded either by load_eager()
+    (at import, or in the gunicorn master via preload()) or on the first get().
+    Records load time, parameter memory and the RSS growth seen while loading each model, and whether
+    a warmup inference has run on it in this process.
+    """
+
+    def __init__(self):
+        self._factories: Dict[str, Callable] = {}
+        self._eager: Dict[str, bool] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+        self._stats: Dict[str, Dict[str, Any]] = {}
+        self._warm: Dict[str, int] = {}
+        self.pipelines: Dict[str, Any] = {}
+
+    def register(self, name: str, factory: Callable, eager: bool = True):
+        self._factories[name] = factory
+        self._eager[name] = eager
+        self._locks[name] = threading.Lock()
+
+    def get(self, name: str):
+        pipe = self.pipelines.get(name)
+        if pipe is not None:
+            return pipe
+        if name not in self._factories:
+            raise KeyError(f"Unknown model: {name}")
+        with self._locks[name]:
+            if name not in self.pipelines:
+                self._load(name)
+        return self.pipelines[name]
+
+    def set(self, name: str, pipe):
+        """Installs an already built pipeline under name (stand-in models for benchmarks)."""
+        self.pipelines[name] = pipe
+        self._stats[name] = {"load_seconds": 0.0, "parameter_bytes": _parameter_bytes(pipe), "rss_delta_bytes": None}
+
+    def is_loaded(self, name: str) -> bool:
+        return name in self.pipelines
+
+    def is_eager(self, name: str) -> bool:
+        return self._eager[name]
+
+    def names(self) -> List[str]:
+        return list(self._factories)
+
+    def mark_warm(self, name: str, seconds: float):
+        """Records that a warmup inference ran on name in this process."""
+        self._warm[name] = os.getpid()
+        self._stats.setdefault(name, {})["warmup_seconds"] = round(seconds, 3)
+
+    def is_warm(self, name: str) -> bool:
+        # a warmup run in the gunicorn master does not count for the forked workers
+        return self._warm.get(name) == os.getpid()
+
+    def load_eager(self):
+        self.preload([name for name, eager in self._eager.items() if eager])
+
+    def preload(self, names: List[str] = None):
+        """Loads names (default: every registered model) now."""
+        for name in names if names is not None else list(self._factories):
+            self.get(name)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {
+            name: {"loaded": name in self.pipelines, "eager": self._eager[name], "warm": self.is_warm(name),
+                   **self._stats.get(name, {})}
+            for name in self._factories
+        }
+
+    def _load(self, name: str):
+        logger.info("⚡ Loading model %s...", name)
+        rss_before = _rss_bytes()
+        started = time.perf_counter()
+        pipe = self._factories[name]()
+        elapsed = time.perf_counter() - started
+        rss_after = _rss_bytes()
+        self._stats[name] = {
+            "load_seconds": round(elapsed, 3),
+            "parameter_bytes": _parameter_bytes(pipe),
+            "rss_delta_bytes": rss_after - rss_before if rss_before is not None and rss_after is not None else None,
+        }
+        self.pipelines[name] = pipe
+        logger.info("✅ Loaded model %s in %.1fs", name, elapsed)
+
+
+def prepare_for_fork():
+    """
+    Call in the gunicorn master after preloading, right before workers are forked.
+    Moves every live object to the permanent GC generation so the workers' garbage collector does not
+    write to (and copy-on-write duplicate) the pages holding the shared model weights.
+    """
+    gc.collect()
+    if hasattr(gc, "freeze"):
+        gc.freeze()
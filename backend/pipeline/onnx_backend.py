@@ -0,0 +1,213 @@
+import os
+import re
+import json
+import time
+import fcntl
+import shutil
+import argparse
+import tempfile
+from typing import Callable, List
+from dotenv import load_dotenv
+from utils.log import get_logger
+load_dotenv()
+
+logger = get_logger("onnx_backend")
+
+# "torch" (eager PyTorch fp32) or "onnx" (ONNX Runtime, int8 dynamic quantisation by default).
+# onnx needs the optional dependencies: pip install -r requirements-onnx.txt
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "torch")
+# which models use the onnx backend when it is enabled, comma separated names from ml_processing.MODEL_SPECS
+ONNX_MODELS = [m.strip() for m in os.getenv("ONNX_MODELS", "priority,topic,sentiment,keywords").split(",") if m.strip()]
+# relative to backend/ by default, shared by every worker whatever its working directory
+ONNX_CACHE_DIR = os.getenv(
+    "ONNX_CACHE_DIR", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "onnx_models")
+)
+ONNX_QUANTIZE = os.getenv("ONNX_QUANTIZE", "1") == "1"
+# instruction set the int8 kernels are tuned for: avx2, avx512 or avx512_vnni
+ONNX_QUANT_ARCH = os.getenv("ONNX_QUANT_ARCH", "avx2")
+# 0 lets ONNX Runtime pick (one thread per physical core); gunicorn.conf.py splits the cores between workers
+ORT_INTRA_OP_THREADS = int(os.getenv("ORT_INTRA_OP_THREADS", 0))
+ORT_INTER_OP_THREADS = int(os.getenv("ORT_INTER_OP_THREADS", 1))
+
+_SEQ2SEQ_TASKS = ("text2text-generation",)
+
+
+def use_onnx(name: str) -> bool:
+    """
+    True when the model called name (priority, topic, sentiment, keywords) should run on ONNX Runtime.
+    """
+    return INFERENCE_BACKEND == "onnx" and name in ONNX_MODELS
+
+
+def _model_classes(task: str):
+    try:
+        from optimum.onnxruntime import ORTModelForSequenceClassification, ORTModelForSeq2SeqLM
+    except ImportError as e:
+        raise ImportError("INFERENCE_BACKEND=onnx needs optimum[onnxruntime]: pip install -r requirements-onnx.txt") from e
+    return ORTModelForSeq2SeqLM if task in _SEQ2SEQ_TASKS else ORTModelForSequenceClassification
+
+
+def _cache_dir(model_id: str, variant: str) -> str:
+    return os.path.join(ONNX_CACHE_DIR, re.sub(r"[^A-Za-z0-9_.-]", "__", model_id), variant)
+
+
+def _build_once(target_dir: str, build: Callable[[str], None]):
+    """
+    Runs build(tmp_dir) and moves the result to target_dir, unless target_dir already exists.
+    Several processes (gunicorn workers) may ask for the same model at once: a flock on a per-directory
+    lock file lets one of them build while the others wait, and the build happens in a temporary
+    directory renamed into place, so target_dir never holds a partial export, even after a crash.
+    """
+    if os.path.isdir(target_dir):
+        return
+    parent = os.path.dirname(target_dir)
+    os.makedirs(parent, exist_ok=True)
+    with open(target_dir + ".lock", "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            if os.path.isdir(target_dir):
+                return
+            tmp_dir = tempfile.mkdtemp(prefix=os.path.basename(target_dir) + ".tmp-", dir=parent)
+            try:
+                build(tmp_dir)
+                os.replace(tmp_dir, target_dir)
+            except BaseException:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+                raise
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def export_model(task: str, model_id: str) -> str:
+    """
+    Exports model_id to ONNX (once, cached under ONNX_CACHE_DIR) and, with ONNX_QUANTIZE, applies dynamic
+    int8 quantisation. Returns the directory of the model to load.
+    """
+    from transformers import AutoTokenizer
+
+    model_class = _model_classes(task)
+    fp32_dir = _cache_dir(model_id, "fp32")
+
+    def export(out_dir: str):
+        logger.info("Exporting %s to ONNX in %s", model_id, fp32_dir)
+        model = model_class.from_pretrained(model_id, export=True)
+        model.save_pretrained(out_dir)
+        AutoTokenizer.from_pretrained(model_id).save_pretrained(out_dir)
+
+    _build_once(fp32_dir, export)
+    if not ONNX_QUANTIZE:
+        return fp32_dir
+
+    int8_dir = _cache_dir(model_id, f"int8-{ONNX_QUANT_ARCH}")
+
+    def quantize(out_dir: str):
+        from optimum.onnxruntime import ORTQuantizer
+        from optimum.onnxruntime.configuration import AutoQuantizationConfig
+
+        logger.info("Quantising %s to int8 in %s", model_id, int8_dir)
+        qconfig = getattr(AutoQuantizationConfig, ONNX_QUANT_ARCH)(is_static=False, per_channel=False)
+        for file_name in sorted(f for f in os.listdir(fp32_dir) if f.endswith(".onnx")):
+            quantizer = ORTQuantizer.from_pretrained(fp32_dir, file_name=file_name)
+            quantizer.quantize(save_dir=out_dir, quantization_config=qconfig)
+        for file_name in os.listdir(fp32_dir):
+            if not file_name.endswith(".onnx") and not os.path.exists(os.path.join(out_dir, file_name)):
+                shutil.copy(os.path.join(fp32_dir, file_name), out_dir)
+
+    _build_once(int8_dir, quantize)
+    return int8_dir
+
+
+def build_onnx_pipeline(task: str, model_id: str, **kwargs):
+    """
+    Same Hugging Face pipeline as transformers.pipeline(task, model=model_id, **kwargs), but the model runs
+    through ONNX Runtime on CPU with ORT_INTRA_OP_THREADS / ORT_INTER_OP_THREADS.
+    """
+    import onnxruntime as ort
+    from transformers import AutoTokenizer, pipeline
+
+    model_class = _model_classes(task)
+    model_dir = export_model(task, model_id)
+
+    session_options = ort.SessionOptions()
+    session_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    session_options.intra_op_num_threads = ORT_INTRA_OP_THREADS
+    session_options.inter_op_num_threads = ORT_INTER_OP_THREADS
+
+    load_kwargs = {"session_options": session_options, "provider": "CPUExecutionProvider"}
+    if ONNX_QUANTIZE:
+        if task in _SEQ2SEQ_TASKS:
+            load_kwargs["encoder_file_name"] = "encoder_model_quantized.onnx"
+            load_kwargs["decoder_file_name"] = "decoder_model_quantized.onnx"
+            if os.path.exists(os.path.join(model_dir, "decoder_with_past_model_quantized.onnx")):
+                load_kwargs["decoder_with_past_file_name"] = "decoder_with_past_model_quantized.onnx"
+        else:
+            load_kwargs["file_name"] = "model_quantized.onnx"
+
+    model = model_class.from_pretrained(model_dir, **load_kwargs)
+    tokenizer = AutoTokenizer.from_pretrained(model_dir)
+    return pipeline(task, model=model, tokenizer=tokenizer, **kwargs)
+
+
+def parity(texts: List[str], names: List[str]) -> dict:
+    """
+    Runs each named model through the PyTorch and the ONNX backend on texts and reports label agreement
+    and time per backend, so a model can be switched to ONNX (ONNX_MODELS) with confidence.
+    """
+    from transformers import pipeline
+    from .ml_processing import MODEL_SPECS, model_id_for
+
+    report = {"samples": len(texts)}
+    for name in names:
+        spec = MODEL_SPECS[name]
+        model_id = model_id_for(name)
+        labels = {}
+        timings = {}
+        for backend in ("torch", "onnx"):
+            if backend == "onnx":
+                pipe = build_onnx_pipeline(spec["task"], model_id, **spec["kwargs"])
+            else:
+                pipe = pipeline(spec["task"], model=model_id, **spec["kwargs"])
+            started = time.perf_counter()
+            labels[backend] = [spec["postprocess"](pipe(text, **spec["call_kwargs"])) for text in texts]
+            timings[backend] = round(time.perf_counter() - started, 3)
+        agree = sum(a == b for a, b in zip(labels["torch"], labels["onnx"]))
+        report[name] = {
+            "model": model_id,
+            "agreement": round(agree / len(texts), 4) if texts else 0.0,
+            "torch_seconds": timings["torch"],
+            "onnx_seconds": timings["onnx"],
+            "disagreements": [
+                {"text": t[:200], "torch": a, "onnx": b}
+                for t, a, b in zip(texts, labels["torch"], labels["onnx"]) if a != b
+            ][:20],
+        }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ONNX Runtime backend for the ml_processing models.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    export_parser = sub.add_parser("export", help="export (and quantise) models into ONNX_CACHE_DIR")
+    export_parser.add_argument("--models", default=",".join(ONNX_MODELS))
+    parity_parser = sub.add_parser("parity", help="compare ONNX and PyTorch labels on a sample of tickets")
+    parity_parser.add_argument("input", help="JSON list of tickets with subject/body")
+    parity_parser.add_argument("--models", default=",".join(ONNX_MODELS))
+    parity_parser.add_argument("--limit", type=int, default=200)
+    args = parser.parse_args()
+
+    from .ml_processing import MODEL_SPECS, model_id_for
+
+    names = [n.strip() for n in args.models.split(",") if n.strip()]
+    if args.command == "export":
+        for name in names:
+            print(export_model(MODEL_SPECS[name]["task"], model_id_for(name)))
+        return
+
+    with open(args.input, encoding="utf-8") as f:
+        tickets = json.load(f)[:args.limit]
+    texts = [f"{t.get('subject', '')} {t.get('body', '')}".strip() for t in tickets]
+    print(json.dumps(parity(texts, names), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,307 @@
+import os
+import json
+import argparse
+import datetime
+import sqlite3
+import threading
+from typing import Optional
+from dotenv import load_dotenv
+from utils.log import get_logger
+load_dotenv()
+
+logger = get_logger("ticket_aggregates")
+
+TICKET_AGGREGATES_ENABLED = os.getenv("TICKET_AGGREGATES_ENABLED", "1") == "1"
+# relative to backend/ by default, so every worker and the CLI use the same file whatever their working directory
+TICKET_AGGREGATES_PATH = os.getenv(
+    "TICKET_AGGREGATES_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "ticket_aggregates.sqlite3"),
+)
+
+# payload fields the dashboards break tickets down by
+DIMENSIONS = ["priority", "topics", "sentiment"]
+BUCKETS = ("day", "week", "month")
+
+# created as tickets/counts, and as tickets_rebuild/counts_rebuild staging tables during a rebuild
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS {tickets} (
+    point_id TEXT PRIMARY KEY,
+    day TEXT NOT NULL,
+    priority TEXT NOT NULL,
+    topics TEXT NOT NULL,
+    sentiment TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS {counts} (
+    dimension TEXT NOT NULL,
+    value TEXT NOT NULL,
+    day TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (dimension, value, day)
+);
+"""
+
+
+def _label(value) -> str:
+    if isinstance(value, list):
+        value = ",".join(str(v) for v in value)
+    return str(value) if value not in (None, "") else "unknown"
+
+
+def _day(created_at) -> str:
+    """ISO day of created_at, "unknown" when it is missing or not an ISO date (e.g. "12/03/2024")."""
+    if isinstance(created_at, datetime.datetime):
+        return created_at.date().isoformat()
+    try:
+        return datetime.date.fromisoformat(str(created_at or "")[:10]).isoformat()
+    except ValueError:
+        return "unknown"
+
+
+def _bucket_of(day: str, bucket: str) -> str:
+    if bucket == "day" or day == "unknown":
+        return day
+    if bucket == "month":
+        return day[:7]
+    try:
+        year, week, _ = datetime.date.fromisoformat(day).isocalendar()
+    except ValueError:
+        # a day stored before _day validated it, fixed by the next rebuild
+        return "unknown"
+    return f"{year}-W{week:02d}"
+
+
+class TicketAggregates:
+    """
+    Ticket counts by priority, topic and sentiment per created_at day, kept in a local SQLite (WAL) file.
+    Every stored ticket is also indexed by point ID, so re-uploading a ticket moves its counts to its
+    new labels instead of counting it twice. Reads only touch the counts table, whose size depends on
+    the number of labels and days, not on the number of tickets.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._conn().executescript(_SCHEMA.format(tickets="tickets", counts="counts"))
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def record(self, points: list):
+        """
+        Counts points (PointStructs or anything with .id and .payload) that were written to QDRANT_COLLECTION_2.
+        Recording the same point again with the same payload changes nothing.
+        While a rebuild is running (in any process) the points are also recorded in its staging tables,
+        so tickets ingested during the rebuild survive the swap.
+        """
+        self._record(points, "tickets", "counts", mirror_rebuild=True)
+
+    def _record(self, points: list, tickets: str, counts: str, mirror_rebuild: bool = False,
+                overwrite: bool = True):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._record_locked(conn, points, tickets, counts, overwrite)
+            if mirror_rebuild and conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'tickets_rebuild'"
+            ).fetchone():
+                self._record_locked(conn, points, "tickets_rebuild", "counts_rebuild")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _record_locked(self, conn: sqlite3.Connection, points: list, tickets: str, counts: str,
+                       overwrite: bool = True):
+        for point in points:
+            payload = point.payload or {}
+            row = (_day(payload.get("created_at")),) + tuple(_label(payload.get(d)) for d in DIMENSIONS)
+            point_id = str(point.id)
+            old = conn.execute(
+                f"SELECT day, priority, topics, sentiment FROM {tickets} WHERE point_id = ?", (point_id,)
+            ).fetchone()
+            if old == row or (old is not None and not overwrite):
+                continue
+            if old is not None:
+                self._add(conn, counts, old, -1)
+            self._add(conn, counts, row, 1)
+            conn.execute(
+                f"INSERT OR REPLACE INTO {tickets} (point_id, day, priority, topics, sentiment) VALUES (?, ?, ?, ?, ?)",
+                (point_id,) + row
+            )
+
+    @staticmethod
+    def _add(conn: sqlite3.Connection, counts: str, row: tuple, delta: int):
+        day, labels = row[0], row[1:]
+        entries = [("total", "all", day, delta)] + [(d, v, day, delta) for d, v in zip(DIMENSIONS, labels)]
+        conn.executemany(
+            f"INSERT INTO {counts} (dimension, value, day, count) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (dimension, value, day) DO UPDATE SET count = count + excluded.count",
+            entries
+        )
+
+    def summary(self, bucket: str = "day", date_from: str = None, date_to: str = None) -> dict:
+        """
+        {"total": n, "by": {dimension: {label: n}}, "series": {dimension: {bucket: {label: n}}}, "bucket": bucket}
+        for the tickets created between date_from and date_to (ISO dates, inclusive).
+        """
+        if bucket not in BUCKETS:
+            raise ValueError(f"bucket must be one of {', '.join(BUCKETS)}")
+        query = "SELECT dimension, value, day, count FROM counts WHERE count != 0"
+        args = []
+        if date_from:
+            query += " AND day >= ?"
+            args.append(date_from[:10])
+        if date_to:
+            query += " AND day <= ?"
+            args.append(date_to[:10])
+
+        total = 0
+        by = {d: {} for d in DIMENSIONS}
+        series = {d: {} for d in ["total"] + DIMENSIONS}
+        for dimension, value, day, count in self._conn().execute(query, args):
+            key = _bucket_of(day, bucket)
+            if dimension == "total":
+                total += count
+                series["total"][key] = series["total"].get(key, 0) + count
+                continue
+            by[dimension][value] = by[dimension].get(value, 0) + count
+            labels = series[dimension].setdefault(key, {})
+            labels[value] = labels.get(value, 0) + count
+        series["total"] = dict(sorted(series["total"].items()))
+        for d in DIMENSIONS:
+            series[d] = dict(sorted(series[d].items()))
+        return {"total": total, "bucket": bucket, "by": by, "series": series}
+
+    def rebuild(self, client, collection_name: str, page_size: int = 1000) -> dict:
+        """
+        Recomputes everything from the collection: scrolls the label and created_at payload fields
+        (no vectors, no bodies) into staging tables, swaps them in with one transaction, then checks the
+        totals against Qdrant count queries. The per-point index that lets ingest move a re-uploaded
+        ticket's counts cannot be rebuilt from count queries, hence the scroll; they only verify it.
+        Until the swap, and if the scroll fails, summary() keeps serving the previous counts.
+        Ingest does not have to stop: record() also writes into the staging tables while they exist,
+        and the scroll only fills in points ingest has not recorded there, so a ticket updated during
+        the rebuild keeps its newest labels. Returns {"tickets": n, "mismatches": {dimension/label: (local, qdrant)}}.
+        """
+        from qdrant_client import models
+
+        conn = self._conn()
+        conn.executescript(
+            "DROP TABLE IF EXISTS tickets_rebuild; DROP TABLE IF EXISTS counts_rebuild;"
+            + _SCHEMA.format(tickets="tickets_rebuild", counts="counts_rebuild")
+        )
+        try:
+            offset = None
+            while True:
+                points, offset = client.scroll(
+                    collection_name=collection_name,
+                    limit=page_size,
+                    offset=offset,
+                    with_payload=["created_at"] + DIMENSIONS,
+                    with_vectors=False
+                )
+                self._record(points, "tickets_rebuild", "counts_rebuild", overwrite=False)
+                if offset is None:
+                    break
+        except Exception:
+            # ingest stops mirroring into the staging tables once they are gone
+            conn.executescript("DROP TABLE IF EXISTS tickets_rebuild; DROP TABLE IF EXISTS counts_rebuild;")
+            raise
+
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM tickets")
+            conn.execute("INSERT INTO tickets SELECT * FROM tickets_rebuild")
+            conn.execute("DELETE FROM counts")
+            conn.execute("INSERT INTO counts SELECT * FROM counts_rebuild")
+            conn.execute("DROP TABLE tickets_rebuild")
+            conn.execute("DROP TABLE counts_rebuild")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+        local = self.summary()
+        mismatches = {}
+        expected = client.count(collection_name=collection_name, exact=True).count
+        if expected != local["total"]:
+            mismatches["total"] = (local["total"], expected)
+        for dimension in DIMENSIONS:
+            for value, count in local["by"][dimension].items():
+                if value == "unknown" or "," in value:
+                    continue
+                expected = client.count(
+                    collection_name=collection_name,
+                    count_filter=models.Filter(must=[
+                        models.FieldCondition(key=dimension, match=models.MatchValue(value=value))
+                    ]),
+                    exact=True
+                ).count
+                if expected != count:
+                    mismatches[f"{dimension}/{value}"] = (count, expected)
+        return {"tickets": local["total"], "mismatches": mismatches}
+
+
+_aggregates = None
+_aggregates_lock = threading.Lock()
+
+
+def get_ticket_aggregates() -> Optional[TicketAggregates]:
+    """
+    Process-wide TicketAggregates, or None when TICKET_AGGREGATES_ENABLED=0.
+    """
+    global _aggregates
+    if not TICKET_AGGREGATES_ENABLED:
+        return None
+    if _aggregates is None:
+        with _aggregates_lock:
+            if _aggregates is None:
+                _aggregates = TicketAggregates(TICKET_AGGREGATES_PATH)
+    return _aggregates
+
+
+def record_ticket_points(points: list):
+    """
+    Writer callback: counts points once Qdrant has accepted them. Never raises, a failure here
+    must not fail the ingest; run the rebuild command to resynchronise.
+    """
+    aggregates = get_ticket_aggregates()
+    if aggregates is None or not points:
+        return
+    try:
+        aggregates.record(points)
+    except Exception as e:
+        logger.warning("Could not update ticket aggregates: %s", e)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ticket counts by priority, topic and sentiment.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    rebuild_parser = sub.add_parser("rebuild", help="recompute the aggregates from QDRANT_COLLECTION_2")
+    rebuild_parser.add_argument("--page-size", type=int, default=1000)
+    show_parser = sub.add_parser("show", help="print the aggregated counts")
+    show_parser.add_argument("bucket", nargs="?", default="day", choices=BUCKETS)
+    show_parser.add_argument("--from", dest="date_from", help="first created_at day, ISO date")
+    show_parser.add_argument("--to", dest="date_to", help="last created_at day, ISO date")
+    args = parser.parse_args()
+
+    aggregates = TicketAggregates(TICKET_AGGREGATES_PATH)
+    if args.command == "rebuild":
+        from .db_connector import client, COLLECTION_NAME
+        report = aggregates.rebuild(client, COLLECTION_NAME, args.page_size)
+        print(f"Rebuilt aggregates for {report['tickets']} tickets")
+        for key, (local, expected) in report["mismatches"].items():
+            print(f"  mismatch {key}: local {local}, qdrant {expected}")
+        return
+    print(json.dumps(aggregates.summary(args.bucket, args.date_from, args.date_to), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+import os
+import json
+import time
+import argparse
+import threading
+from typing import List, Dict, Optional
+import numpy as np
+from dotenv import load_dotenv
+load_dotenv()
+
+# "nli" (zero-shot DeBERTa, 12 hypotheses per ticket) or "prototype" (one encoder pass + cosine similarity)
+TOPIC_ENGINE = os.getenv("TOPIC_ENGINE", "nli")
+TOPIC_PROTOTYPE_MODEL = os.getenv("TOPIC_PROTOTYPE_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+# top-1 minus top-2 cosine similarity below which a ticket is sent to the NLI pipeline instead
+TOPIC_PROTOTYPE_MARGIN = float(os.getenv("TOPIC_PROTOTYPE_MARGIN", 0.03))
+# optional JSON file {label: [example ticket, ...]} mixed into the label prototypes
+TOPIC_SEED_EXAMPLES = os.getenv("TOPIC_SEED_EXAMPLES")
+
+TOPIC_DESCRIPTIONS = {
+    "How-to": "A question asking how to do something or for step by step instructions.",
+    "Product": "A question about product features, capabilities, UI behaviour or plans.",
+    "Connector": "An issue setting up, configuring or running a data source connector or crawler.",
+    "Lineage": "A question or problem about data lineage, upstream and downstream assets.",
+    "API/SDK": "A question about the REST API, SDKs, tokens, endpoints or programmatic access.",
+    "SSO": "A problem with single sign-on, SAML, Okta, Azure AD, login or authentication.",
+    "Glossary": "A question about business glossaries, terms and categories.",
+    "Best practices": "A request for recommendations or best practices on how to organise or govern data.",
+    "Sensitive data": "A question about PII, data classification, masking, tags or access policies for sensitive data.",
+    "Integrations": "A question about integrations with other tools such as Slack, Jira, dbt or BI tools.",
+    "Errors": "A report of an error message, failure, crash or something not working.",
+    "Others": "A ticket that does not fit any of the other categories.",
+}
+
+
+class SentenceEncoder:
+    """
+    Mean-pooled transformer sentence encoder returning L2-normalised float32 embeddings.
+    """
+
+    def __init__(self, model_id: str = TOPIC_PROTOTYPE_MODEL, max_length: int = 256):
+        import torch
+        from transformers import AutoTokenizer, AutoModel
+
+        self._torch = torch
+        self.tokenizer = AutoTokenizer.from_pretrained(model_id)
+        self.model = AutoModel.from_pretrained(model_id).eval()
+        self.max_length = max_length
+
+    def encode(self, texts: List[str], batch_size: int = 32) -> np.ndarray:
+        torch = self._torch
+        out = np.zeros((len(texts), self.model.config.hidden_size), dtype=np.float32)
+        # length-sorted batches keep padding small
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        for start in range(0, len(order), batch_size):
+            indices = order[start:start + batch_size]
+            batch = self.tokenizer([texts[i] for i in indices], padding=True, truncation=True,
+                                   max_length=self.max_length, return_tensors="pt")
+            with torch.inference_mode():
+                hidden = self.model(**batch).last_hidden_state
+            mask = batch["attention_mask"].unsqueeze(-1).to(hidden.dtype)
+            pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1e-9)
+            out[indices] = pooled.numpy()
+        norms = np.linalg.norm(out, axis=1, keepdims=True)
+        return out / np.maximum(norms, 1e-12)
+
+
+class PrototypeTopicClassifier:
+    """
+    Classifies tickets by cosine similarity to one prototype vector per label.
+    A prototype is the normalised mean of the embedding of the label's description and of its seed examples.
+    classify() encodes a batch once and scores it with a single (tickets x labels) matrix product;
+    tickets whose top-2 margin is below margin go to the fallback (the NLI pipeline) instead.
+    """
+
+    def __init__(self, encoder: SentenceEncoder, labels: List[str], descriptions: Dict[str, str],
+                 seed_examples: Optional[Dict[str, List[str]]] = None, margin: float = TOPIC_PROTOTYPE_MARGIN):
+        self.encoder = encoder
+        self.labels = list(labels)
+        self.margin = margin
+        seed_examples = seed_examples or {}
+
+        texts, owners = [], []
+        for i, label in enumerate(self.labels):
+            for text in [f"{label}: {descriptions.get(label, label)}"] + list(seed_examples.get(label, [])):
+                texts.append(text)
+                owners.append(i)
+        embeddings = encoder.encode(texts)
+        owners = np.asarray(owners)
+        prototypes = np.stack([embeddings[owners == i].mean(axis=0) for i in range(len(self.labels))])
+        self.prototypes = prototypes / np.linalg.norm(prototypes, axis=1, keepdims=True)
+
+    def scores(self, texts: List[str], batch_size: int = 32) -> np.ndarray:
+        return self.encoder.encode(texts, batch_size) @ self.prototypes.T
+
+    def classify(self, texts: List[str], batch_size: int = 32, fallback=None) -> list:
+        """
+        Returns one label per text. fallback(texts) -> labels is called once with every low-margin text.
+        """
+        if not texts:
+            return []
+        sims = self.scores(texts, batch_size)
+        top2 = np.argsort(-sims, axis=1)[:, :2]
+        rows = np.arange(len(texts))
+        margins = sims[rows, top2[:, 0]] - sims[rows, top2[:, 1]]
+        labels = [self.labels[j] for j in top2[:, 0]]
+
+        if fallback is not None:
+            uncertain = [i for i in range(len(texts)) if margins[i] < self.margin]
+            if uncertain:
+                for i, label in zip(uncertain, fallback([texts[i] for i in uncertain])):
+                    labels[i] = label
+        return labels
+
+
+_classifier = None
+_classifier_lock = threading.Lock()
+
+
+def get_prototype_classifier(labels: List[str]) -> PrototypeTopicClassifier:
+    """
+    Process-wide PrototypeTopicClassifier, built on first use from TOPIC_DESCRIPTIONS and TOPIC_SEED_EXAMPLES.
+    """
+    global _classifier
+    if _classifier is None:
+        with _classifier_lock:
+            if _classifier is None:
+                seeds = None
+                if TOPIC_SEED_EXAMPLES:
+                    with open(TOPIC_SEED_EXAMPLES, encoding="utf-8") as f:
+                        seeds = json.load(f)
+                _classifier = PrototypeTopicClassifier(SentenceEncoder(), labels, TOPIC_DESCRIPTIONS, seeds)
+    return _classifier
+
+
+def compare(tickets: List[dict], label_field: str = "topic", batch_size: int = 16) -> dict:
+    """
+    Runs the NLI and prototype engines over the same tickets and reports throughput, how often the
+    prototype engine fell back to NLI, agreement between the two and, when tickets carry label_field,
+    the accuracy of each against it.
+    """
+    from .ml_processing import TOPIC_LABELS, nli_topic_batch
+
+    texts = [f"{t.get('subject', '')} {t.get('body', '')}".strip() for t in tickets]
+    gold = [t.get(label_field) for t in tickets]
+
+    classifier = get_prototype_classifier(TOPIC_LABELS)
+    fallback_count = [0]
+
+    def counting_fallback(batch):
+        fallback_count[0] += len(batch)
+        return nli_topic_batch(batch, batch_size)
+
+    report = {"tickets": len(texts)}
+    runs = {
+        "nli": lambda: nli_topic_batch(texts, batch_size),
+        "prototype_only": lambda: classifier.classify(texts, batch_size),
+        "prototype_with_fallback": lambda: classifier.classify(texts, batch_size, fallback=counting_fallback),
+    }
+    predictions = {}
+    for name, run in runs.items():
+        started = time.perf_counter()
+        predictions[name] = run()
+        elapsed = time.perf_counter() - started
+        report[name] = {"seconds": round(elapsed, 3),
+                        "tickets_per_second": round(len(texts) / elapsed, 2) if elapsed else None}
+
+    report["prototype_with_fallback"]["fallback_rate"] = round(fallback_count[0] / len(texts), 4) if texts else 0.0
+    for name in ("prototype_only", "prototype_with_fallback"):
+        agree = sum(a == b for a, b in zip(predictions[name], predictions["nli"]))
+        report[name]["agreement_with_nli"] = round(agree / len(texts), 4) if texts else 0.0
+
+    labelled = [i for i, g in enumerate(gold) if g]
+    if labelled:
+        for name in runs:
+            correct = sum(predictions[name][i] == gold[i] for i in labelled)
+            report[name]["accuracy"] = round(correct / len(labelled), 4)
+        report["labelled_tickets"] = len(labelled)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the prototype topic engine against the NLI pipeline.")
+    parser.add_argument("input", help="JSON list of tickets with subject/body and optionally a gold topic")
+    parser.add_argument("--label-field", default="topic")
+    parser.add_argument("--batch-size", type=int, default=16)
+    args = parser.parse_args()
+
+    with open(args.input, encoding="utf-8") as f:
+        tickets = json.load(f)
+    print(json.dumps(compare(tickets, args.label_field, args.batch_size), indent=2))
+
+
+if __name__ == "__main__":
+    main()
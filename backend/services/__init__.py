@@ -1,10 +1,27 @@
+from .clients import get_qdrant_client, get_openai_client, ping_qdrant, ping_openai
 from .llm_service import generate_llm_response
-from .qdrant_service import search_text, insert_point, retrieve_llm_responses_by_user,embed_text
+from .openai_gateway import OpenAIGateway, OpenAIResult, get_openai_gateway
+from .response_cache import response_cache_stats, invalidate_response_cache
+from .qdrant_service import search_text, search_texts, insert_point, insert_points, retrieve_llm_responses_by_user, retrieve_llm_responses_by_users,embed_text,embed_texts,embedding_cache_stats
 
 __all__ = [
     'generate_llm_response',
     'search_text',
+    'search_texts',
     'insert_point',
+    'insert_points',
     'retrieve_llm_responses_by_user',
-    'embed_text'
+    'retrieve_llm_responses_by_users',
+    'embed_text',
+    'embed_texts',
+    'embedding_cache_stats',
+    'response_cache_stats',
+    'invalidate_response_cache',
+    'get_qdrant_client',
+    'get_openai_client',
+    'ping_qdrant',
+    'ping_openai',
+    'OpenAIGateway',
+    'OpenAIResult',
+    'get_openai_gateway'
 ]
\ No newline at end of file
@@ -0,0 +1,158 @@
+import os
+import threading
+import httpx
+from qdrant_client import QdrantClient
+from openai import OpenAI
+from dotenv import load_dotenv
+load_dotenv()
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+QDRANT_URL = os.getenv("QDRANT_URL")
+QDRANT_API_KEY = os.getenv("QDRANT_API_KEY")
+
+# ":memory:" runs an in-process Qdrant (tests, benchmarks), a directory path runs a local on-disk one;
+# unset uses QDRANT_URL
+QDRANT_LOCATION = os.getenv("QDRANT_LOCATION")
+# gRPC for searches and bulk upserts, REST is still used for the calls gRPC does not cover
+QDRANT_PREFER_GRPC = os.getenv("QDRANT_PREFER_GRPC", "0") == "1"
+QDRANT_GRPC_PORT = int(os.getenv("QDRANT_GRPC_PORT", 6334))
+QDRANT_TIMEOUT_SECONDS = int(os.getenv("QDRANT_TIMEOUT_SECONDS", 10))
+QDRANT_MAX_CONNECTIONS = int(os.getenv("QDRANT_MAX_CONNECTIONS", 32))
+
+OPENAI_TIMEOUT_SECONDS = float(os.getenv("OPENAI_TIMEOUT_SECONDS", 60))
+OPENAI_CONNECT_TIMEOUT_SECONDS = float(os.getenv("OPENAI_CONNECT_TIMEOUT_SECONDS", 5))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", 2))
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", 64))
+
+_lock = threading.Lock()
+_clients = {}
+
+
+class _SerializedClient:
+    """
+    Local (in-process) Qdrant is not thread-safe, concurrent requests would corrupt its in-memory indexes:
+    every call goes through one lock.
+    """
+
+    def __init__(self, client: QdrantClient):
+        self._client = client
+        self._lock = threading.RLock()
+
+    def __getattr__(self, attr):
+        value = getattr(self._client, attr)
+        if not callable(value):
+            return value
+
+        def call(*args, **kwargs):
+            with self._lock:
+                return value(*args, **kwargs)
+        return call
+
+
+def _build_qdrant_client() -> QdrantClient:
+    if QDRANT_LOCATION == ":memory:":
+        return _SerializedClient(QdrantClient(location=":memory:"))
+    if QDRANT_LOCATION:
+        return _SerializedClient(QdrantClient(path=QDRANT_LOCATION))
+    return QdrantClient(
+        url=QDRANT_URL,
+        api_key=QDRANT_API_KEY,
+        prefer_grpc=QDRANT_PREFER_GRPC,
+        grpc_port=QDRANT_GRPC_PORT,
+        timeout=QDRANT_TIMEOUT_SECONDS,
+        # keep connections alive between requests (qdrant-client disables keep-alive for localhost by default)
+        limits=httpx.Limits(max_connections=QDRANT_MAX_CONNECTIONS, max_keepalive_connections=QDRANT_MAX_CONNECTIONS),
+    )
+
+
+def _build_openai_client() -> OpenAI:
+    http_client = httpx.Client(
+        timeout=httpx.Timeout(OPENAI_TIMEOUT_SECONDS, connect=OPENAI_CONNECT_TIMEOUT_SECONDS),
+        limits=httpx.Limits(max_connections=OPENAI_MAX_CONNECTIONS, max_keepalive_connections=OPENAI_MAX_CONNECTIONS),
+    )
+    return OpenAI(api_key=OPENAI_API_KEY, max_retries=OPENAI_MAX_RETRIES, http_client=http_client)
+
+
+_factories = {"qdrant": _build_qdrant_client, "openai": _build_openai_client}
+
+
+def _get(name: str):
+    entry = _clients.get(name)
+    # connection pools must not be shared across fork: a gunicorn worker builds its own clients,
+    # except the in-memory Qdrant whose data only exists in the copied instance
+    if entry is not None and (entry[0] == os.getpid() or (name == "qdrant" and QDRANT_LOCATION == ":memory:")):
+        return entry[1]
+    with _lock:
+        entry = _clients.get(name)
+        if entry is None or entry[0] != os.getpid():
+            entry = (os.getpid(), _factories[name]())
+            _clients[name] = entry
+    return entry[1]
+
+
+def get_qdrant_client() -> QdrantClient:
+    """
+    The process-wide Qdrant client, built on first use.
+    """
+    return _get("qdrant")
+
+
+def get_openai_client() -> OpenAI:
+    """
+    The process-wide OpenAI client, built on first use.
+    """
+    return _get("openai")
+
+
+def set_qdrant_client(client: QdrantClient):
+    """Replaces the shared Qdrant client (e.g. with a seeded in-memory one in benchmarks)."""
+    with _lock:
+        _clients["qdrant"] = (os.getpid(), client)
+
+
+def set_openai_client(client: OpenAI):
+    """Replaces the shared OpenAI client (e.g. one pointed at a fake server in benchmarks)."""
+    with _lock:
+        _clients["openai"] = (os.getpid(), client)
+
+
+def ping_qdrant(collections: list = None):
+    """
+    Raises unless Qdrant answers and every collection in collections exists.
+    """
+    client = get_qdrant_client()
+    existing = {c.name for c in client.get_collections().collections}
+    missing = [name for name in collections or [] if name and name not in existing]
+    if missing:
+        raise RuntimeError(f"missing collections: {', '.join(missing)}")
+
+
+def ping_openai(model: str = None, timeout: float = None):
+    """
+    Raises unless the OpenAI API accepts the key: retrieves model, or lists the models when model is None.
+    Free of token cost, and not retried.
+    """
+    client = get_openai_client().with_options(max_retries=0, timeout=timeout or OPENAI_CONNECT_TIMEOUT_SECONDS)
+    if model:
+        client.models.retrieve(model)
+    else:
+        client.models.list()
+
+
+class _SharedClient:
+    """
+    Module-level stand-in for a shared client: attribute access goes to the current process's client,
+    so modules can keep `qdrant_client.search(...)` call sites without holding a client across fork.
+    """
+
+    def __init__(self, name: str):
+        self._name = name
+
+    def __getattr__(self, attr):
+        return getattr(_get(self._name), attr)
+
+    def __repr__(self):
+        return f"<shared {self._name} client>"
+
+
+qdrant_client = _SharedClient("qdrant")
+openai_client = _SharedClient("openai")
@@ -0,0 +1,231 @@
+import os
+import time
+import hashlib
+import sqlite3
+import argparse
+import threading
+from typing import List, Dict, Optional
+import numpy as np
+from dotenv import load_dotenv
+load_dotenv()
+OPENAI_EMBEDDING_MODEL = os.getenv("OPENAI_EMBEDDING_MODEL")
+QDRANT_COLLECTION_3 = os.getenv("QDRANT_COLLECTION_3")
+
+# Persistent embedding store, disabled unless EMBEDDING_STORE_PATH is set
+EMBEDDING_STORE_PATH = os.getenv("EMBEDDING_STORE_PATH")
+EMBEDDING_STORE_MAX_ENTRIES = int(os.getenv("EMBEDDING_STORE_MAX_ENTRIES", 200000))
+
+# last_access is only rewritten when older than this, so reads stay read-only most of the time
+_ACCESS_RESOLUTION_SECONDS = 3600
+# size is checked every N writes per process instead of on every write
+_EVICTION_CHECK_EVERY = 256
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS embeddings (
+    key TEXT PRIMARY KEY,
+    model TEXT NOT NULL,
+    dim INTEGER NOT NULL,
+    vector BLOB NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS embeddings_last_access ON embeddings (last_access);
+"""
+
+
+def content_key(model: str, text: str) -> str:
+    """
+    Content address of an embedding: sha256 of the model name and the text.
+    """
+    return hashlib.sha256(f"{model}\x00{text}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingStore:
+    """
+    On-disk embedding store shared by every worker process on the host.
+    Vectors are stored as raw float32 blobs in a SQLite file in WAL mode, so readers never block
+    writers and a read decodes the blob with np.frombuffer instead of parsing JSON.
+    When the table grows past max_entries the least recently used rows are evicted down to 90% of the cap.
+    """
+
+    def __init__(self, path: str, max_entries: int = EMBEDDING_STORE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._writes = 0
+        self._writes_lock = threading.Lock()
+        self._conn().executescript(_SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        # one connection per thread and per process, connections must not cross a fork
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, model: str, text: str) -> Optional[List[float]]:
+        return self.get_many(model, [text]).get(text)
+
+    def get_many(self, model: str, texts: List[str]) -> Dict[str, List[float]]:
+        """
+        Returns {text: vector} for the texts that are in the store. Vectors are converted back to lists
+        of floats (np.frombuffer(...).tolist()), the type embed_text returns and Qdrant points take.
+        """
+        keys = {content_key(model, text): text for text in texts}
+        if not keys:
+            return {}
+        conn = self._conn()
+        found = {}
+        stale = []
+        now = time.time()
+        key_list = list(keys)
+        # stay under SQLite's bound-parameter limit
+        for start in range(0, len(key_list), 500):
+            chunk = key_list[start:start + 500]
+            rows = conn.execute(
+                f"SELECT key, vector, last_access FROM embeddings WHERE key IN ({','.join('?' * len(chunk))})",
+                chunk,
+            ).fetchall()
+            for key, blob, last_access in rows:
+                found[keys[key]] = np.frombuffer(blob, dtype=np.float32).tolist()
+                if now - last_access > _ACCESS_RESOLUTION_SECONDS:
+                    stale.append((now, key))
+        if stale:
+            conn.executemany("UPDATE embeddings SET last_access = ? WHERE key = ?", stale)
+        return found
+
+    def put(self, model: str, text: str, vector: List[float]):
+        self.put_many(model, {text: vector})
+
+    def put_many(self, model: str, vectors: Dict[str, List[float]]):
+        if not vectors:
+            return
+        now = time.time()
+        rows = []
+        for text, vector in vectors.items():
+            blob = np.asarray(vector, dtype=np.float32).tobytes()
+            rows.append((content_key(model, text), model, len(vector), blob, now))
+        conn = self._conn()
+        conn.executemany(
+            "INSERT OR REPLACE INTO embeddings (key, model, dim, vector, last_access) VALUES (?, ?, ?, ?, ?)",
+            rows,
+        )
+        with self._writes_lock:
+            self._writes += len(rows)
+            check = self._writes >= _EVICTION_CHECK_EVERY
+            if check:
+                self._writes = 0
+        if check:
+            self.evict()
+
+    def evict(self) -> int:
+        """
+        Deletes the least recently used rows once the store is over max_entries. Returns rows deleted.
+        """
+        conn = self._conn()
+        count = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        if count <= self.max_entries:
+            return 0
+        excess = count - int(self.max_entries * 0.9)
+        conn.execute(
+            "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY last_access LIMIT ?)",
+            (excess,),
+        )
+        return excess
+
+    def stats(self) -> Dict[str, int]:
+        count = self._conn().execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        return {"entries": count, "max_entries": self.max_entries}
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_embedding_store() -> Optional[EmbeddingStore]:
+    """
+    Returns the process-wide EmbeddingStore, or None when EMBEDDING_STORE_PATH is not set.
+    """
+    global _store
+    if not EMBEDDING_STORE_PATH:
+        return None
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = EmbeddingStore(EMBEDDING_STORE_PATH)
+    return _store
+
+
+def _scroll_texts(client, collection: str, field: str, with_vectors: bool, page_size: int):
+    offset = None
+    while True:
+        points, offset = client.scroll(
+            collection_name=collection,
+            limit=page_size,
+            offset=offset,
+            with_payload=[field],
+            with_vectors=with_vectors,
+        )
+        for p in points:
+            text = (p.payload or {}).get(field)
+            if text:
+                yield text, p.vector
+        if offset is None:
+            break
+
+
+def warm(batch_size: int = 256):
+    """
+    Fills the store from the chat history already in Qdrant: QDRANT_COLLECTION_3 points were written with
+    embed_text(input_text), so their stored vectors are copied into the store without calling the
+    embeddings API. Docs chunks are not warmed, their texts are never embedded again (only chat queries
+    and tickets go through embed_text), so storing them would cost API calls and give no hits.
+    """
+    from services.clients import qdrant_client
+
+    store = get_embedding_store()
+    if store is None:
+        raise SystemExit("EMBEDDING_STORE_PATH is not set")
+
+    history, vectors = 0, {}
+    for text, vector in _scroll_texts(qdrant_client, QDRANT_COLLECTION_3, "input_text", True, batch_size):
+        if isinstance(vector, list):
+            vectors[text] = vector
+        if len(vectors) >= batch_size:
+            store.put_many(OPENAI_EMBEDDING_MODEL, vectors)
+            history += len(vectors)
+            vectors = {}
+    if vectors:
+        store.put_many(OPENAI_EMBEDDING_MODEL, vectors)
+        history += len(vectors)
+    print(f"Warmed {history} texts from {QDRANT_COLLECTION_3}")
+    store.evict()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the persistent embedding store (EMBEDDING_STORE_PATH).")
+    sub = parser.add_subparsers(dest="command", required=True)
+    warm_parser = sub.add_parser("warm", help="copy the chat-history vectors of QDRANT_COLLECTION_3 into the store")
+    warm_parser.add_argument("--batch-size", type=int, default=256)
+    sub.add_parser("stats", help="print the number of stored embeddings")
+    sub.add_parser("evict", help="evict down to EMBEDDING_STORE_MAX_ENTRIES")
+    args = parser.parse_args()
+
+    if args.command == "warm":
+        warm(batch_size=args.batch_size)
+        return
+
+    store = get_embedding_store()
+    if store is None:
+        raise SystemExit("EMBEDDING_STORE_PATH is not set")
+    if args.command == "stats":
+        print(store.stats())
+    elif args.command == "evict":
+        print(f"Evicted {store.evict()} embeddings")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+import os
+import json
+import fcntl
+import time
+import uuid
+import queue
+import atexit
+import datetime
+import threading
+from contextlib import contextmanager
+from typing import List, Dict, Any, Optional
+from dotenv import load_dotenv
+from .clients import qdrant_client
+from .qdrant_service import insert_points
+from utils.log import get_logger
+load_dotenv()
+
+logger = get_logger("history_writer")
+
+HISTORY_WRITE_BEHIND = os.getenv("HISTORY_WRITE_BEHIND", "1") == "1"
+# Backpressure: max pending records, and how long enqueue waits for room before the caller writes synchronously
+HISTORY_QUEUE_MAX = int(os.getenv("HISTORY_QUEUE_MAX", 10000))
+HISTORY_ENQUEUE_TIMEOUT_SECONDS = float(os.getenv("HISTORY_ENQUEUE_TIMEOUT_SECONDS", 0.05))
+# Records per bulk upsert, and how long the worker waits to fill a batch
+HISTORY_BATCH_SIZE = int(os.getenv("HISTORY_BATCH_SIZE", 64))
+HISTORY_FLUSH_SECONDS = float(os.getenv("HISTORY_FLUSH_SECONDS", 1.0))
+HISTORY_MAX_RETRIES = int(os.getenv("HISTORY_MAX_RETRIES", 3))
+# Optional JSONL journal of pending records, replayed on startup so queued history survives a restart.
+# Shared by every process (gunicorn workers) of the app, access is serialised with a flock on <path>.lock
+HISTORY_SPILL_PATH = os.getenv("HISTORY_SPILL_PATH")
+
+
+class HistoryWriteBehind:
+    """
+    Background writer for chat history (QDRANT_COLLECTION_3).
+    enqueue() returns immediately; a worker thread collects up to batch_size records (or whatever arrived
+    within flush_seconds), embeds the ones without a vector in one embeddings call and bulk-upserts them.
+    Every record gets its point ID at enqueue time, so replaying the spill file after a crash
+    overwrites instead of duplicating. The spill file is compacted to the still pending records
+    (of every process sharing it) whenever this process's queue drains.
+    """
+
+    def __init__(self, client=qdrant_client, max_size: int = HISTORY_QUEUE_MAX,
+                 batch_size: int = HISTORY_BATCH_SIZE, flush_seconds: float = HISTORY_FLUSH_SECONDS,
+                 spill_path: Optional[str] = HISTORY_SPILL_PATH):
+        self.client = client
+        self.batch_size = max(1, batch_size)
+        self.flush_seconds = flush_seconds
+        self.spill_path = spill_path
+
+        self._queue = queue.Queue(maxsize=max_size)
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._spill_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._metrics = {"enqueued": 0, "written": 0, "failed": 0, "rejected": 0, "flushes": 0,
+                         "last_flush_seconds": 0.0, "total_flush_seconds": 0.0}
+
+    def enqueue(self, user_id: str, input_text: str, llm_response: str,
+                vector: Optional[List[float]] = None) -> bool:
+        """
+        Queues one chat-history record. Returns False when the queue stayed full for
+        HISTORY_ENQUEUE_TIMEOUT_SECONDS, the caller should then write the record itself.
+        """
+        self._ensure_started()
+        record = {
+            "point_id": str(uuid.uuid4()),
+            "user_id": user_id,
+            "input_text": input_text,
+            "llm_response": llm_response,
+            "created_at": datetime.datetime.utcnow().isoformat(),
+            "vector": vector,
+        }
+        # journal the record before the worker can see it: its "done" line must come after its "add" line,
+        # and a crash after put() must not lose it
+        self._spill({"add": {k: v for k, v in record.items() if k != "vector"}})
+        try:
+            self._queue.put(record, timeout=HISTORY_ENQUEUE_TIMEOUT_SECONDS)
+        except queue.Full:
+            # the caller writes it instead
+            self._spill({"done": [record["point_id"]]})
+            with self._lock:
+                self._metrics["rejected"] += 1
+            return False
+        with self._lock:
+            self._metrics["enqueued"] += 1
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._metrics)
+        stats["queue_depth"] = self._queue.qsize()
+        stats["in_flight"] = self._in_flight
+        stats["avg_flush_seconds"] = stats["total_flush_seconds"] / stats["flushes"] if stats["flushes"] else 0.0
+        return stats
+
+    def stop(self, timeout: float = 10.0):
+        """Stops the worker after it has drained the queue (or timeout seconds)."""
+        self._stop.set()
+        if self._thread is not None and self._thread.is_alive():
+            self._thread.join(timeout)
+
+    def start(self):
+        """
+        Replays the spill file and starts the worker thread of this process. Call at process startup
+        (app.init_worker); enqueue() also starts it if it is not running yet.
+        """
+        self._ensure_started()
+
+    def _ensure_started(self):
+        # threads do not survive a fork, so the worker is started in each process
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stop.clear()
+            self._replay_spill()
+            self._thread = threading.Thread(target=self._run, name="history-writer", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not (self._stop.is_set() and self._queue.empty()):
+            batch = self._next_batch()
+            if batch:
+                self._flush(batch)
+
+    def _next_batch(self) -> List[Dict[str, Any]]:
+        try:
+            batch = [self._queue.get(timeout=self.flush_seconds)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_seconds
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        self._in_flight = len(batch)
+        return batch
+
+    def _flush(self, batch: List[Dict[str, Any]]):
+        started = time.perf_counter()
+        for attempt in range(HISTORY_MAX_RETRIES + 1):
+            try:
+                insert_points(self.client, batch)
+                break
+            except Exception as e:
+                logger.warning("History flush of %d records failed (attempt %d): %s", len(batch), attempt + 1, e)
+                if attempt == HISTORY_MAX_RETRIES:
+                    with self._lock:
+                        self._metrics["failed"] += len(batch)
+                    self._in_flight = 0
+                    # left in the spill file, so they are retried on the next restart
+                    return
+                time.sleep(min(2 ** attempt, 30))
+
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self._metrics["written"] += len(batch)
+            self._metrics["flushes"] += 1
+            self._metrics["last_flush_seconds"] = elapsed
+            self._metrics["total_flush_seconds"] += elapsed
+        self._in_flight = 0
+        self._spill({"done": [r["point_id"] for r in batch]})
+        if self._queue.empty():
+            self._compact_spill()
+
+    @contextmanager
+    def _spill_file_lock(self):
+        # the thread lock orders this process's threads, the flock orders the processes sharing the file
+        with self._spill_lock, open(self.spill_path + ".lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _spill(self, entry: Dict[str, Any]):
+        if not self.spill_path:
+            return
+        try:
+            with self._spill_file_lock(), open(self.spill_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry) + "\n")
+        except OSError as e:
+            logger.error("Could not write history spill file: %s", e)
+
+    def _read_pending(self) -> Dict[str, Dict[str, Any]]:
+        """Records added and not marked done, in order. Call with the spill file lock held."""
+        pending: Dict[str, Dict[str, Any]] = {}
+        if not os.path.exists(self.spill_path):
+            return pending
+        with open(self.spill_path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # torn last line after a crash
+                if "add" in entry:
+                    pending[entry["add"]["point_id"]] = entry["add"]
+                for point_id in entry.get("done", []):
+                    pending.pop(point_id, None)
+        return pending
+
+    def _compact_spill(self):
+        """
+        Rewrites the spill file with only the pending records, so it stays bounded by what is still
+        queued (here or in another process) or failed, instead of growing with every record ever written.
+        """
+        if not self.spill_path:
+            return
+        try:
+            with self._spill_file_lock():
+                pending = self._read_pending()
+                tmp_path = f"{self.spill_path}.{os.getpid()}.tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    for record in pending.values():
+                        f.write(json.dumps({"add": record}) + "\n")
+                os.replace(tmp_path, self.spill_path)
+        except OSError as e:
+            logger.error("Could not compact history spill file: %s", e)
+
+    def _replay_spill(self):
+        if not self.spill_path:
+            return
+        with self._spill_file_lock():
+            pending = self._read_pending()
+        for record in pending.values():
+            record["vector"] = None
+            try:
+                self._queue.put_nowait(record)
+            except queue.Full:
+                break
+        if pending:
+            logger.info("Replaying %d pending chat-history records from %s", len(pending), self.spill_path)
+
+
+history_writer = HistoryWriteBehind()
+atexit.register(history_writer.stop)
+
+
+def history_queue_stats() -> Dict[str, Any]:
+    return history_writer.stats()
@@ -2,31 +2,22 @@ import os
 import json
 import datetime
 from typing import List, Dict, Any, Optional
-from openai import OpenAI
 from dotenv import load_dotenv
-from collections import defaultdict
 from typing import List, Dict, Any, Optional
 import re
+import time
+from .response_cache import response_cache, RESPONSE_CACHE_ENABLED
+from .openai_gateway import get_openai_gateway
+from .prompt_builder import build_prompt, prompt_stats
+from utils.metrics import metrics, span, timed
+from utils.log import get_logger
 load_dotenv()
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 OPENAI_CHAT_MODEL = os.getenv("OPENAI_CHAT_MODEL")
 OPENAI_EMBEDDING_MODEL = os.getenv("OPENAI_EMBEDDING_MODEL")
 
-openai_client = OpenAI(api_key=OPENAI_API_KEY)
-
-def format_docs(results: List[Dict[str, Any]]) -> str:
-    """
-    Formats the documents retrieved from the vector database for LLM input."""
-    grouped = defaultdict(list)
-    for r in results:
-        text = r.get("text") or ""
-        url = r.get("url") or ""
-        grouped[r.get("id")].append(f"{text}:::{url}:::FINISH")
-
-    return "\n".join(
-        f"{doc_id}\n" + "\n".join(pairs)
-        for doc_id, pairs in grouped.items()
-    )
+logger = get_logger("llm_service", sampled=True)
+PROMPT_TOKEN_BUCKETS = (250, 500, 1000, 2000, 4000, 8000, 16000, 32000)
 
 def parse_llm_output(output_str: str) -> dict:
     """
@@ -49,98 +40,219 @@ def parse_llm_output(output_str: str) -> dict:
         return {"LLM_Response": output_str.strip(), "Cited_URLs": []}
 
 
-def format_conv_history(responses: List[str]) -> str:
-    """
-    Formats the conversation history for LLM input.
-    """
-    return "\n".join(responses)
+def _report_prompt(report: Dict[str, int], usage=None):
+    prompt_stats.record(report, usage)
+    metrics.observe("csc_prompt_tokens", report["prompt_tokens"], buckets=PROMPT_TOKEN_BUCKETS)
+    cached = getattr(getattr(usage, "prompt_tokens_details", None), "cached_tokens", None)
+    if usage is not None:
+        metrics.inc("csc_openai_tokens_total", getattr(usage, "prompt_tokens", 0) or 0, kind="prompt")
+        metrics.inc("csc_openai_tokens_total", getattr(usage, "completion_tokens", 0) or 0, kind="completion")
+        metrics.inc("csc_openai_tokens_total", cached or 0, kind="cached_prompt")
+    logger.info("Prompt tokens: %s (docs %s, history %s), openai prompt tokens: %s, cached: %s",
+                report["prompt_tokens"], report["docs_tokens"], report["history_tokens"],
+                getattr(usage, "prompt_tokens", None), cached)
 
+@timed("generate_llm_response")
 def generate_llm_response(
     user_text: str,
     responses: List[str],
     results: List[Dict[str, Any]],
-) -> str:
+    query_vector: Optional[List[float]] = None,
+) -> Dict[str, Any]:
     """
     Generates a response from the LLM based on user input from frontend, conversation history from qdrant, and relevant documents from the RAG Pipeline.
+    Answers are served from the response cache when the same query hit the same docs before, or when
+    query_vector is close enough to a previously answered query that retrieved the same docs
+    (see services/response_cache.py). Prompts with chat history bypass the cache, their answers are per user.
+    Always returns {"LLM_Response", "Cited_URLs"}; when the OpenAI call failed the dict also has "error"
+    and LLM_Response holds a message for the user.
     """
-    model = OPENAI_CHAT_MODEL
-    DOCS = format_docs(results)
-    CONV_HISTORY_SUMMARY = format_conv_history(responses)
-    print("-----")
-    print(DOCS)
-    print("-----")
-    delimiter = "$$$$"
-    system_instructions = f"""
-        You are an assistant helping resolve support tickets.
-
-        User Query:
-        {user_text}
-
-        Conversation History (summarized):
-        {CONV_HISTORY_SUMMARY}
-        If true(it is empty), treat the conversation as new.
-
-        Relevant Documentation (DOCS):
-        ```{DOCS}``` -> DOCS
-        You will see the relevant documentation in the form : 
-        {delimiter}
-        text1:::url1:::FINISH, text1:::url2:::FINISH..etc
-        {delimiter}
-        In this docs, there will be many url_ids and many points. Refer to all the points and clearly state the answer. Cite all the URLs mentioned in DOCS.
-        Do not simple judge on score basis. Consider every detail and then answer. 
-        {delimiter}
-        When a user asks for steps, refer to documentation and create steps and return back to the user. 
-        NEVER say, "I dont find this in documentation" : Looks weak
-        You will never give the user inaccurate data, remember that
-        {delimiter}
-        {delimiter}
-        Classify the incoming ticket as follows : 
-
-        {delimiter}If the topic is How-to, Product, Best practices, API/SDK, or SSO, use DOCS to generate and display a direct answer.{delimiter}
-        If the topic is anything else, respond with a simple message indicating classification and routing. 
-        {delimiter}
-        For example:
-        “This ticket has been classified as a 'Connector' issue and routed to the appropriate team.”
-        "We've categorized this as a Connector issue and passed it to the right team who can help you further."
-        "This has been identified as a Connector issue and is now with our specialists for resolution."
-        "Looks like this is a Connector issue. I've routed it to the right experts so they can assist you."
-        "Your request falls under a Connector issue, and I've shared it with the right team to handle it quickly."
-        "This ticket has been flagged as a Connector issue and forwarded to our support experts for action."
-        {delimiter}
-        {delimiter}
-
-        Instructions:
-        - Draft a clear and accurate response to the user's query.
-        - Cite only from the URLs explicitly present in the provided DOCS.
-        - Do not ask follow-up questions.
-        - If no relevant DOCS found, return with "Cited_URLs": [].
-        - Output strictly in the following JSON format:
-
-        [{{
-            "LLM_Response": "<drafted response to the ticket>",
-            "Cited_URLs": ["<url1> , <url2> , <url3>"]
-        }}]
-    """
+    doc_ids = [r.get("id") for r in results]
+    # answers shaped by one user's chat history must not be served to anyone else
+    use_cache = RESPONSE_CACHE_ENABLED and not responses
+    if use_cache:
+        cached = response_cache.get(user_text, doc_ids, query_vector)
+        if cached is not None:
+            return cached
 
-    messages = []
-    
-    messages = [{"role": "system", "content": system_instructions}]
+    model = OPENAI_CHAT_MODEL
+    messages, report = build_prompt(user_text, responses, results)
 
-    try:
-        resp = openai_client.chat.completions.create(
-            model=model,
-            messages=messages,
+    started = time.perf_counter()
+    with span("openai_chat"):
+        result = get_openai_gateway().chat(
+            model,
+            messages,
             temperature=0  # keep deterministic
         )
-        print(resp.choices[0].message.content)
-        # return resp.choices[0].message.content
+    try:
+        if not result.ok:
+            raise RuntimeError(result.error)
+        resp = result.value
+        # a coalesced call shares the usage of the call it joined, count it once
+        _report_prompt(report, None if result.coalesced else resp.usage)
         raw_output = resp.choices[0].message.content
-        print("Raw LLM Output:", raw_output)
-        return parse_llm_output(raw_output)
-    
+        logger.debug("Raw LLM Output: %s", raw_output)
+        parsed = parse_llm_output(raw_output)
+        if use_cache and parsed["LLM_Response"] and not result.coalesced:
+            response_cache.put(user_text, doc_ids, query_vector, parsed, time.perf_counter() - started)
+        return parsed
+
     except Exception as e:
-        print("LLM call failed:", e)
-        return json.dumps({
+        logger.warning("LLM call failed: %s", e)
+        metrics.inc("csc_llm_errors_total", mode="sync")
+        return {
             "LLM_Response": "Error: LLM call failed.",
-            "Cited_URLs": []
-        })
\ No newline at end of file
+            "Cited_URLs": [],
+            "error": str(e)
+        }
+
+
+class LLMResponseStreamParser:
+    """
+    Incremental parser for the [{"LLM_Response": ..., "Cited_URLs": [...]}] envelope.
+    feed() takes raw completion chunks as they arrive and returns the part of the LLM_Response
+    string value decoded so far (JSON escapes resolved), so it can be forwarded to the user
+    before the completion is finished. result() parses the full output once the stream ends.
+    """
+    KEY = '"LLM_Response"'
+
+    def __init__(self):
+        self.raw = []
+        self.emitted = False
+        self._buf = ""
+        self._state = "key"
+
+    def feed(self, chunk: str) -> str:
+        self.raw.append(chunk)
+        self._buf += chunk
+        out = []
+        while self._buf and self._state != "done":
+            if self._state == "key":
+                idx = self._buf.find(self.KEY)
+                if idx < 0:
+                    # keep a tail in case the key is split across chunks
+                    self._buf = self._buf[-(len(self.KEY) - 1):]
+                    break
+                self._buf = self._buf[idx + len(self.KEY):]
+                self._state = "colon"
+            elif self._state in ("colon", "quote"):
+                self._buf = self._buf.lstrip()
+                if not self._buf:
+                    break
+                expected = ":" if self._state == "colon" else '"'
+                if self._buf[0] != expected:
+                    self._state = "key"
+                    continue
+                self._buf = self._buf[1:]
+                self._state = "quote" if self._state == "colon" else "string"
+            elif self._state == "string":
+                decoded = self._consume_string()
+                if decoded is None:
+                    break
+                out.append(decoded)
+        text = "".join(out)
+        if text:
+            self.emitted = True
+        return text
+
+    def _consume_string(self) -> Optional[str]:
+        """Decodes the next run of the string value, None when more input is needed."""
+        buf = self._buf
+        if buf[0] == '"':
+            self._buf = ""
+            self._state = "done"
+            return ""
+        if buf[0] != "\\":
+            end = len(buf)
+            for stop in ('"', "\\"):
+                idx = buf.find(stop)
+                if idx >= 0:
+                    end = min(end, idx)
+            self._buf = buf[end:]
+            return buf[:end]
+
+        if len(buf) < 2:
+            return None
+        length = 6 if buf[1] == "u" else 2
+        if buf[1] == "u" and buf[2:4].lower() in ("d8", "d9", "da", "db"):
+            length = 12  # surrogate pair, decode both halves together
+        if len(buf) < length:
+            return None
+        self._buf = buf[length:]
+        try:
+            return json.loads(f'"{buf[:length]}"')
+        except ValueError:
+            return buf[:length]
+
+    def result(self) -> dict:
+        return parse_llm_output("".join(self.raw))
+
+
+def stream_llm_response(
+    user_text: str,
+    responses: List[str],
+    results: List[Dict[str, Any]],
+    query_vector: Optional[List[float]] = None,
+):
+    """
+    Streaming variant of generate_llm_response.
+    Yields {"type": "token", "text": ...} events with LLM_Response text as OpenAI produces it,
+    then one {"type": "done", "LLM_Response": ..., "Cited_URLs": [...]} event with the parsed output
+    (or {"type": "error", ...} if the call fails).
+    """
+    doc_ids = [r.get("id") for r in results]
+    # answers shaped by one user's chat history must not be served to anyone else
+    use_cache = RESPONSE_CACHE_ENABLED and not responses
+    if use_cache:
+        cached = response_cache.get(user_text, doc_ids, query_vector)
+        if cached is not None:
+            yield {"type": "token", "text": cached["LLM_Response"]}
+            yield {"type": "done", **cached}
+            return
+
+    messages, report = build_prompt(user_text, responses, results)
+    parser = LLMResponseStreamParser()
+    first_token_seen = False
+    usage = None
+    try:
+        started = time.perf_counter()
+        result = get_openai_gateway().chat_stream(
+            OPENAI_CHAT_MODEL,
+            messages,
+            temperature=0,  # keep deterministic
+            stream_options={"include_usage": True}
+        )
+        if not result.ok:
+            raise RuntimeError(result.error)
+        for chunk in result.value:
+            if getattr(chunk, "usage", None) is not None:
+                usage = chunk.usage
+            if not chunk.choices:
+                continue
+            content = chunk.choices[0].delta.content
+            if not content:
+                continue
+            text = parser.feed(content)
+            if text:
+                if not first_token_seen:
+                    first_token_seen = True
+                    metrics.observe("csc_stage_duration_seconds", time.perf_counter() - started,
+                                    stage="openai_chat_first_token")
+                yield {"type": "token", "text": text}
+    except Exception as e:
+        logger.warning("LLM stream failed: %s", e)
+        metrics.inc("csc_llm_errors_total", mode="stream")
+        yield {"type": "error", "LLM_Response": "Error: LLM call failed.", "Cited_URLs": []}
+        return
+
+    metrics.observe("csc_stage_duration_seconds", time.perf_counter() - started, stage="openai_chat_stream")
+    _report_prompt(report, usage)
+    parsed = parser.result()
+    logger.debug("Raw LLM Output: %s", "".join(parser.raw))
+    if not parser.emitted and parsed["LLM_Response"]:
+        # the model did not follow the envelope, send the whole answer at once
+        yield {"type": "token", "text": parsed["LLM_Response"]}
+    if use_cache and parsed["LLM_Response"]:
+        response_cache.put(user_text, doc_ids, query_vector, parsed, time.perf_counter() - started)
+    yield {"type": "done", **parsed}
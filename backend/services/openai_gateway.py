@@ -0,0 +1,377 @@
+import os
+import re
+import json
+import time
+import random
+import hashlib
+import threading
+from concurrent.futures import Future
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional
+import openai
+from dotenv import load_dotenv
+from .clients import openai_client
+from .prompt_builder import count_tokens
+from utils.metrics import metrics
+from utils.log import get_logger
+load_dotenv()
+
+logger = get_logger("openai_gateway", sampled=True)
+
+# Account limits of the OpenAI organisation, shared by every thread of this process; 0 disables a bucket.
+# With several gunicorn workers set them to the account limit divided by the number of workers.
+OPENAI_RPM_LIMIT = int(os.getenv("OPENAI_RPM_LIMIT", 0))
+OPENAI_TPM_LIMIT = int(os.getenv("OPENAI_TPM_LIMIT", 0))
+# upstream calls in flight at once (streams count until they are closed)
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", 16))
+# retries of 429s, 5xx, timeouts and connection errors, with exponential backoff and full jitter
+OPENAI_GATEWAY_RETRIES = int(os.getenv("OPENAI_GATEWAY_RETRIES", 4))
+OPENAI_BACKOFF_BASE_SECONDS = float(os.getenv("OPENAI_BACKOFF_BASE_SECONDS", 0.5))
+OPENAI_BACKOFF_MAX_SECONDS = float(os.getenv("OPENAI_BACKOFF_MAX_SECONDS", 20))
+# longest a call waits for a rate-limit slot or a concurrency slot before it fails
+OPENAI_QUEUE_TIMEOUT_SECONDS = float(os.getenv("OPENAI_QUEUE_TIMEOUT_SECONDS", 30))
+# completion tokens charged to the TPM bucket up front when the request sets no max_tokens
+OPENAI_COMPLETION_TOKENS_ESTIMATE = int(os.getenv("OPENAI_COMPLETION_TOKENS_ESTIMATE", 400))
+
+RETRYABLE_ERRORS = (openai.RateLimitError, openai.APIConnectionError, openai.APITimeoutError,
+                    openai.InternalServerError)
+
+
+@dataclass
+class OpenAIResult:
+    """
+    Outcome of a gateway call. ok is True when value holds the parsed SDK response (a Stream for
+    chat_stream); otherwise error describes the last failure and status is its HTTP status, if any.
+    """
+    ok: bool
+    value: Any = None
+    error: Optional[str] = None
+    status: Optional[int] = None
+    attempts: int = 0
+    coalesced: bool = False
+    seconds: float = 0.0
+
+
+class TokenBucket:
+    """
+    Refills capacity units per minute, continuously. take() waits until amount units are available;
+    the level may go negative through charge(), which delays later callers instead of failing them.
+    """
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.level = float(per_minute)
+        self._rate = per_minute / 60.0
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self._updated) * self._rate)
+        self._updated = now
+
+    def take(self, amount: float, deadline: float) -> bool:
+        # a request larger than the whole bucket would wait forever, it only has to wait for a full one
+        amount = min(amount, self.capacity)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self.level >= amount:
+                    self.level -= amount
+                    return True
+                wait = (amount - self.level) / self._rate
+            if now + wait > deadline:
+                return False
+            time.sleep(min(wait, 1.0))
+
+    def charge(self, amount: float):
+        """Adds (or refunds, when negative) units once the real usage is known."""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.level = min(self.capacity, self.level - amount)
+
+    def drain(self, seconds: float):
+        """Empties the bucket for at least seconds, e.g. when OpenAI reports the limit as exhausted."""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.level = min(self.level, -seconds * self._rate)
+
+
+def _duration_seconds(value: Optional[str]) -> Optional[float]:
+    """Parses the x-ratelimit-reset-* format ("20ms", "1s", "6m0s", "1h2m3.5s")."""
+    if not value:
+        return None
+    parts = re.findall(r"([\d.]+)(ms|h|m|s)", value)
+    if not parts:
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    scale = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+    return sum(float(n) * scale[unit] for n, unit in parts)
+
+
+def _retry_after(headers) -> Optional[float]:
+    if headers is None:
+        return None
+    if headers.get("retry-after-ms"):
+        try:
+            return float(headers["retry-after-ms"]) / 1000
+        except ValueError:
+            pass
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class _SlotStream:
+    """
+    Iterates a stream and calls release() once, when it is exhausted, fails or is closed (even before the
+    first chunk, or when it is garbage collected without being closed).
+    """
+
+    def __init__(self, stream, release: Callable):
+        self._stream = stream
+        self._chunks = iter(stream)
+        self._release = release
+        self._released = False
+        self._lock = threading.Lock()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self._chunks)
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self):
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        try:
+            close = getattr(self._stream, "close", None)
+            if close is not None:
+                close()
+        finally:
+            self._release()
+
+    def __del__(self):
+        self.close()
+
+
+def _usage_tokens(value) -> Optional[int]:
+    usage = getattr(value, "usage", None)
+    return getattr(usage, "total_tokens", None) if usage is not None else None
+
+
+class OpenAIGateway:
+    """
+    Single way out to the OpenAI API for this process. Every call:
+    - waits for a slot in the requests-per-minute and tokens-per-minute buckets (token counts are
+      estimated up front and corrected from the reported usage), and in the concurrency semaphore;
+    - is retried on 429, 5xx, timeouts and connection errors with exponential backoff, waiting at least
+      the Retry-After the API sent; a 429 holds off every caller for its Retry-After, and an exhausted
+      x-ratelimit-remaining-* header empties the matching bucket until the reported reset;
+    - is coalesced with identical calls already in flight (same endpoint and arguments), which then share
+      the one upstream response; streams are never coalesced;
+    - returns an OpenAIResult instead of raising.
+    """
+
+    def __init__(self, client=openai_client, rpm: int = OPENAI_RPM_LIMIT, tpm: int = OPENAI_TPM_LIMIT,
+                 max_concurrency: int = OPENAI_MAX_CONCURRENCY, retries: int = OPENAI_GATEWAY_RETRIES,
+                 queue_timeout: float = OPENAI_QUEUE_TIMEOUT_SECONDS):
+        self.client = client
+        self.pid = os.getpid()
+        self.retries = max(0, retries)
+        self.queue_timeout = queue_timeout
+        self._requests = TokenBucket(rpm) if rpm > 0 else None
+        self._tokens = TokenBucket(tpm) if tpm > 0 else None
+        self._slots = threading.BoundedSemaphore(max(1, max_concurrency))
+        self._paused_until = 0.0
+        self._in_flight: Dict[str, Future] = {}
+        self._in_flight_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._stats = {"calls": 0, "upstream_calls": 0, "coalesced": 0, "retries": 0, "rate_limited": 0,
+                       "failures": 0, "queue_timeouts": 0, "active": 0}
+
+    def embeddings(self, model: str, input) -> OpenAIResult:
+        """embeddings.create(model=model, input=input); input is a string or a list of strings."""
+        texts = [input] if isinstance(input, str) else list(input)
+        estimate = sum(count_tokens(text) for text in texts)
+        return self._call("embeddings", lambda c: c.embeddings, {"model": model, "input": input}, estimate)
+
+    def chat(self, model: str, messages: List[Dict[str, str]], **kwargs) -> OpenAIResult:
+        """chat.completions.create(model=model, messages=messages, **kwargs), without streaming."""
+        params = {"model": model, "messages": messages, **kwargs}
+        return self._call("chat", lambda c: c.chat.completions, params, self._chat_estimate(messages, kwargs))
+
+    def chat_stream(self, model: str, messages: List[Dict[str, str]], **kwargs) -> OpenAIResult:
+        """
+        Streaming chat.completions.create. Retries only cover opening the stream; value iterates the
+        chunks and holds a concurrency slot until it is exhausted or closed.
+        """
+        params = {"model": model, "messages": messages, "stream": True, **kwargs}
+        self._count("calls")
+        result = self._execute("chat_stream", lambda c: c.chat.completions, params,
+                               self._chat_estimate(messages, kwargs), hold_slot=True)
+        if result.ok:
+            result.value = _SlotStream(result.value, self._release)
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self._stats)
+
+    @staticmethod
+    def _chat_estimate(messages: List[Dict[str, str]], kwargs: dict) -> int:
+        prompt = sum(count_tokens(m.get("content") or "") for m in messages)
+        completion = kwargs.get("max_tokens") or kwargs.get("max_completion_tokens") or OPENAI_COMPLETION_TOKENS_ESTIMATE
+        return prompt + completion
+
+    def _count(self, key: str, amount: int = 1):
+        with self._lock:
+            self._stats[key] += amount
+
+    def _call(self, kind: str, endpoint: Callable, params: dict, estimate: int) -> OpenAIResult:
+        """Single-flight wrapper of _execute: identical concurrent calls share one upstream call."""
+        self._count("calls")
+        key = hashlib.sha256(json.dumps([kind, params], sort_keys=True, default=str).encode("utf-8")).hexdigest()
+        with self._in_flight_lock:
+            leader = self._in_flight.get(key)
+            if leader is None:
+                future = self._in_flight[key] = Future()
+        if leader is not None:
+            self._count("coalesced")
+            metrics.inc("csc_openai_coalesced_total", kind=kind)
+            shared = leader.result()
+            return OpenAIResult(**{**shared.__dict__, "coalesced": True})
+
+        try:
+            result = self._execute(kind, endpoint, params, estimate)
+        except BaseException as e:
+            result = OpenAIResult(ok=False, error=f"{type(e).__name__}: {e}")
+            raise
+        finally:
+            with self._in_flight_lock:
+                self._in_flight.pop(key, None)
+            future.set_result(result)
+        return result
+
+    def _execute(self, kind: str, endpoint: Callable, params: dict, estimate: int,
+                 hold_slot: bool = False) -> OpenAIResult:
+        started = time.perf_counter()
+        attempts, error, status = 0, None, None
+        while True:
+            attempts += 1
+            deadline = time.monotonic() + self.queue_timeout
+            if not self._acquire(estimate, deadline):
+                self._count("queue_timeouts")
+                metrics.inc("csc_openai_failures_total", kind=kind, reason="queue_timeout")
+                return OpenAIResult(ok=False, error=error or "Timed out waiting for an OpenAI rate-limit slot",
+                                    status=status, attempts=attempts - 1, seconds=time.perf_counter() - started)
+            metrics.observe("csc_stage_duration_seconds", time.perf_counter() - started, stage="openai_queue_wait")
+
+            delay = None
+            release = True
+            try:
+                self._count("upstream_calls")
+                raw = endpoint(self.client.with_options(max_retries=0)).with_raw_response.create(**params)
+                self._observe_headers(raw.headers)
+                value = raw.parse()
+                if self._tokens is not None:
+                    used = _usage_tokens(value)
+                    if used is not None:
+                        self._tokens.charge(used - estimate)
+                release = not hold_slot
+                return OpenAIResult(ok=True, value=value, attempts=attempts, seconds=time.perf_counter() - started)
+            except RETRYABLE_ERRORS as e:
+                error, status = f"{type(e).__name__}: {e}", getattr(e, "status_code", None)
+                response = getattr(e, "response", None)
+                delay = _retry_after(response.headers if response is not None else None)
+                if isinstance(e, openai.RateLimitError):
+                    self._count("rate_limited")
+                    self._observe_headers(response.headers if response is not None else None, delay)
+                    if delay:
+                        self._paused_until = max(self._paused_until, time.monotonic() + delay)
+                reason = "rate_limited" if status == 429 else type(e).__name__
+            except openai.APIStatusError as e:
+                error, status = f"{type(e).__name__}: {e}", e.status_code
+                reason = None
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+                reason = None
+            finally:
+                if release:
+                    self._release()
+
+            if reason is None or attempts > self.retries:
+                self._count("failures")
+                metrics.inc("csc_openai_failures_total", kind=kind, reason=reason or "error")
+                logger.warning("OpenAI %s call failed after %s attempt(s): %s", kind, attempts, error)
+                return OpenAIResult(ok=False, error=error, status=status, attempts=attempts,
+                                    seconds=time.perf_counter() - started)
+
+            backoff = random.uniform(0, min(OPENAI_BACKOFF_MAX_SECONDS, OPENAI_BACKOFF_BASE_SECONDS * 2 ** (attempts - 1)))
+            wait = max(backoff, delay or 0)
+            self._count("retries")
+            metrics.inc("csc_openai_retries_total", kind=kind, reason=reason)
+            logger.info("OpenAI %s call failed (%s), retry %s in %.2fs", kind, error, attempts, wait)
+            time.sleep(wait)
+
+    def _acquire(self, estimate: int, deadline: float) -> bool:
+        # every caller holds off while a 429's Retry-After runs
+        pause = self._paused_until - time.monotonic()
+        if pause > 0:
+            if time.monotonic() + pause > deadline:
+                return False
+            time.sleep(pause)
+        if self._requests is not None and not self._requests.take(1, deadline):
+            return False
+        if self._tokens is not None and not self._tokens.take(estimate, deadline):
+            return False
+        if not self._slots.acquire(timeout=max(0.0, deadline - time.monotonic())):
+            return False
+        with self._lock:
+            self._stats["active"] += 1
+        return True
+
+    def _release(self):
+        self._slots.release()
+        with self._lock:
+            self._stats["active"] -= 1
+
+    def _observe_headers(self, headers, retry_after: Optional[float] = None):
+        """Pauses a bucket whose x-ratelimit-remaining-* header says the account limit is used up."""
+        if headers is None:
+            return
+        for name, bucket in (("requests", self._requests), ("tokens", self._tokens)):
+            if bucket is None or headers.get(f"x-ratelimit-remaining-{name}") != "0":
+                continue
+            reset = _duration_seconds(headers.get(f"x-ratelimit-reset-{name}")) or retry_after
+            if reset:
+                bucket.drain(reset)
+
+
+_gateway = None
+_gateway_lock = threading.Lock()
+
+
+def get_openai_gateway() -> OpenAIGateway:
+    """
+    Process-wide OpenAIGateway, built on first use (after fork under gunicorn).
+    """
+    global _gateway
+    if _gateway is None or _gateway.pid != os.getpid():
+        with _gateway_lock:
+            if _gateway is None or _gateway.pid != os.getpid():
+                _gateway = OpenAIGateway()
+    return _gateway
+
+
+def openai_gateway_stats() -> Dict[str, Any]:
+    return get_openai_gateway().stats()
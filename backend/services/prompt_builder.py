@@ -0,0 +1,258 @@
+import os
+import threading
+from collections import defaultdict
+from typing import List, Dict, Any, Tuple
+from dotenv import load_dotenv
+from utils.log import get_logger
+load_dotenv()
+OPENAI_CHAT_MODEL = os.getenv("OPENAI_CHAT_MODEL")
+
+# Token budgets of the dynamic parts of the prompt, chunks and history entries past the budget are dropped
+PROMPT_DOCS_TOKEN_BUDGET = int(os.getenv("PROMPT_DOCS_TOKEN_BUDGET", 3000))
+PROMPT_HISTORY_TOKEN_BUDGET = int(os.getenv("PROMPT_HISTORY_TOKEN_BUDGET", 800))
+
+logger = get_logger("prompt_builder")
+
+DELIMITER = "$$$$"
+
+# Static instructions, sent first and unchanged on every request so the provider can cache this prefix.
+# Everything that depends on the request goes in the user message built by build_prompt.
+SYSTEM_PROMPT = f"""
+        You are an assistant helping resolve support tickets.
+
+        The user message contains the User Query, the Conversation History (summarized) and the
+        Relevant Documentation (DOCS). If the conversation history is empty, treat the conversation as new.
+
+        You will see the relevant documentation in the form :
+        {DELIMITER}
+        text1:::url1:::FINISH, text1:::url2:::FINISH..etc
+        {DELIMITER}
+        In this docs, there will be many url_ids and many points. Refer to all the points and clearly state the answer. Cite all the URLs mentioned in DOCS.
+        Do not simple judge on score basis. Consider every detail and then answer.
+        {DELIMITER}
+        When a user asks for steps, refer to documentation and create steps and return back to the user.
+        NEVER say, "I dont find this in documentation" : Looks weak
+        You will never give the user inaccurate data, remember that
+        {DELIMITER}
+        {DELIMITER}
+        Classify the incoming ticket as follows :
+
+        {DELIMITER}If the topic is How-to, Product, Best practices, API/SDK, or SSO, use DOCS to generate and display a direct answer.{DELIMITER}
+        If the topic is anything else, respond with a simple message indicating classification and routing.
+        {DELIMITER}
+        For example:
+        “This ticket has been classified as a 'Connector' issue and routed to the appropriate team.”
+        "We've categorized this as a Connector issue and passed it to the right team who can help you further."
+        "This has been identified as a Connector issue and is now with our specialists for resolution."
+        "Looks like this is a Connector issue. I've routed it to the right experts so they can assist you."
+        "Your request falls under a Connector issue, and I've shared it with the right team to handle it quickly."
+        "This ticket has been flagged as a Connector issue and forwarded to our support experts for action."
+        {DELIMITER}
+        {DELIMITER}
+
+        Instructions:
+        - Draft a clear and accurate response to the user's query.
+        - Cite only from the URLs explicitly present in the provided DOCS.
+        - Do not ask follow-up questions.
+        - If no relevant DOCS found, return with "Cited_URLs": [].
+        - Output strictly in the following JSON format:
+
+        [{{
+            "LLM_Response": "<drafted response to the ticket>",
+            "Cited_URLs": ["<url1> , <url2> , <url3>"]
+        }}]
+    """
+
+_encoding = {}
+
+
+def _get_encoding():
+    """tiktoken encoding of OPENAI_CHAT_MODEL, None when tiktoken is not installed."""
+    if "enc" not in _encoding:
+        try:
+            import tiktoken
+            try:
+                _encoding["enc"] = tiktoken.encoding_for_model(OPENAI_CHAT_MODEL or "")
+            except KeyError:
+                _encoding["enc"] = tiktoken.get_encoding("o200k_base")
+        except ImportError:
+            _encoding["enc"] = None
+            logger.warning("tiktoken is not installed, token budgets use a 4 characters per token estimate")
+    return _encoding["enc"]
+
+
+def count_tokens(text: str) -> int:
+    """
+    Local token count of text: exact with tiktoken, otherwise estimated at 4 characters per token.
+    """
+    if not text:
+        return 0
+    enc = _get_encoding()
+    if enc is not None:
+        return len(enc.encode(text, disallowed_special=()))
+    return (len(text) + 3) // 4
+
+
+def _truncate(text: str, max_tokens: int) -> str:
+    enc = _get_encoding()
+    if enc is not None:
+        return enc.decode(enc.encode(text, disallowed_special=())[:max_tokens])
+    return text[:max_tokens * 4]
+
+
+def format_docs(results: List[Dict[str, Any]]) -> str:
+    """
+    Formats the documents retrieved from the vector database for LLM input."""
+    grouped = defaultdict(list)
+    for r in results:
+        text = r.get("text") or ""
+        url = r.get("url") or ""
+        grouped[r.get("id")].append(f"{text}:::{url}:::FINISH")
+
+    return "\n".join(
+        f"{doc_id}\n" + "\n".join(pairs)
+        for doc_id, pairs in grouped.items()
+    )
+
+
+def format_conv_history(responses: List[str]) -> str:
+    """
+    Formats the conversation history for LLM input.
+    """
+    return "\n".join(responses)
+
+
+def dedupe_chunks(results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Keeps the first (best scored) chunk of each (url_id, parent_id); chunks without either are keyed on their text.
+    """
+    seen = set()
+    unique = []
+    for r in results:
+        if r.get("url_id") or r.get("parent_id"):
+            key = ("doc", r.get("url_id"), r.get("parent_id"))
+        else:
+            key = ("text", r.get("text"), r.get("url"))
+        if key not in seen:
+            seen.add(key)
+            unique.append(r)
+    return unique
+
+
+def fit_docs(results: List[Dict[str, Any]], budget: int) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    Chunks in rank order that fit in budget tokens; a chunk that does not fit is skipped and smaller,
+    lower ranked ones may still fill the rest. A top chunk larger than the whole budget is truncated.
+    Returns (kept chunks, tokens used).
+    """
+    kept, used = [], 0
+    for r in results:
+        # text plus the ":::url:::FINISH" framing
+        cost = count_tokens(f"{r.get('id')}\n{r.get('text') or ''}:::{r.get('url') or ''}:::FINISH")
+        if used + cost > budget:
+            if not kept and budget > 0:
+                r = {**r, "text": _truncate(r.get("text") or "", max(budget - count_tokens(r.get("url") or "") - 8, 0))}
+                kept.append(r)
+                used = budget
+                break
+            continue
+        kept.append(r)
+        used += cost
+    return kept, used
+
+
+def fit_history(responses: List[str], budget: int) -> Tuple[List[str], int]:
+    """
+    History entries in the order given (most relevant first) until budget tokens are used.
+    """
+    kept, used = [], 0
+    for response in responses:
+        cost = count_tokens(response)
+        if used + cost > budget:
+            break
+        kept.append(response)
+        used += cost
+    return kept, used
+
+
+def build_prompt(
+    user_text: str,
+    responses: List[str],
+    results: List[Dict[str, Any]],
+    docs_budget: int = None,
+    history_budget: int = None,
+) -> Tuple[List[Dict[str, str]], Dict[str, int]]:
+    """
+    Builds the chat messages for one ticket: the static SYSTEM_PROMPT, then a user message with the query,
+    the conversation history and the deduplicated docs, each trimmed to its token budget.
+    Returns (messages, token report).
+    """
+    docs_budget = PROMPT_DOCS_TOKEN_BUDGET if docs_budget is None else docs_budget
+    history_budget = PROMPT_HISTORY_TOKEN_BUDGET if history_budget is None else history_budget
+
+    unique = dedupe_chunks(results)
+    docs, docs_tokens = fit_docs(unique, docs_budget)
+    history, history_tokens = fit_history(responses, history_budget)
+
+    user_message = f"""
+        User Query:
+        {user_text}
+
+        Conversation History (summarized):
+        {format_conv_history(history)}
+
+        Relevant Documentation (DOCS):
+        ```{format_docs(docs)}``` -> DOCS
+    """
+    system_tokens = count_tokens(SYSTEM_PROMPT)
+    prompt_tokens = system_tokens + count_tokens(user_message)
+    report = {
+        "prompt_tokens": prompt_tokens,
+        "system_tokens": system_tokens,
+        "docs_tokens": docs_tokens,
+        "history_tokens": history_tokens,
+        "docs_kept": len(docs),
+        "docs_duplicates": len(results) - len(unique),
+        "docs_dropped": len(unique) - len(docs),
+        "history_kept": len(history),
+        "history_dropped": len(responses) - len(history),
+    }
+    messages = [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": user_message},
+    ]
+    return messages, report
+
+
+class PromptStats:
+    """
+    Running totals of the prompt token reports, plus the prompt and cached token counts returned by OpenAI.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._totals = defaultdict(int)
+
+    def record(self, report: Dict[str, int], usage=None):
+        with self._lock:
+            self._totals["requests"] += 1
+            for key, value in report.items():
+                self._totals[key] += value
+            if usage is not None:
+                self._totals["openai_prompt_tokens"] += getattr(usage, "prompt_tokens", 0) or 0
+                details = getattr(usage, "prompt_tokens_details", None)
+                self._totals["openai_cached_tokens"] += getattr(details, "cached_tokens", 0) or 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            totals = dict(self._totals)
+        requests = totals.get("requests", 0)
+        averages = {
+            f"avg_{key}": round(value / requests, 1)
+            for key, value in totals.items() if key != "requests" and requests
+        }
+        return {"requests": requests, "tokenizer": "tiktoken" if _get_encoding() else "estimate", **averages,
+                "openai_cached_tokens": totals.get("openai_cached_tokens", 0)}
+
+
+prompt_stats = PromptStats()
@@ -3,12 +3,18 @@ import os
 import json
 import traceback
 import uuid
+import threading
+from collections import OrderedDict
 from typing import List, Dict, Any, Optional
 from qdrant_client import QdrantClient
 from qdrant_client.http.models import PointStruct
 from qdrant_client.models import FieldCondition, PayloadSchemaType
 from qdrant_client import models
-from openai import OpenAI
+from .embedding_store import get_embedding_store
+from .clients import qdrant_client
+from .openai_gateway import get_openai_gateway
+from utils.metrics import metrics, span, timed
+from utils.log import get_logger
 from dotenv import load_dotenv
 load_dotenv()
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
@@ -22,27 +28,169 @@ QDRANT_COLLECTION_3 = os.getenv("QDRANT_COLLECTION_3")
 QDRANT_VECTOR_NAME = os.getenv("QDRANT_VECTOR_NAME")
 
 
+logger = get_logger("qdrant_service", sampled=True)
 VECTOR_NAME = QDRANT_VECTOR_NAME
-openai_client = OpenAI(api_key=OPENAI_API_KEY)
-qdrant_client = QdrantClient(url=QDRANT_URL, api_key=QDRANT_API_KEY)
 
 top_k = 3
 
+# Process-wide LRU of embeddings keyed by (model, text), 0 disables it
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", 4096))
+# Max texts per embeddings request in embed_texts
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", 512))
+# Output size of the OpenAI embedding models, OPENAI_EMBEDDING_DIM overrides it for other models
+EMBEDDING_DIMENSIONS = {
+    "text-embedding-3-small": 1536,
+    "text-embedding-3-large": 3072,
+    "text-embedding-ada-002": 1536,
+}
+
+_embedding_cache = OrderedDict()
+_embedding_cache_lock = threading.Lock()
+_embedding_cache_stats = {"hits": 0, "misses": 0}
+
+
+def _cache_get(key):
+    with _embedding_cache_lock:
+        vector = _embedding_cache.get(key)
+        if vector is None:
+            _embedding_cache_stats["misses"] += 1
+            return None
+        _embedding_cache.move_to_end(key)
+        _embedding_cache_stats["hits"] += 1
+        return list(vector)
+
+
+def _cache_put(key, vector: List[float]):
+    if EMBEDDING_CACHE_SIZE <= 0:
+        return
+    with _embedding_cache_lock:
+        _embedding_cache[key] = tuple(vector)
+        _embedding_cache.move_to_end(key)
+        while len(_embedding_cache) > EMBEDDING_CACHE_SIZE:
+            _embedding_cache.popitem(last=False)
+
+
+def embedding_size() -> Optional[int]:
+    """
+    Size of the vectors returned for OPENAI_EMBEDDING_MODEL, None when it is not known without calling the API.
+    """
+    if os.getenv("OPENAI_EMBEDDING_DIM"):
+        return int(os.getenv("OPENAI_EMBEDDING_DIM"))
+    return EMBEDDING_DIMENSIONS.get(OPENAI_EMBEDDING_MODEL)
+
+
+def embedding_cache_stats() -> Dict[str, Any]:
+    """
+    Returns hit/miss counters and the current size of the embedding LRU.
+    """
+    with _embedding_cache_lock:
+        hits, misses = _embedding_cache_stats["hits"], _embedding_cache_stats["misses"]
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+            "size": len(_embedding_cache),
+            "max_size": EMBEDDING_CACHE_SIZE,
+        }
+
+
+def clear_embedding_cache():
+    with _embedding_cache_lock:
+        _embedding_cache.clear()
+        _embedding_cache_stats["hits"] = 0
+        _embedding_cache_stats["misses"] = 0
+
+
+def _create_embeddings(texts):
+    """
+    One embeddings request through the OpenAI gateway (rate limits, retries, coalescing of identical
+    concurrent requests); raises when it failed.
+    """
+    with span("openai_embeddings"):
+        result = get_openai_gateway().embeddings(OPENAI_EMBEDDING_MODEL, texts)
+        if not result.ok:
+            raise RuntimeError(f"Embeddings request failed: {result.error}")
+    if not result.coalesced:
+        _count_embedding_tokens(result.value)
+    return result.value
+
+
+def _count_embedding_tokens(resp):
+    usage = getattr(resp, "usage", None)
+    if usage is not None and getattr(usage, "total_tokens", None):
+        metrics.inc("csc_openai_tokens_total", usage.total_tokens, kind="embedding")
+
+
+@timed("embed_text")
 def embed_text(text: str) -> List[float]:
     """
     Generates an embedding vector for the given text using OpenAI text-3-small embedding model. 
     vector size = 1536
+    Results are kept in a process-wide LRU (EMBEDDING_CACHE_SIZE entries) keyed by model and text,
+    then in the persistent embedding store when EMBEDDING_STORE_PATH is set,
+    so a repeated text does not call the embeddings API again.
     """
-    
-    resp = openai_client.embeddings.create(model=OPENAI_EMBEDDING_MODEL, input=text)
-    
-    return resp.data[0].embedding
+    key = (OPENAI_EMBEDDING_MODEL, text)
+    cached = _cache_get(key)
+    if cached is not None:
+        return cached
+
+    store = get_embedding_store()
+    if store is not None:
+        vector = store.get(OPENAI_EMBEDDING_MODEL, text)
+        if vector is not None:
+            _cache_put(key, vector)
+            return vector
+
+    resp = _create_embeddings(text)
+    vector = resp.data[0].embedding
+    _cache_put(key, vector)
+    if store is not None:
+        store.put(OPENAI_EMBEDDING_MODEL, text, vector)
+    return vector
+
+@timed("embed_texts")
+def embed_texts(texts: List[str]) -> List[List[float]]:
+    """
+    Batched embed_text: returns one vector per text, in order.
+    Texts missing from the LRU and the embedding store are embedded with list input,
+    EMBEDDING_BATCH_SIZE texts per embeddings request.
+    """
+    vectors: Dict[str, List[float]] = {}
+    missing = []
+    for text in dict.fromkeys(texts):
+        cached = _cache_get((OPENAI_EMBEDDING_MODEL, text))
+        if cached is not None:
+            vectors[text] = cached
+        else:
+            missing.append(text)
 
-def search_text(query: str, k: int) -> List[Dict[str, Any]]:
+    store = get_embedding_store()
+    if store is not None and missing:
+        stored = store.get_many(OPENAI_EMBEDDING_MODEL, missing)
+        for text, vector in stored.items():
+            vectors[text] = vector
+            _cache_put((OPENAI_EMBEDDING_MODEL, text), vector)
+        missing = [text for text in missing if text not in stored]
+
+    for start in range(0, len(missing), EMBEDDING_BATCH_SIZE):
+        chunk = missing[start:start + EMBEDDING_BATCH_SIZE]
+        resp = _create_embeddings(chunk)
+        fresh = {text: item.embedding for text, item in zip(chunk, sorted(resp.data, key=lambda d: d.index))}
+        for text, vector in fresh.items():
+            vectors[text] = vector
+            _cache_put((OPENAI_EMBEDDING_MODEL, text), vector)
+        if store is not None:
+            store.put_many(OPENAI_EMBEDDING_MODEL, fresh)
+
+    return [list(vectors[text]) for text in texts]
+
+def search_text(query: str, k: int, query_vector: Optional[List[float]] = None) -> List[Dict[str, Any]]:
     """
     Searches the Qdrant collection for the top-k(5 in our case) most similar documents to the query text.
     k is set so as to not overload the LLM with too many documents.
     Searched in QDRANT_COLLECTION (Primary collection for RAG Pipeline) ie atlan-web-docs-3
+    Pass query_vector when the query has already been embedded to skip embed_text.
     """
     try:
         if not query:
@@ -52,48 +200,81 @@ def search_text(query: str, k: int) -> List[Dict[str, Any]]:
         top_k = k 
 
         
-        vec = embed_text(query)
+        vec = query_vector if query_vector is not None else embed_text(query)
 
         
-        hits = qdrant_client.query_points(
-            collection_name=QDRANT_COLLECTION,
-            query=vec,
-            using=VECTOR_NAME,
-            limit=top_k,
-            with_payload=True
-        ).points
+        with span("qdrant_search"):
+            hits = qdrant_client.query_points(
+                collection_name=QDRANT_COLLECTION,
+                query=vec,
+                using=VECTOR_NAME,
+                limit=top_k,
+                with_payload=True
+            ).points
 
-        
-        results: List[Dict[str, Any]] = []
-        for h in hits:
-            payload = h.payload or {}
-            results.append({
-                "id": str(h.id),
-                "score": float(h.score) if h.score is not None else 0.0,
-                "text": payload.get("text", ""),
-                "url": payload.get("url", ""),
-                "url_id": payload.get("url_id", ""),
-                "parent_id": payload.get("parent_id", "")
-            })
-
-        return results
+        return _doc_results(hits)
 
     except Exception as e:
-        print(f"Error in search function: {e}")
+        logger.warning("Error in search function: %s", e)
         return []
 
 
+def _doc_results(hits) -> List[Dict[str, Any]]:
+    results: List[Dict[str, Any]] = []
+    for h in hits:
+        payload = h.payload or {}
+        results.append({
+            "id": str(h.id),
+            "score": float(h.score) if h.score is not None else 0.0,
+            "text": payload.get("text", ""),
+            "url": payload.get("url", ""),
+            "url_id": payload.get("url_id", ""),
+            "parent_id": payload.get("parent_id", "")
+        })
+    return results
 
-def insert_point(client: QdrantClient, user_id: str, input_text: str, llm_response: str):
+
+def search_texts(queries: List[str], k: int,
+                 query_vectors: Optional[List[List[float]]] = None) -> List[List[Dict[str, Any]]]:
+    """
+    Batched search_text: the top-k documents of every query, in order, from one Qdrant batch query.
+    query_vectors are the embeddings of queries if the caller already has them.
+    A failed search returns an empty list for every query.
+    """
+    if not queries:
+        return []
+    try:
+        vectors = query_vectors if query_vectors is not None else embed_texts(queries)
+        with span("qdrant_search_batch"):
+            responses = qdrant_client.query_batch_points(
+                collection_name=QDRANT_COLLECTION,
+                requests=[
+                    models.QueryRequest(query=vec, using=VECTOR_NAME, limit=k, with_payload=True)
+                    for vec in vectors
+                ]
+            )
+        return [_doc_results(response.points) for response in responses]
+
+    except Exception as e:
+        logger.warning("Error in batch search function: %s", e)
+        return [[] for _ in queries]
+
+
+
+@timed("insert_point")
+def insert_point(client: QdrantClient, user_id: str, input_text: str, llm_response: str,
+                 vector: Optional[List[float]] = None):
     """
     Inserts a new point into the Qdrant collection for chat history.
     Each point contains user_id, input_text, llm_response, and created_at timestamp.
-    Pushes into qdrant collection QDRANT_COLLECTION_3 (chat-history-with-llm-per-user)"""
-    print(f"Inserting chat history for user_id: {user_id}")
+    Pushes into qdrant collection QDRANT_COLLECTION_3 (chat-history-with-llm-per-user)
+    vector is the embedding of input_text if the caller already has it."""
+    logger.debug("Inserting chat history for user_id: %s", user_id)
 
     
     point_id = str(uuid.uuid4())
-    vector = embed_text(input_text)
+    if vector is None:
+        vector = embed_text(input_text)
 
     payload = {
         "user_id": user_id,                
@@ -110,13 +291,50 @@ def insert_point(client: QdrantClient, user_id: str, input_text: str, llm_respon
         points=[point],
     )
 
-    print(f"Inserted chat history for user_id: {user_id}, point_id: {point_id}")
+    logger.debug("Inserted chat history for user_id: %s, point_id: %s", user_id, point_id)
+
+@timed("insert_points")
+def insert_points(client: QdrantClient, records: List[Dict[str, Any]], wait: bool = True):
+    """
+    Bulk version of insert_point for QDRANT_COLLECTION_3.
+    Each record has point_id, user_id, input_text, llm_response, created_at and optionally vector;
+    records without a vector are embedded together in one embed_texts call.
+    """
+    if not records:
+        return
+    missing = [r for r in records if r.get("vector") is None]
+    if missing:
+        for record, vector in zip(missing, embed_texts([r["input_text"] for r in missing])):
+            record["vector"] = vector
+
+    points = [
+        PointStruct(
+            id=r["point_id"],
+            vector=r["vector"],
+            payload={
+                "user_id": r["user_id"],
+                "input_text": r["input_text"],
+                "llm_response": r["llm_response"],
+                "created_at": r["created_at"]
+            }
+        )
+        for r in records
+    ]
+    client.upsert(
+        collection_name=QDRANT_COLLECTION_3,
+        wait=wait,
+        points=points,
+    )
 
-def retrieve_llm_responses_by_user(client: QdrantClient, user_id: str, input_text: str) -> List[str]:
+@timed("history_retrieval")
+def retrieve_llm_responses_by_user(client: QdrantClient, user_id: str, input_text: str,
+                                   query_vector: Optional[List[float]] = None) -> List[str]:
     """
     Retrieves the top 3 most relevant LLM responses for a given user_id based on the input_text.
-    Searches in QDRANT_COLLECTION_3 (chat-history-with-llm-per-user)"""
-    query_vector = embed_text(input_text)
+    Searches in QDRANT_COLLECTION_3 (chat-history-with-llm-per-user)
+    query_vector is the embedding of input_text if the caller already has it."""
+    if query_vector is None:
+        query_vector = embed_text(input_text)
 
     results = client.search(
         collection_name=QDRANT_COLLECTION_3,
@@ -132,3 +350,38 @@ def retrieve_llm_responses_by_user(client: QdrantClient, user_id: str, input_tex
 
     return [r.payload["llm_response"] for r in results if "llm_response" in r.payload]
 
+@timed("history_retrieval_batch")
+def retrieve_llm_responses_by_users(client: QdrantClient, user_ids: List[str], input_texts: List[str],
+                                    query_vectors: Optional[List[List[float]]] = None) -> List[List[str]]:
+    """
+    Batched retrieve_llm_responses_by_user: the top 3 LLM responses of each (user_id, input_text) pair,
+    in order, from one Qdrant batch query on QDRANT_COLLECTION_3.
+    """
+    if not input_texts:
+        return []
+    if query_vectors is None:
+        query_vectors = embed_texts(input_texts)
+
+    responses = client.query_batch_points(
+        collection_name=QDRANT_COLLECTION_3,
+        requests=[
+            models.QueryRequest(
+                query=vector,
+                limit=3,
+                with_payload=["llm_response"],
+                filter=models.Filter(
+                    must=[models.FieldCondition(
+                        key="user_id",
+                        match=models.MatchValue(value=user_id)
+                    )]
+                )
+            )
+            for user_id, vector in zip(user_ids, query_vectors)
+        ]
+    )
+
+    return [
+        [p.payload["llm_response"] for p in response.points if p.payload and "llm_response" in p.payload]
+        for response in responses
+    ]
+
@@ -0,0 +1,209 @@
+import os
+import re
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional
+import numpy as np
+from dotenv import load_dotenv
+from qdrant_client import models
+from .clients import qdrant_client
+from utils.log import get_logger
+load_dotenv()
+
+logger = get_logger("response_cache")
+QDRANT_COLLECTION = os.getenv("QDRANT_COLLECTION")
+
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "1") == "1"
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", 1024))
+RESPONSE_CACHE_TTL_SECONDS = float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", 3600))
+# cosine similarity above which a previous answer is reused for a different query text, >1 disables the layer
+RESPONSE_CACHE_SIMILARITY = float(os.getenv("RESPONSE_CACHE_SIMILARITY", 0.97))
+# how often the docs collection is checked for changes
+RESPONSE_CACHE_DOCS_CHECK_SECONDS = float(os.getenv("RESPONSE_CACHE_DOCS_CHECK_SECONDS", 60))
+# Optional payload field of the doc chunks that changes on every edit (a version or updated_at), needs a
+# range or datetime payload index. Without it only changes of the chunk count are noticed, see _docs_fingerprint
+RESPONSE_CACHE_DOCS_VERSION_FIELD = os.getenv("RESPONSE_CACHE_DOCS_VERSION_FIELD")
+
+
+def normalise_query(text: str) -> str:
+    return re.sub(r"\s+", " ", text or "").strip().lower()
+
+
+def exact_key(user_text: str, doc_ids: List[str]) -> str:
+    """
+    Exact-match key: normalised query plus the sorted IDs of the retrieved doc chunks.
+    """
+    raw = normalise_query(user_text) + "\x00" + "\x00".join(sorted(str(d) for d in doc_ids))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _docs_fingerprint():
+    """
+    Point counts of the docs collection, plus the highest RESPONSE_CACHE_DOCS_VERSION_FIELD value when set.
+    Without that field a docs refresh that edits chunks in place and keeps their count is not noticed,
+    call invalidate_response_cache() after it.
+    """
+    info = qdrant_client.get_collection(QDRANT_COLLECTION)
+    fingerprint = (info.points_count, info.indexed_vectors_count)
+    if not RESPONSE_CACHE_DOCS_VERSION_FIELD:
+        return fingerprint
+    points, _ = qdrant_client.scroll(
+        collection_name=QDRANT_COLLECTION,
+        limit=1,
+        order_by=models.OrderBy(key=RESPONSE_CACHE_DOCS_VERSION_FIELD, direction=models.Direction.DESC),
+        with_payload=[RESPONSE_CACHE_DOCS_VERSION_FIELD],
+        with_vectors=False,
+    )
+    latest = points[0].payload.get(RESPONSE_CACHE_DOCS_VERSION_FIELD) if points else None
+    return fingerprint + (latest,)
+
+
+class ResponseCache:
+    """
+    Two-layer cache of parsed LLM responses.
+    1. exact layer: exact_key(query, doc ids) -> response
+    2. semantic layer: cosine similarity of the query embedding against the cached queries that
+       retrieved the same doc chunks, the best match above similarity_threshold is reused
+    Entries expire after ttl seconds, the least recently used entry is evicted past max_entries,
+    and everything is dropped when docs_fingerprint() changes (checked every docs_check_seconds),
+    or by invalidate_response_cache().
+    """
+
+    def __init__(self, max_entries: int = RESPONSE_CACHE_MAX_ENTRIES, ttl: float = RESPONSE_CACHE_TTL_SECONDS,
+                 similarity_threshold: float = RESPONSE_CACHE_SIMILARITY,
+                 docs_check_seconds: float = RESPONSE_CACHE_DOCS_CHECK_SECONDS,
+                 docs_fingerprint=_docs_fingerprint):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        self.docs_check_seconds = docs_check_seconds
+        self.docs_fingerprint = docs_fingerprint
+
+        self._entries = OrderedDict()
+        self._matrix = None
+        self._matrix_keys = []
+        self._lock = threading.Lock()
+        self._fingerprint = None
+        self._fingerprint_checked = 0.0
+        self._stats = {"exact_hits": 0, "semantic_hits": 0, "misses": 0,
+                       "saved_latency_seconds": 0.0, "invalidations": 0}
+
+    def get(self, user_text: str, doc_ids: List[str], query_vector: Optional[List[float]] = None) -> Optional[Dict[str, Any]]:
+        self._check_docs()
+        now = time.time()
+        docs = _doc_set(doc_ids)
+        with self._lock:
+            key = exact_key(user_text, doc_ids)
+            entry = self._live_entry(key, now)
+            if entry is not None:
+                return self._hit(key, entry, "exact_hits")
+
+            if query_vector is not None and self._entries and self.similarity_threshold <= 1.0:
+                if self._matrix is None:
+                    self._build_matrix()
+                if self._matrix is not None:
+                    sims = self._matrix @ _unit(query_vector)
+                    for i in np.argsort(-sims):
+                        if sims[i] < self.similarity_threshold:
+                            break
+                        candidate = self._matrix_keys[i]
+                        entry = self._live_entry(candidate, now)
+                        # an answer is only valid for the doc chunks it was generated from
+                        if entry is not None and entry["doc_ids"] == docs:
+                            return self._hit(candidate, entry, "semantic_hits")
+
+            self._stats["misses"] += 1
+            return None
+
+    def put(self, user_text: str, doc_ids: List[str], query_vector: Optional[List[float]],
+            response: Dict[str, Any], latency: float):
+        with self._lock:
+            key = exact_key(user_text, doc_ids)
+            self._entries[key] = {
+                "response": response,
+                "vector": _unit(query_vector) if query_vector is not None else None,
+                "doc_ids": _doc_set(doc_ids),
+                "created": time.time(),
+                "latency": latency,
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._matrix = None
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+            self._matrix = None
+            self._stats["invalidations"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            lookups = stats["exact_hits"] + stats["semantic_hits"] + stats["misses"]
+            stats["hit_rate"] = (stats["exact_hits"] + stats["semantic_hits"]) / lookups if lookups else 0.0
+            stats["entries"] = len(self._entries)
+            stats["max_entries"] = self.max_entries
+            return stats
+
+    def _live_entry(self, key: str, now: float):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if now - entry["created"] > self.ttl:
+            del self._entries[key]
+            self._matrix = None
+            return None
+        return entry
+
+    def _hit(self, key: str, entry: dict, kind: str) -> Dict[str, Any]:
+        self._entries.move_to_end(key)
+        self._stats[kind] += 1
+        self._stats["saved_latency_seconds"] += entry["latency"]
+        return dict(entry["response"])
+
+    def _build_matrix(self):
+        keys = [key for key, entry in self._entries.items() if entry["vector"] is not None]
+        self._matrix_keys = keys
+        self._matrix = np.stack([self._entries[key]["vector"] for key in keys]) if keys else None
+
+    def _check_docs(self):
+        now = time.time()
+        if now - self._fingerprint_checked < self.docs_check_seconds:
+            return
+        self._fingerprint_checked = now
+        try:
+            fingerprint = self.docs_fingerprint()
+        except Exception as e:
+            logger.warning("Could not check docs collection for response cache: %s", e)
+            return
+        if self._fingerprint is not None and fingerprint != self._fingerprint:
+            logger.info("Docs collection changed, clearing response cache")
+            self.invalidate()
+        self._fingerprint = fingerprint
+
+
+def _doc_set(doc_ids: List[str]) -> tuple:
+    return tuple(sorted(str(d) for d in doc_ids))
+
+
+def _unit(vector) -> np.ndarray:
+    v = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(v)
+    return v / norm if norm else v
+
+
+response_cache = ResponseCache()
+
+
+def response_cache_stats() -> Dict[str, Any]:
+    return response_cache.stats()
+
+
+def invalidate_response_cache():
+    """
+    Drops every cached response, call after re-indexing the docs collection.
+    """
+    response_cache.invalidate()
@@ -0,0 +1,17 @@
+import os
+import sys
+import types
+import importlib.util
+
+# the backend modules import each other as top-level packages (services, pipeline, utils)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# pytest imports backend/__init__.py, and with it the app and pipeline.ml_processing: keep every model lazy
+# so no pipeline is built, and stand in for transformers when the model stack is not installed
+os.environ.setdefault("MODEL_LOAD_MODE", "lazy")
+if importlib.util.find_spec("transformers") is None:
+    def _pipeline(*args, **kwargs):
+        raise RuntimeError("transformers is not installed")
+
+    sys.modules["transformers"] = types.ModuleType("transformers")
+    sys.modules["transformers"].pipeline = _pipeline
@@ -0,0 +1,62 @@
+import threading
+from qdrant_client.http.models import PointStruct
+from pipeline.db_connector import BulkPointWriter
+
+
+class FakeQdrant:
+    """Rejects every upsert that contains one of the rejected point ids, like a payload/vector validation error."""
+
+    def __init__(self, rejected=()):
+        self.rejected = set(rejected)
+        self.upserts = []
+        self.stored = {}
+        self._lock = threading.Lock()
+
+    def upsert(self, collection_name, wait, points):
+        with self._lock:
+            self.upserts.append(([p.id for p in points], wait))
+            bad = [p.id for p in points if p.id in self.rejected]
+            if bad:
+                raise ValueError(f"bad point {bad[0]}")
+            self.stored.update((p.id, p) for p in points)
+
+
+def point(n):
+    return PointStruct(id=n, vector=[0.1, 0.2], payload={"n": n})
+
+
+def test_only_rejected_points_are_reported_with_their_ref():
+    client = FakeQdrant(rejected={3, 7})
+    accepted = []
+    writer = BulkPointWriter(client, "tickets", batch_size=4, flush_interval=0, parallelism=2,
+                             on_success=accepted.extend)
+    with writer:
+        for n in range(10):
+            writer.add(point(n), ref=f"item-{n}")
+
+    assert set(writer.failures) == {"item-3", "item-7"}
+    assert writer.failures["item-3"] == "bad point 3"
+    assert set(client.stored) == set(range(10)) - {3, 7}
+    assert sorted({p.id for p in accepted}) == sorted(client.stored)
+
+
+def test_close_ends_with_a_waited_upsert():
+    client = FakeQdrant()
+    writer = BulkPointWriter(client, "tickets", batch_size=2, flush_interval=0, parallelism=2)
+    for n in range(4):
+        writer.add(point(n), ref=n)
+    assert writer.close() == {}
+
+    # every full chunk went out with wait=False, the barrier re-sends the last point with wait=True
+    assert [wait for _, wait in client.upserts] == [False, False, True]
+    assert client.upserts[-1][0] == [3]
+
+
+def test_flush_drops_completed_futures():
+    client = FakeQdrant()
+    writer = BulkPointWriter(client, "tickets", batch_size=100, flush_interval=0, parallelism=1)
+    writer.add(point(1), ref=1)
+    for future in writer.flush():
+        future.result()
+    assert writer.flush() == []
+    writer.close()
@@ -0,0 +1,53 @@
+import json
+import pytest
+from services.llm_service import LLMResponseStreamParser
+
+ENVELOPE = json.dumps([{
+    "LLM_Response": 'Go to "Settings" \\ SSO.\nThen retry é中 \U0001F600 done',
+    "Cited_URLs": ["https://docs.example.com/sso"],
+}])
+
+
+def feed_all(chunks):
+    parser = LLMResponseStreamParser()
+    text = "".join(parser.feed(chunk) for chunk in chunks)
+    return parser, text
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 5, 7, 64, len(ENVELOPE)])
+def test_streamed_text_matches_full_parse_for_any_chunking(size):
+    chunks = [ENVELOPE[i:i + size] for i in range(0, len(ENVELOPE), size)]
+    parser, text = feed_all(chunks)
+
+    expected = json.loads(ENVELOPE)[0]
+    assert text == expected["LLM_Response"]
+    assert parser.emitted
+    assert parser.result() == expected
+
+
+def test_text_after_the_value_is_not_emitted():
+    parser, text = feed_all(['[{"LLM_Response": "hi", ', '"Cited_URLs": ["https://x", "LLM_Response"]}]'])
+    assert text == "hi"
+
+
+def test_key_split_across_chunks():
+    parser, text = feed_all(['[{"LLM_Res', 'ponse"', ' :  ', '"ab', 'c"}]'])
+    assert text == "abc"
+
+
+def test_escape_split_across_chunks_is_held_back():
+    parser = LLMResponseStreamParser()
+    assert parser.feed('[{"LLM_Response": "a\\') == "a"
+    assert parser.feed("u00") == ""
+    assert parser.feed('e9b"}]') == "éb"
+
+
+def test_output_without_envelope_emits_nothing_and_falls_back_to_raw_text():
+    parser, text = feed_all(["Sorry, ", "I cannot help with that."])
+    assert text == "" and not parser.emitted
+    assert parser.result() == {"LLM_Response": "Sorry, I cannot help with that.", "Cited_URLs": []}
+
+
+def test_key_not_followed_by_a_string_is_skipped():
+    parser, text = feed_all(['{"LLM_Response": null, "note": "x", "LLM_Response": "late"}'])
+    assert text == "late"
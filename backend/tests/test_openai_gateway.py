@@ -0,0 +1,234 @@
+import threading
+import httpx
+import openai
+import pytest
+from services import openai_gateway
+from services.openai_gateway import OpenAIGateway, TokenBucket, _duration_seconds, _retry_after
+
+
+class FakeClock:
+    """Stands in for the time module: sleep() advances monotonic() instead of blocking."""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def perf_counter(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class Raw:
+    def __init__(self, value, headers=None):
+        self.value = value
+        self.headers = headers or {}
+
+    def parse(self):
+        return self.value
+
+
+class FakeEndpoint:
+    """embeddings / chat.completions: create() pops the next outcome, raising it if it is an exception."""
+
+    def __init__(self, outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = []
+        self.with_raw_response = self
+
+    def create(self, **params):
+        self.calls.append(params)
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return outcome if isinstance(outcome, Raw) else Raw(outcome)
+
+
+class FakeClient:
+    def __init__(self, outcomes):
+        self.embeddings = FakeEndpoint(outcomes)
+        self.chat = type("Chat", (), {"completions": self.embeddings})()
+
+    def with_options(self, **options):
+        return self
+
+
+def rate_limit_error(headers):
+    request = httpx.Request("POST", "https://api.openai.com/v1/embeddings")
+    return openai.RateLimitError("rate limited", response=httpx.Response(429, headers=headers, request=request), body=None)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(openai_gateway, "time", clock)
+    return clock
+
+
+def test_token_bucket_waits_for_refill(clock):
+    bucket = TokenBucket(60)  # one unit per second
+    assert bucket.take(60, deadline=clock.now)
+    assert bucket.take(3, deadline=clock.now + 10)
+    assert sum(clock.sleeps) == pytest.approx(3)
+
+
+def test_token_bucket_gives_up_past_deadline(clock):
+    bucket = TokenBucket(60)
+    bucket.take(60, deadline=clock.now)
+    assert not bucket.take(5, deadline=clock.now + 2)
+    assert clock.sleeps == []
+
+
+def test_token_bucket_caps_request_at_capacity(clock):
+    bucket = TokenBucket(10)
+    assert bucket.take(1000, deadline=clock.now)
+    assert bucket.level == 0
+
+
+def test_token_bucket_charge_and_drain(clock):
+    bucket = TokenBucket(60)
+    bucket.charge(90)
+    assert bucket.level == -30
+    bucket.charge(-1000)
+    assert bucket.level == 60
+    bucket.drain(5)
+    assert bucket.level == -5
+    assert bucket.take(1, deadline=clock.now + 6)
+    assert sum(clock.sleeps) == pytest.approx(6)
+
+
+def test_duration_and_retry_after_parsing():
+    assert _duration_seconds("20ms") == pytest.approx(0.02)
+    assert _duration_seconds("6m0s") == 360
+    assert _duration_seconds("1h2m3.5s") == pytest.approx(3723.5)
+    assert _duration_seconds("2.5") == 2.5
+    assert _duration_seconds(None) is None
+    assert _retry_after({"retry-after-ms": "1500", "retry-after": "9"}) == 1.5
+    assert _retry_after({"retry-after": "3"}) == 3
+    assert _retry_after({"retry-after": "soon"}) is None
+
+
+def test_retry_waits_at_least_retry_after(clock, monkeypatch):
+    monkeypatch.setattr(openai_gateway.random, "uniform", lambda low, high: high)
+    client = FakeClient([rate_limit_error({"retry-after": "7"}), "vectors"])
+    gateway = OpenAIGateway(client, rpm=0, tpm=0, max_concurrency=2, retries=2, queue_timeout=30)
+
+    result = gateway.embeddings("model", "text")
+
+    assert result.ok and result.value == "vectors" and result.attempts == 2
+    # the 429 pauses every caller for the Retry-After, on top of the retry's own wait
+    assert clock.sleeps[0] == 7
+    stats = gateway.stats()
+    assert stats["rate_limited"] == 1 and stats["retries"] == 1 and stats["active"] == 0
+
+
+def test_backoff_grows_exponentially_and_stops_after_retries(clock, monkeypatch):
+    monkeypatch.setattr(openai_gateway.random, "uniform", lambda low, high: high)
+    request = httpx.Request("POST", "https://api.openai.com/v1/embeddings")
+    errors = [openai.APIConnectionError(request=request) for _ in range(4)]
+    gateway = OpenAIGateway(FakeClient(errors), rpm=0, tpm=0, max_concurrency=1, retries=3, queue_timeout=30)
+
+    result = gateway.embeddings("model", "text")
+
+    assert not result.ok and result.attempts == 4 and "APIConnectionError" in result.error
+    base = openai_gateway.OPENAI_BACKOFF_BASE_SECONDS
+    assert clock.sleeps == [base, base * 2, base * 4]
+    assert gateway.stats()["failures"] == 1
+
+
+def test_non_retryable_error_is_not_retried(clock):
+    request = httpx.Request("POST", "https://api.openai.com/v1/embeddings")
+    error = openai.BadRequestError("bad", response=httpx.Response(400, request=request), body=None)
+    client = FakeClient([error])
+    gateway = OpenAIGateway(client, rpm=0, tpm=0, max_concurrency=1, retries=3, queue_timeout=30)
+
+    result = gateway.embeddings("model", "text")
+
+    assert not result.ok and result.status == 400 and result.attempts == 1
+    assert len(client.embeddings.calls) == 1 and clock.sleeps == []
+
+
+def test_exhausted_remaining_header_drains_bucket(clock):
+    headers = {"x-ratelimit-remaining-requests": "0", "x-ratelimit-reset-requests": "4s"}
+    client = FakeClient([Raw("a", headers), "b"])
+    gateway = OpenAIGateway(client, rpm=600, tpm=0, max_concurrency=1, retries=0, queue_timeout=30)
+
+    assert gateway.embeddings("model", "one").ok
+    assert gateway.embeddings("model", "two").ok
+    # the second call waits for the reported reset, not for the locally computed refill
+    assert sum(clock.sleeps) >= 4
+
+
+def test_identical_concurrent_calls_share_one_upstream_call():
+    started, release = threading.Event(), threading.Event()
+
+    class BlockingEndpoint(FakeEndpoint):
+        def create(self, **params):
+            started.set()
+            release.wait(5)
+            return super().create(**params)
+
+    client = FakeClient([])
+    client.embeddings = BlockingEndpoint(["shared"])
+    gateway = OpenAIGateway(client, rpm=0, tpm=0, max_concurrency=4, retries=0, queue_timeout=5)
+    results = {}
+
+    leader = threading.Thread(target=lambda: results.setdefault("leader", gateway.embeddings("model", "same")))
+    leader.start()
+    assert started.wait(5)
+    follower = threading.Thread(target=lambda: results.setdefault("follower", gateway.embeddings("model", "same")))
+    follower.start()
+    while gateway.stats()["coalesced"] == 0:
+        threading.Event().wait(0.001)
+    release.set()
+    leader.join(5)
+    follower.join(5)
+
+    assert len(client.embeddings.calls) == 1
+    assert results["leader"].value == results["follower"].value == "shared"
+    assert not results["leader"].coalesced and results["follower"].coalesced
+    # once finished the key is forgotten, a later identical call goes upstream again
+    client.embeddings.outcomes.append("again")
+    assert gateway.embeddings("model", "same").value == "again"
+
+
+class FakeStream:
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.closed = False
+
+    def __iter__(self):
+        return iter(self.chunks)
+
+    def close(self):
+        self.closed = True
+
+
+def test_stream_holds_slot_until_exhausted(clock):
+    stream = FakeStream(["a", "b"])
+    gateway = OpenAIGateway(FakeClient([stream]), rpm=0, tpm=0, max_concurrency=1, retries=0, queue_timeout=0)
+
+    result = gateway.chat_stream("model", [{"role": "user", "content": "hi"}])
+    assert result.ok and gateway.stats()["active"] == 1
+    # the only slot is taken by the open stream
+    assert not gateway.embeddings("model", "text").ok
+
+    assert list(result.value) == ["a", "b"]
+    assert stream.closed and gateway.stats()["active"] == 0
+
+
+def test_stream_closed_before_first_chunk_releases_slot(clock):
+    stream = FakeStream(["a"])
+    gateway = OpenAIGateway(FakeClient([stream]), rpm=0, tpm=0, max_concurrency=1, retries=0, queue_timeout=0)
+
+    result = gateway.chat_stream("model", [{"role": "user", "content": "hi"}])
+    result.value.close()
+    # a second close must not release the slot again (the semaphore is bounded and would raise)
+    result.value.close()
+
+    assert stream.closed and gateway.stats()["active"] == 0
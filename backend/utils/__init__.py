@@ -1,5 +1,16 @@
-from .fetch import fetch_tickets
+from .fetch import fetch_tickets, fetch_tickets_page
+from .concurrency import submit, result_or_default
+from .metrics import metrics, span, timed, render_prometheus
+from .log import get_logger
 
 __all__ = [
-    'fetch_tickets'
+    'fetch_tickets',
+    'fetch_tickets_page',
+    'submit',
+    'result_or_default',
+    'metrics',
+    'span',
+    'timed',
+    'render_prometheus',
+    'get_logger'
 ]
\ No newline at end of file
@@ -0,0 +1,37 @@
+import os
+from concurrent.futures import ThreadPoolExecutor, Future, TimeoutError as FutureTimeoutError
+from dotenv import load_dotenv
+from .metrics import metrics
+from .log import get_logger
+load_dotenv()
+
+logger = get_logger("concurrency")
+
+# Shared, bounded pool for independent I/O steps (Qdrant / OpenAI calls) of a request
+IO_EXECUTOR_WORKERS = int(os.getenv("IO_EXECUTOR_WORKERS", 16))
+
+io_executor = ThreadPoolExecutor(max_workers=IO_EXECUTOR_WORKERS, thread_name_prefix="io")
+
+
+def submit(fn, *args, **kwargs) -> Future:
+    """
+    Runs fn(*args, **kwargs) on the shared I/O executor.
+    """
+    return io_executor.submit(fn, *args, **kwargs)
+
+
+def result_or_default(future: Future, timeout: float, default, step: str = ""):
+    """
+    Waits at most timeout seconds for future and returns its result.
+    Returns default if the step timed out or raised; a timed-out step keeps running in the background
+    and its result is discarded.
+    """
+    try:
+        return future.result(timeout=timeout)
+    except FutureTimeoutError:
+        logger.warning("%s timed out after %ss, using fallback", step or "step", timeout)
+        metrics.inc("csc_fallbacks_total", step=step or "step", reason="timeout")
+    except Exception as e:
+        logger.exception("%s failed, using fallback: %s", step or "step", e)
+        metrics.inc("csc_fallbacks_total", step=step or "step", reason="error")
+    return default
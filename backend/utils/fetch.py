@@ -1,36 +1,94 @@
 import os
 import json
-from qdrant_client import QdrantClient
-from fastapi.responses import JSONResponse
+import uuid
+from typing import Optional
+from qdrant_client import models
+from services.clients import qdrant_client
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 QDRANT_URL = os.getenv("QDRANT_URL")
 QDRANT_API_KEY = os.getenv("QDRANT_API_KEY")
 QDRANT_COLLECTION_2 = os.getenv("QDRANT_COLLECTION_2")
 
-def fetch_tickets(limit=30):
+TICKET_FIELDS = ["id", "subject", "body", "priority", "topics", "keywords", "sentiment", "created_at"]
+# payload fields that can be filtered on, comma separated values match any of them
+FILTER_FIELDS = ["priority", "topics", "sentiment"]
+
+# the shared client, one connection pool for every request
+client = qdrant_client
+
+
+def build_ticket_filter(filters: Optional[dict]) -> Optional[models.Filter]:
     """
-    Fetches ticket points from the Qdrant collection QDRANT_COLLECTION_2 (Bulk_Tickets-2)
-    Returns results to frontend"""
-    client = QdrantClient(url=QDRANT_URL, api_key=QDRANT_API_KEY)
+    Qdrant filter from {"priority": [...], "topics": [...], "sentiment": [...], "created_from": datetime, "created_to": datetime}.
+    """
+    if not filters:
+        return None
+    must = []
+    for field in FILTER_FIELDS:
+        values = filters.get(field)
+        if values:
+            must.append(models.FieldCondition(key=field, match=models.MatchAny(any=list(values))))
+    if filters.get("created_from") or filters.get("created_to"):
+        must.append(models.FieldCondition(
+            key="created_at",
+            range=models.DatetimeRange(gte=filters.get("created_from"), lte=filters.get("created_to"))
+        ))
+    return models.Filter(must=must) if must else None
+
+
+def encode_offset(offset) -> Optional[str]:
+    return None if offset is None else json.dumps(str(offset) if isinstance(offset, uuid.UUID) else offset)
+
+
+def decode_offset(raw: Optional[str]):
+    """
+    Turns the next_page_offset cursor sent back by the client into a point ID (int or UUID string).
+    Raises ValueError when it is neither.
+    """
+    if not raw:
+        return None
+    try:
+        value = json.loads(raw)
+    except ValueError:
+        value = raw
+    if isinstance(value, int) and not isinstance(value, bool) and value >= 0:
+        return value
+    if isinstance(value, str):
+        return str(uuid.UUID(value))
+    raise ValueError(f"Invalid offset: {raw!r}")
+
+
+def fetch_tickets_page(limit=30, offset=None, filters: Optional[dict] = None, fields: Optional[list] = None) -> dict:
+    """
+    Fetches one page of ticket points from QDRANT_COLLECTION_2 (Bulk_Tickets-2).
+    - offset: the next_page_offset of the previous page, None for the first page
+    - filters: see build_ticket_filter, served by the payload indexes from ensure_ticket_payload_indexes
+    - fields: payload fields to return (e.g. leave out "body" for list views), all fields by default
+    Returns {"tickets": [...], "next_page_offset": cursor or None on the last page}
+    """
+    fields = [f for f in (fields or TICKET_FIELDS) if f in TICKET_FIELDS]
+    if "id" not in fields:
+        fields.insert(0, "id")
 
-    points, _ = client.scroll(
+    points, next_offset = client.scroll(
         collection_name=QDRANT_COLLECTION_2,
+        scroll_filter=build_ticket_filter(filters),
         limit=limit,
-        with_payload=True
+        offset=offset,
+        with_payload=fields,
+        with_vectors=False
     )
 
     results = []
     for p in points:
         payload = p.payload or {}
-        results.append({
-            "id": payload.get("id", ""),
-            "subject": payload.get("subject", ""),
-            "body": payload.get("body", ""),
-            "priority": payload.get("priority", ""),
-            "topics": payload.get("topics", ""),
-            "keywords": payload.get("keywords", ""),
-            "sentiment": payload.get("sentiment", ""),
-            "created_at": payload.get("created_at", "")
-        })
-
-    return results
+        results.append({field: payload.get(field, "") for field in fields})
+
+    return {"tickets": results, "next_page_offset": encode_offset(next_offset)}
+
+
+def fetch_tickets(limit=30):
+    """
+    Fetches ticket points from the Qdrant collection QDRANT_COLLECTION_2 (Bulk_Tickets-2)
+    Returns results to frontend"""
+    return fetch_tickets_page(limit)["tickets"]
@@ -0,0 +1,47 @@
+import os
+import random
+import logging
+from dotenv import load_dotenv
+load_dotenv()
+
+# level of the application loggers, e.g. DEBUG to see every pushed point and raw LLM output
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# fraction of hot-path DEBUG/INFO messages (one per request or per ticket) that are written, warnings and errors always are
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", 1.0))
+
+_configured = []
+
+
+def _configure():
+    if _configured:
+        return
+    _configured.append(True)
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s [%(name)s] %(message)s"))
+    root = logging.getLogger("csc")
+    root.addHandler(handler)
+    root.setLevel(LOG_LEVEL)
+    root.propagate = False
+
+
+class SampledLogger(logging.LoggerAdapter):
+    """
+    Logger for per-request messages: below WARNING only LOG_SAMPLE_RATE of the messages are written.
+    """
+
+    def log(self, level, msg, *args, **kwargs):
+        if level < logging.WARNING and LOG_SAMPLE_RATE < 1 and random.random() >= LOG_SAMPLE_RATE:
+            return
+        super().log(level, msg, *args, **kwargs)
+
+    def process(self, msg, kwargs):
+        return msg, kwargs
+
+
+def get_logger(name: str, sampled: bool = False):
+    """
+    Logger "csc.<name>" configured from LOG_LEVEL; sampled=True for hot-path loggers (see SampledLogger).
+    """
+    _configure()
+    logger = logging.getLogger(f"csc.{name}")
+    return SampledLogger(logger, {}) if sampled else logger
@@ -0,0 +1,169 @@
+import time
+import threading
+import functools
+from contextlib import contextmanager
+from typing import Callable, Dict, Tuple
+
+# upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _label_key(labels: dict) -> Tuple:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(key: Tuple, extra: Tuple = ()) -> str:
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (f'{k}="{_escape(v)}"' for k, v in pairs)
+    return "{" + ",".join(escaped) + "}"
+
+
+class _Histogram:
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+
+class MetricsRegistry:
+    """
+    In-process counters, histograms and gauges rendered in the Prometheus text format.
+    Metrics are per process: with several gunicorn workers each one reports its own, scrape them
+    per worker or sum them in Prometheus.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._help: Dict[str, Tuple[str, str]] = {}
+        self._counters: Dict[str, Dict[Tuple, float]] = {}
+        self._histograms: Dict[str, Dict[Tuple, _Histogram]] = {}
+        self._collectors: Dict[str, Tuple[str, Callable]] = {}
+
+    def describe(self, name: str, kind: str, help_text: str):
+        self._help.setdefault(name, (kind, help_text))
+
+    def inc(self, name: str, value: float = 1, **labels):
+        self.describe(name, "counter", name.replace("_", " "))
+        key = _label_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, value: float, buckets: Tuple[float, ...] = LATENCY_BUCKETS, **labels):
+        self.describe(name, "histogram", name.replace("_", " "))
+        key = _label_key(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = _Histogram(buckets)
+            histogram.observe(value)
+
+    def register_gauge(self, name: str, help_text: str, collect: Callable):
+        """
+        collect() is called on every scrape and returns a number, or a list of (labels dict, number).
+        """
+        self._collectors[name] = (help_text, collect)
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            counters = {name: dict(series) for name, series in self._counters.items()}
+            histograms = {
+                name: {key: (h.buckets, list(h.counts), h.count, h.sum) for key, h in series.items()}
+                for name, series in self._histograms.items()
+            }
+
+        for name, series in sorted(counters.items()):
+            lines += [f"# HELP {name} {self._help[name][1]}", f"# TYPE {name} counter"]
+            lines += [f"{name}{_format_labels(key)} {value}" for key, value in sorted(series.items())]
+
+        for name, series in sorted(histograms.items()):
+            lines += [f"# HELP {name} {self._help[name][1]}", f"# TYPE {name} histogram"]
+            for key, (buckets, counts, count, total) in sorted(series.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(buckets, counts):
+                    cumulative += bucket_count
+                    lines.append(f"{name}_bucket{_format_labels(key, (('le', repr(bound)),))} {cumulative}")
+                lines.append(f"{name}_bucket{_format_labels(key, (('le', '+Inf'),))} {count}")
+                lines.append(f"{name}_sum{_format_labels(key)} {total}")
+                lines.append(f"{name}_count{_format_labels(key)} {count}")
+
+        for name, (help_text, collect) in sorted(self._collectors.items()):
+            try:
+                value = collect()
+            except Exception:
+                continue
+            samples = value if isinstance(value, list) else [({}, value)]
+            samples = [(labels, v) for labels, v in samples if v is not None]
+            if not samples:
+                continue
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+            lines += [f"{name}{_format_labels(_label_key(labels))} {float(v)}" for labels, v in samples]
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+for _name, _kind, _help in [
+    ("csc_stage_duration_seconds", "histogram", "Latency of each pipeline stage"),
+    ("csc_stage_errors_total", "counter", "Exceptions raised by each pipeline stage"),
+    ("csc_http_request_duration_seconds", "histogram", "Latency of each HTTP route"),
+    ("csc_prompt_tokens", "histogram", "Locally counted prompt tokens per chat request"),
+    ("csc_openai_tokens_total", "counter", "Tokens reported by OpenAI, by kind"),
+    ("csc_llm_errors_total", "counter", "Failed chat completions"),
+    ("csc_fallbacks_total", "counter", "Request steps that timed out or failed and used their fallback"),
+    ("csc_ingest_tickets_total", "counter", "Tickets processed by the AI pipeline, by status"),
+    ("csc_ingest_labels_reused_total", "counter", "Tickets that reused the labels of a near-duplicate"),
+    ("csc_qdrant_points_rejected_total", "counter", "Points rejected by Qdrant upserts"),
+    ("csc_openai_retries_total", "counter", "OpenAI calls retried by the gateway, by reason"),
+    ("csc_openai_failures_total", "counter", "OpenAI gateway calls that failed after their retries"),
+    ("csc_openai_coalesced_total", "counter", "OpenAI calls served by an identical call already in flight"),
+]:
+    metrics.describe(_name, _kind, _help)
+
+
+@contextmanager
+def span(stage: str):
+    """
+    Times the block as stage in csc_stage_duration_seconds; exceptions are counted in
+    csc_stage_errors_total and re-raised.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException as e:
+        if not isinstance(e, GeneratorExit):
+            metrics.inc("csc_stage_errors_total", stage=stage, error=type(e).__name__)
+        raise
+    finally:
+        metrics.observe("csc_stage_duration_seconds", time.perf_counter() - started, stage=stage)
+
+
+def timed(stage: str):
+    """Decorator version of span."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def render_prometheus() -> str:
+    return metrics.render()